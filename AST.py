@@ -2,15 +2,36 @@ from tree_sitter import Parser, Language, Node
 from graphviz import Digraph
 from igraph import Graph
 import pickle
+import json
 import os
 import re
 import time
-from typing import Callable, Literal, Dict, List, Any, Tuple, Union
+import threading
+from typing import Callable, Literal, Dict, List, Any, Tuple, Union, Optional, Iterable, Iterator, Set
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
 import tree_sitter
 
-text = lambda node: node.text.decode('utf-8')
+def text(node: Node, source: Optional['SourceBuffer'] = None) -> str:
+    '''节点的文本，给定source时从共享的源码缓冲区中解码，否则由tree-sitter复制出bytes再解码'''
+    return source.text(node) if source is not None else node.text.decode('utf-8')
+
 constant_type = ['number_literal', 'string_literal', 'character_literal', 'preproc_arg', 'true', 'false', 'null']   # 常量类型
 
+# tree-sitter的S表达式查询，每种语言只编译一次，匹配在C运行时中完成
+# 函数定义，函数名在function_declarator的declarator中，返回指针的函数外面还包有pointer_declarator
+FUNCTION_PATTERN = '''
+(function_definition) @function
+(function_definition declarator: (function_declarator declarator: (_) @name))
+(function_definition declarator: (pointer_declarator declarator: (function_declarator declarator: (_) @name)))
+(function_definition declarator: (pointer_declarator declarator: (pointer_declarator declarator: (function_declarator declarator: (_) @name))))
+'''
+CALL_PATTERN = '(call_expression) @call'           # 函数调用点
+RETURN_PATTERN = '(return_statement) @return'     # 返回语句
+
 def timer(func: Callable) -> Callable:
     def wrapper(*args, **kwargs):
         start = time.time()
@@ -20,136 +41,666 @@ def timer(func: Callable) -> Callable:
         return res
     return wrapper
 
+def line_starts(code: bytes) -> List[int]:
+    '''每一行起始的字节偏移'''
+    return [0] + [m.end() for m in re.finditer(b'\n', code)]
+
+class SourceBuffer:
+    '''
+    解析用的UTF-8源码只保存一份，节点文本按字节区间切出memoryview，不复制
+    需要str时才解码，短文本（标识符、运算符等）以字节区间为键放在LRU缓存中，同一个节点的文本在各个分析中反复读取时只解码一次
+    '''
+    def __init__(self, 
+        code: Union[str, bytes], 
+        cache_size: int = 4096, 
+        max_cached: int = 64
+    ) -> None:
+        self.data = code.encode('utf-8') if isinstance(code, str) else code
+        self.view = memoryview(self.data)
+        self.max_cached = max_cached      # 超过这个长度的文本（语句、函数体）不进缓存
+        view = self.view    # 缓存只引用view，不引用self，避免循环引用
+        self._decode = lru_cache(maxsize=cache_size)(lambda start, end: str(view[start:end], 'utf-8'))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, node: Node) -> memoryview:
+        return self.view[node.start_byte:node.end_byte]
+
+    def slice(self, start: int, end: int) -> memoryview:
+        return self.view[start:end]
+
+    def decode(self, start: int, end: int) -> str:
+        if end - start <= self.max_cached:
+            return self._decode(start, end)
+        return str(self.view[start:end], 'utf-8')
+
+    def text(self, node: Node) -> str:
+        return self.decode(node.start_byte, node.end_byte)
+
+class EditBuffer:
+    '''
+    批量记录对代码的插入、删除操作，最后一次性拼接生成新代码，复杂度为O(n + k)
+    所有操作的偏移都是相对于原始代码source的字节偏移，同一位置先插入再删除，同一位置的插入按照添加顺序
+    生成新代码后保留输出到输入的偏移映射，base为上一次编辑的EditBuffer，可以一直映射回最初的代码
+    '''
+    def __init__(self, 
+        code: Union[str, bytes], 
+        base: Optional['EditBuffer'] = None
+    ) -> None:
+        self.source = code.encode('utf-8') if isinstance(code, str) else code
+        self.base = base
+        self.edits: List[Tuple[int, int, int, bytes]] = []     # (start, end, seq, 插入的字符串)
+        self.output: Optional[bytes] = None
+        self._out_starts: List[int] = []    # 输出中每一段的起始偏移
+        self._in_starts: List[int] = []     # 对应输入中的起始偏移
+        self._copied: List[bool] = []       # 这一段是从输入复制的还是插入的
+        self._out_lines: Optional[List[int]] = None      # 输出中每一行的起始偏移
+        self._source_lines: Optional[List[int]] = None   # 输入中每一行的起始偏移
+
+    def insert(self, offset: int, string: Union[str, bytes]) -> None:
+        self.replace(offset, offset, string)
+
+    def delete(self, start: int, end: int) -> None:
+        self.replace(start, end, b'')
+
+    def replace(self, start: int, end: int, string: Union[str, bytes]) -> None:
+        if isinstance(string, str):
+            string = string.encode('utf-8')
+        self.edits.append((start, end, len(self.edits), string))
+        self.output = None
+        self._out_lines = None
+
+    def add(self, op: Tuple[int, Union[int, str]]) -> None:
+        '''replace_from_code的操作格式，(index, str)在index处插入，(index, int)删除index往左的元素'''
+        if type(op[1]) is int:
+            if op[1] < 0:      # 从op[0]往左删除-op[1]个元素
+                self.delete(op[0] + op[1], op[0])
+            else:       # 从op[0]往左删除到op[1]
+                self.delete(op[1], op[0])
+        else:
+            self.insert(op[0], op[1])
+
+    def materialize(self) -> bytes:
+        '''按照位置应用所有操作，被前面的删除覆盖的操作会被忽略'''
+        if self.output is not None:
+            return self.output
+        pieces: List[bytes] = []
+        self._out_starts, self._in_starts, self._copied = [], [], []
+        out_pos, prev = 0, 0
+        for start, end, _, string in sorted(self.edits):
+            if start < prev:    # 落在已经删除的区域里
+                continue
+            if start > prev:
+                pieces.append(self.source[prev:start])
+                self._out_starts.append(out_pos); self._in_starts.append(prev); self._copied.append(True)
+                out_pos += start - prev
+            if string:
+                pieces.append(string)
+                self._out_starts.append(out_pos); self._in_starts.append(start); self._copied.append(False)
+                out_pos += len(string)
+            prev = end
+        pieces.append(self.source[prev:])
+        self._out_starts.append(out_pos); self._in_starts.append(prev); self._copied.append(True)
+        self.output = b''.join(pieces)
+        return self.output
+
+    def __str__(self) -> str:
+        return self.materialize().decode('utf-8', errors='ignore')
+
+    def to_source(self, offset: int) -> int:
+        '''将输出中的字节偏移映射回最初代码中的字节偏移，插入的内容映射到插入的位置'''
+        self.materialize()
+        i = bisect_right(self._out_starts, offset) - 1
+        if self._copied[i]:
+            offset = self._in_starts[i] + offset - self._out_starts[i]
+        else:
+            offset = self._in_starts[i]
+        return self.base.to_source(offset) if self.base else offset
+
+    def source_line(self, line: int) -> int:
+        '''将输出中的行号（从1开始）映射回最初代码中的行号'''
+        output = self.materialize()
+        if self._out_lines is None:
+            self._out_lines = line_starts(output)
+        origin = self.origin
+        if origin._source_lines is None:
+            origin._source_lines = line_starts(origin.source)
+        return bisect_right(origin._source_lines, self.to_source(self._out_lines[line - 1]))
+
+    @property
+    def origin(self) -> 'EditBuffer':
+        return self.base.origin if self.base else self
+
 def replace_from_code(
     operation: List[Tuple[int, Union[int, str]]], 
     code: str
 ) -> str:
-    code = code.encode('utf-8')
-    diff = 0        # 插入删除产生的长度差
-    # 按照第一个元素，及修改的位置从小到大排序，如果有同一个位置删除和插入，先删除再插入
-    operation = sorted(operation, key=lambda x: (x[0], 1 if type(x[1]) is int else 0, -len(x[1]) if type(x[1]) is not int else 0)) # 第一个key是index，第二个key是先做删除操作，第三个key是先插入字符串少的
-    for op in operation:
-        if type(op[1]) is int:  # 如果第二个元素是一个数字
-            if op[1] < 0:      # 如果小于0，则从op[0]往左删除op[1]个元素
-                del_num = op[1]
-            else:       # 则从op[0]往左删除到op[1]个元素
-                del_num = op[1] - op[0]
-            code = code[:op[0] + diff + del_num] + code[op[0] + diff:]
-            diff += del_num
-        else:                   # 如果第二个元素是字符串，则从op[0]往右插入该字符串，diff+=len(op[1])
-            code = code[:op[0] + diff] + op[1].encode('utf-8') + code[op[0] + diff:]
-            diff += len(op[1])
+    buffer = EditBuffer(code)
+    # 按照第一个元素，及修改的位置从小到大排序，同一个位置插入多个字符串时，先插入长的
+    for op in sorted(operation, key=lambda x: (x[0], -len(x[1]) if type(x[1]) is not int else 0)):
+        buffer.add(op)
     operation.clear()
-    return code.decode('utf-8', errors='ignore')
-
-def define_replace(
-    body: str, 
-    *params: List[str]
-) -> Callable[[List[str]], str]:  # 宏替换，输入宏的定义和参数，返回一个函数，输入参数返回替换后的字符串
-    if not len(*params):    # 简单的变量名替换
-        def func(params: List[str]):
-            return body
-    else:   # 如果是带有参数的宏
-        ori_body = body.replace('{', '{{').replace('}', '}}')   # 删除所有的{}，因为format函数会将{}替换成{0}，{1}...
-        body = ori_body
-        for i, param in enumerate(*params):
-            not_sub_word = [word for word in body.split() if '##' in word]
-            body = body.replace(f'##{param}', '{' + str(i) + '}').replace(f'{param}##', '{' + str(i) + '}')    # str##param -> strparam , param##str -> paramstr
-            body = body.replace(f'#{param}', f'"{param}"').replace(f'#@{param}', f"'{param}'")  # #param -> "param" , #@param -> 'param'
-            for subword in ori_body.split():    # param -> {i}
-                if param in subword and subword not in not_sub_word:
-                    new_subword = subword.replace(param, '{' + str(i) + '}')
-                    body = body.replace(subword, new_subword)
-        def func(params: List[str]):
-            params = [param.strip() for param in params]
-            return body.format(*params).replace('{{', '{').replace('}}', '}'.replace('""', ''))
-    return func
+    return str(buffer)
+
+_languages: Dict[str, Language] = {}   # 每种语言只加载一次Language
+_language_lock = threading.Lock()
+_local = threading.local()             # 每个线程持有自己的Parser, Parser不是线程安全的
+
+def get_language(language: str) -> Language:
+    '''获取language对应的Language，进程内只编译、加载一次'''
+    if language in _languages:
+        return _languages[language]
+    with _language_lock:
+        if language not in _languages:
+            if not os.path.exists(f'./build/{language}-languages.so'):
+                if not os.path.exists(f'./tree-sitter-{language}'):
+                    os.system(f'git clone https://github.com/tree-sitter/tree-sitter-{language}')
+                Language.build_library(
+                    f'./build/{language}-languages.so',
+                    [
+                        f'./tree-sitter-{language}',
+                    ]
+                )
+            _languages[language] = Language(f'./build/{language}-languages.so', language)
+    return _languages[language]
+
+def get_parser(language: str) -> Parser:
+    '''获取当前线程中language对应的Parser，同一线程内重复使用'''
+    parsers: Dict[str, Parser] = _local.__dict__.setdefault('parsers', {})
+    if language not in parsers:
+        parser = Parser()
+        parser.set_language(get_language(language))
+        parsers[language] = parser
+    return parsers[language]
+
+def parse(
+    language: str, 
+    code: Union[str, bytes], 
+    old_tree: Optional[tree_sitter.Tree] = None
+) -> tree_sitter.Tree:
+    '''使用共享的Parser解析代码，传入已经edit过的old_tree时进行增量解析'''
+    if isinstance(code, str):
+        code = bytes(code, 'utf8')
+    if old_tree is not None:
+        return get_parser(language).parse(code, old_tree)
+    return get_parser(language).parse(code)
+
+_queries: Dict[Tuple[str, str], tree_sitter.binding.Query] = {}
+
+def get_query(language: str, pattern: str) -> tree_sitter.binding.Query:
+    '''编译S表达式pattern，每种语言的每个pattern只编译一次'''
+    key = (language, pattern)
+    if key not in _queries:
+        _queries[key] = get_language(language).query(pattern)
+    return _queries[key]
+
+def walk_query(
+    root_node: Node, 
+    types: Union[Literal["all"], List[str]] = 'all', 
+    nest: bool = True
+) -> List[Node]:
+    '''使用TreeCursor迭代遍历root_node，语义与AST.query相同，没有递归深度限制'''
+    nodes: List[Node] = []
+    cursor = root_node.walk()
+    depth = 0       # 自己记录深度，不能让cursor走到root_node的兄弟节点上
+    while True:
+        node = cursor.node if depth else root_node     # 从别名节点开始的cursor会丢失别名，例如field_identifier
+        matched = types == 'all' or node.type in types
+        if matched:
+            nodes.append(node)
+        if not (matched and not nest) and cursor.goto_first_child():
+            depth += 1
+            continue
+        while depth == 0 or not cursor.goto_next_sibling():
+            if depth == 0:
+                return nodes
+            cursor.goto_parent()
+            depth -= 1
+
+class NodeIndex:
+    '''
+    对一棵语法树做一次TreeCursor迭代遍历，建立节点类型索引
+    nodes为先序遍历的所有节点，任意节点的子树在nodes中是连续的区间[order, end)，
+    每一种类型的节点按照先序（即字节偏移）排好序，因此每个函数的节点都落在各类型列表的一段连续区间内，
+    查询某个函数（或任意子树）内的某类节点只需要二分查找，不需要重新遍历
+    '''
+    def __init__(self, root_node: Node):
+        self.root_node = root_node
+        self.nodes: List[Node] = []             # 先序遍历的所有节点
+        self.end: List[int] = []                # 每个节点的子树在nodes中的结束位置（不包含）
+        self.order: Dict[int, int] = {}         # node.id -> 在nodes中的位置
+        self.types: Dict[str, List[int]] = {}   # 节点类型 -> 该类型节点在nodes中的位置，升序
+        parents: List[int] = []
+        cursor = root_node.walk()
+        while True:
+            node = cursor.node
+            i = len(self.nodes)
+            self.nodes.append(node)
+            self.end.append(i + 1)
+            self.order[node.id] = i
+            self.types.setdefault(node.type, []).append(i)
+            if cursor.goto_first_child():
+                parents.append(i)
+                continue
+            while not parents or not cursor.goto_next_sibling():
+                if not parents:     # 回到了根节点，遍历结束
+                    return
+                cursor.goto_parent()
+                self.end[parents.pop()] = len(self.nodes)
+
+    def contains(self, node: Node) -> bool:
+        i = self.order.get(node.id)
+        return i is not None and self.nodes[i] == node
+
+    def query(self, 
+        root_node: Node, 
+        types: Union[Literal["all"], List[str]] = 'all', 
+        nest: bool = True
+    ) -> List[Node]:
+        start = self.order[root_node.id]
+        stop = self.end[start]
+        if types == 'all':
+            return self.nodes[start:stop] if nest else [root_node]
+        positions = []
+        for type in dict.fromkeys(types):
+            type_positions = self.types.get(type, [])
+            lo = bisect_left(type_positions, start)
+            hi = bisect_left(type_positions, stop, lo)
+            if lo < hi:
+                positions.append(type_positions[lo:hi])
+        if len(positions) > 1:
+            positions = merge(*positions)
+        elif positions:
+            positions = positions[0]
+        nodes: List[Node] = []
+        skip_until = -1
+        for i in positions:
+            if i < skip_until:      # nest为False时，跳过已匹配节点的子孙
+                continue
+            nodes.append(self.nodes[i])
+            if not nest:
+                skip_until = self.end[i]
+        return nodes
+
+MACRO_TOKEN = re.compile(r'''##|#@?\s*[A-Za-z_]\w*|[A-Za-z_]\w*|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/|//[^\n]*|\s+|.''', flags=re.S)
+
+class Macro:
+    '''
+    编译好的宏定义，宏体按token切分成展开模板，模板的每一项为字符串、参数下标或者(#/#@, 参数下标)
+    展开时只需要按模板拼接实参，不需要再对宏体做字符串替换
+    '''
+    __slots__ = ('name', 'params', 'variadic', 'template')
+
+    def __init__(self, name: str, params: Optional[Tuple[str, ...]], body: str):
+        self.name = name
+        self.params = params        # 为None时是不带参数的宏
+        self.variadic = bool(params) and params[-1] == '...'
+        self.template: List[Union[str, int, Tuple[str, int]]] = []
+        index = {param: i for i, param in enumerate(params or ())}
+        if self.variadic:
+            index['__VA_ARGS__'] = len(params) - 1
+        paste = False
+        for token in MACRO_TOKEN.findall(body):
+            if token.startswith('/*') or token.startswith('//'):    # 宏体中的注释
+                token = ' '
+            if token == '##':       # a##b，去掉##两边的空白
+                if self.template and isinstance(self.template[-1], str):
+                    self.template[-1] = self.template[-1].rstrip()
+                paste = True
+                continue
+            if paste and token.isspace():
+                continue
+            paste = False
+            param = token.lstrip('#@').strip()
+            if token[0] == '#' and param in index:  # #param -> "param" , #@param -> 'param'
+                self.template.append(('#@' if token.startswith('#@') else '#', index[param]))
+            elif token in index:
+                self.template.append(index[token])
+            elif self.template and isinstance(self.template[-1], str):
+                self.template[-1] += token
+            else:
+                self.template.append(token)
+
+    def expand(self, arguments: List[str]) -> str:
+        arguments = [argument.strip() for argument in arguments]
+        if self.variadic:   # ...对应剩下的所有实参
+            arguments = arguments[:len(self.params) - 1] + [', '.join(arguments[len(self.params) - 1:])]
+        result = []
+        for part in self.template:
+            if isinstance(part, str):
+                result.append(part)
+                continue
+            if isinstance(part, int):
+                result.append(arguments[part] if part < len(arguments) else '')
+                continue
+            kind, i = part
+            argument = arguments[i] if i < len(arguments) else ''
+            result.append(f'"{argument}"' if kind == '#' else f"'{argument}'")
+        return ''.join(result).strip()
+
+@lru_cache(maxsize=65536)
+def compile_macro(name: str, params: Optional[Tuple[str, ...]], body: str) -> Macro:
+    '''同样的宏定义只编译一次'''
+    return Macro(name, params, body)
+
+class MacroTable:
+    '''
+    一份代码中的所有宏定义，按照定义的顺序编译成Macro
+    以所有宏定义的文本作为key在进程内缓存，共享同一组宏定义的文件（例如同一个子系统）只编译一次
+    '''
+    max_tables: int = 64
+    _tables: 'OrderedDict[Tuple[str, ...], MacroTable]' = OrderedDict()
+
+    def __init__(self, define_nodes: List[Node], source: Optional[SourceBuffer] = None):
+        self.macros: List[Macro] = []
+        for node in define_nodes:
+            name = text(node.child_by_field_name('name'), source)
+            value_node = node.child_by_field_name('value')
+            body = text(value_node, source) if value_node else ''   # #define FLAG 没有值
+            params = None
+            params_node = node.child_by_field_name('parameters')
+            if params_node:
+                params = tuple(text(child, source) for child in params_node.children if child.type in ['identifier', '...'])
+            self.macros.append(compile_macro(name, params, body))
+
+    @classmethod
+    def from_nodes(cls, define_nodes: List[Node], source: Optional[SourceBuffer] = None) -> 'MacroTable':
+        key = tuple(text(node, source) for node in define_nodes)
+        if key in cls._tables:
+            cls._tables.move_to_end(key)
+            return cls._tables[key]
+        table = cls(define_nodes, source)
+        cls._tables[key] = table
+        if len(cls._tables) > cls.max_tables:
+            cls._tables.popitem(last=False)
+        return table
+
+COMMENT_AND_INCLUDE = re.compile(rb'(//.*?(\n|$))|(/\*.*?\*/)|(#include.*?(\n|$))', flags=re.S)
+
+def comment_and_include_edits(code: Union[str, bytes]) -> EditBuffer:
+    '''从左往右扫描一遍，删除代码中的注释和#include，单行注释替换成换行'''
+    buffer = EditBuffer(code)
+    for m in COMMENT_AND_INCLUDE.finditer(buffer.source):
+        buffer.replace(m.start(), m.end(), b'\n' if m.group(1) else b'')
+    return buffer
 
 def remove_comments_and_include(code: str) -> str:
     '''删除代码中的注释和#include'''
-    code = re.sub(r'//.*?(\n|$)', '\n', code)   # 删除单行注释
-    code = re.sub(r'/\*.*?\*/', '', code, flags=re.S)  # 删除多行注释 /* Skip blocks */
-    code = re.sub(r'#include.*?(\n|$)', '', code)  # 删除#include
-    return code
+    return str(comment_and_include_edits(code))
+
+# 列式存储的AST，每个节点一行，节点的文本为原始代码中的字节区间
+AST_DTYPE = np.dtype([
+    ('type', np.uint16),            # 节点类型在types.npy中的下标
+    ('parent', np.int32),           # 父节点下标，根节点为-1
+    ('first_child', np.int32),      # 第一个子节点下标，没有为-1
+    ('next_sibling', np.int32),     # 下一个兄弟节点下标，没有为-1
+    ('start_byte', np.uint32),
+    ('end_byte', np.uint32),
+    ('line', np.int32),             # 起始行号，从1开始
+])
+
+class ArrayAST:
+    '''
+    AST.save_arrays保存的列式AST，使用np.load(mmap_mode='r')打开，不需要反序列化，
+    节点按照先序遍历排列，下标0为根节点
+    '''
+    def __init__(self, dirpath: str):
+        self.nodes: np.ndarray = np.load(os.path.join(dirpath, 'nodes.npy'), mmap_mode='r')
+        self.source: np.ndarray = np.load(os.path.join(dirpath, 'source.npy'), mmap_mode='r')
+        self.types: List[str] = np.load(os.path.join(dirpath, 'types.npy')).tolist()   # 类型id -> 节点类型
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def type(self, i: int) -> str:
+        return self.types[self.nodes['type'][i]]
+
+    def text(self, i: int) -> str:
+        node = self.nodes[i]
+        return self.source[node['start_byte']:node['end_byte']].tobytes().decode('utf-8', errors='ignore')
+
+    def children(self, i: int) -> List[int]:
+        children = []
+        child = self.nodes['first_child'][i]
+        while child != -1:
+            children.append(int(child))
+            child = self.nodes['next_sibling'][child]
+        return children
+
+    def query(self, types: Union[str, List[str]]) -> np.ndarray:
+        '''返回指定类型的所有节点下标，按先序排列'''
+        if not isinstance(types, list):
+            types = [types]
+        ids = [i for i, type in enumerate(self.types) if type in types]
+        return np.flatnonzero(np.isin(self.nodes['type'], ids))
+
+class Vocabulary:
+    '''
+    token到id的映射，id 0保留给未登录词<unk>
+    frozen为False时遇到新token自动分配id，可以用save/load在多次数据集任务之间保持一致
+    '''
+    UNK = '<unk>'
+
+    def __init__(self, tokens: Iterable[str] = (), frozen: bool = False):
+        self.ids: Dict[str, int] = {self.UNK: 0}
+        self.tokens: List[str] = [self.UNK]
+        self.frozen = False
+        for token in tokens:
+            self[token]
+        self.frozen = frozen
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, token: str) -> int:
+        id = self.ids.get(token)
+        if id is None:
+            if self.frozen:
+                return 0
+            id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return id
+
+    def encode(self, tokens: Iterable[str]) -> np.ndarray:
+        '''将token流直接编码成int32数组，不生成中间的列表'''
+        return np.fromiter((self[token] for token in tokens), dtype=np.int32)
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        return [self.tokens[id] for id in ids]
+
+    def save(self, path: str) -> None:
+        # 用json保存token列表（不含<unk>），token中的换行等字符原样保留
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.tokens[1:], f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, frozen: bool = False) -> 'Vocabulary':
+        # 空文件对应空词表
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        return cls(json.loads(text) if text.strip() else [], frozen=frozen)
 
 class AST:
-    functions: Dict[str, Node] = {}
+    functions: Dict[str, Node]
     code: str
     language: Literal["c"]
     parser: tree_sitter.Parser
+    tree: tree_sitter.Tree
     root_node: Node
     func_num: int
+    source: SourceBuffer
+    _index: Optional[NodeIndex] = None
+    _function_ranges: Optional[Dict[Tuple[int, int], Node]] = None
+    edits: Optional[EditBuffer] = None
+    def_uses: Optional[Any] = None      # DDG.def_use_cache建立的def/use摘要缓存，和这次解析的语法树一起释放
 
     def __init__(self, 
         language: Literal['c'], 
-        code: str
+        code: str, 
+        old_tree: Optional[tree_sitter.Tree] = None
     ) -> None:
         self.language = language
-        if not os.path.exists(f'./build/{language}-languages.so'):
-            if not os.path.exists(f'./tree-sitter-{language}'):
-                os.system(f'git clone https://github.com/tree-sitter/tree-sitter-{language}')
-            Language.build_library(
-                f'./build/{language}-languages.so',
-                [
-                    f'./tree-sitter-{language}',
-                ]
-            )
-        LANGUAGE = Language(f'./build/{language}-languages.so', language)
-        parser = Parser()
-        parser.set_language(LANGUAGE)
-        self.parser = parser
+        self.parser = get_parser(language)      # 所有AST共享同一个Language，同一线程共享同一个Parser
         # self.preprocess_code(code)
         self.code = code
-        self.root_node = self.parser.parse(bytes(code, 'utf8')).root_node
-        function_nodes = self.query(self.root_node, types='function_definition', nest=False)
+        self.tree = parse(self.language, code, old_tree)
+        self.source = SourceBuffer(self.tree.text)
+        self.root_node = self.tree.root_node
+        self.function_nodes: List[Node] = []
+        names: Dict[int, str] = {}
+        for node, capture in self.match(FUNCTION_PATTERN):
+            if capture == 'function':
+                if not self.function_nodes or node.start_byte >= self.function_nodes[-1].end_byte:  # 不考虑嵌套的函数定义
+                    self.function_nodes.append(node)
+            else:
+                func_node = node.parent.parent
+                while func_node.type == 'pointer_declarator':
+                    func_node = func_node.parent
+                names[func_node.id] = self.text(node)
         self.functions = {}
-        for node in function_nodes:
-            funcnode = self.query(node, types='function_declarator', nest=False)[0]
-            funcname = text(funcnode.child_by_field_name('declarator'))
+        for node in self.function_nodes:
+            if node.id in names:
+                funcname = names[node.id]
+            else:   # 其他形式的声明符，取第一个function_declarator
+                funcnode = self.query(node, types='function_declarator', nest=False)[0]
+                funcname = self.text(funcnode.child_by_field_name('declarator'))
             self.functions[funcname] = node
         self.func_num = len(self.functions)
 
-    def preprocess_code(self, code: str) -> str:
-        '''预处理代码，去掉注释，替换宏定义等'''
-        operation: List[Tuple[int, Union[int, str]]] = []
-        code = remove_comments_and_include(code)
-        root_node = self.parser.parse(bytes(code, 'utf8')).root_node
-        define_nodes = self.query(root_node, types=['preproc_def', 'preproc_function_def'], nest=False)
+    def preprocess_code(self, 
+        code: str, 
+        save_path: str = ''
+    ) -> str:
+        '''
+        预处理代码，去掉注释和#include，展开宏定义
+        只解析一次原始代码，注释节点、#include节点和宏的使用在同一次遍历中写入EditBuffer
+        self.edits记录预处理后的代码到原始代码的映射，save_path不为空时保存预处理后的代码
+        '''
+        tree = parse(self.language, code)
+        source = SourceBuffer(tree.text)
+        root_node = tree.root_node
+        define_nodes = walk_query(root_node, types=['preproc_def', 'preproc_function_def'], nest=False)
         # 宏定义的替换参考文章https://zhuanlan.zhihu.com/p/367761694
-        defines: Dict[str, str] = {}
-        define_line: Dict[str, int] = {}
-        for node in define_nodes:
-            name = text(node.child_by_field_name('name'))
-            value = text(node.child_by_field_name('value'))
-            params_node = self.query(node, types='identifier', nest=False)[1:]
-            params = [text(p) for p in params_node]
-            defines[name] = define_replace(value, params)
-            define_line[name] = node.start_point[0]
-        # 找出来所有的宏定义以后，遍历所有变量名节点，将宏定义替换成对应的字符串
-        identifier_nodes = self.query(root_node, types='identifier', nest=False)
-        for node in identifier_nodes:
-            name = text(node)
-            if name in defines and node.start_point[0] > define_line[name] and node.parent.type != 'call_expression':
-                operation.append((node.end_byte, node.start_byte))
-                operation.append((node.start_byte, defines[name]([])))
-        code = replace_from_code(operation, code)
-        operation.clear()
-        root_node = self.parser.parse(bytes(code, 'utf8')).root_node
-        # 遍历所有函数调用节点，将宏定义替换成对应的字符串
-        call_nodes = self.query(root_node, types='call_expression', nest=True)
-        for node in call_nodes:
-            name = text(node.child_by_field_name('function'))
-            arguments = text(node.child_by_field_name('arguments'))[1:-1].split(',')
-            if name in defines and node.start_point[0] > define_line[name]:
-                operation.append((node.end_byte, node.start_byte))
-                operation.append((node.start_byte, defines[name](arguments)))
-        self.code = replace_from_code(operation, code)
-        self.root_node = self.parser.parse(bytes(self.code, 'utf8')).root_node
-        with open('preprocess.c', 'w') as f:
-            f.write(self.code)
+        table = MacroTable.from_nodes(define_nodes, source)
+        defines: Dict[str, List[Tuple[int, Macro]]] = {}    # 宏名 -> [(定义结束的位置, 宏)]，只有定义之后的使用才展开
+        for node, macro in zip(define_nodes, table.macros):
+            defines.setdefault(macro.name, []).append((node.end_byte, macro))
+        nodes = walk_query(root_node, types=['comment', 'preproc_include', 'identifier', 'call_expression'], nest=True)
+        buffer = EditBuffer(source.data)
+        self.expand_macros(buffer, 0, nodes, 0, len(buffer.source), defines, source)
+        self.edits = buffer
+        self.code = str(buffer)
+        self.tree = parse(self.language, buffer.materialize())
+        self.source = SourceBuffer(self.tree.text)
+        self.root_node = self.tree.root_node
+        if save_path:
+            with open(save_path, 'w') as f:
+                f.write(self.code)
+        return self.code
+
+    def expand_macros(self, 
+        buffer: EditBuffer, 
+        base: int, 
+        nodes: List[Node], 
+        i: int, 
+        end: int, 
+        defines: Dict[str, List[Tuple[int, Macro]]], 
+        source: SourceBuffer
+    ) -> int:
+        '''
+        将nodes[i:]中起始位置在end之前的节点的替换写入buffer，base为buffer在原始代码中的起始偏移，返回下一个未处理的节点下标
+        宏函数的实参先在各自的EditBuffer中展开，再代入宏函数，所以每个节点只会被处理一次
+        '''
+        def find(name: str, position: int) -> Optional[Macro]:
+            for define_end, macro in reversed(defines.get(name, [])):
+                if define_end <= position:
+                    return macro
+            return None
+        while i < len(nodes) and nodes[i].start_byte < end:
+            node = nodes[i]
+            replacement = None
+            i += 1
+            if node.type in ['comment', 'preproc_include']:
+                replacement = ''
+            elif node.type == 'identifier' and not node.parent.type.startswith('preproc'):
+                macro = find(source.text(node), node.start_byte)
+                if macro and macro.params is None:
+                    replacement = macro.expand([])
+            elif node.type == 'call_expression':
+                function = node.child_by_field_name('function')
+                macro = find(source.text(function), node.start_byte) if function.type == 'identifier' else None
+                if macro and macro.params is not None:
+                    arguments = []
+                    for argument in node.child_by_field_name('arguments').named_children:
+                        if argument.type == 'comment':
+                            continue
+                        argument_buffer = EditBuffer(bytes(source[argument]))
+                        while i < len(nodes) and nodes[i].start_byte < argument.start_byte:
+                            i += 1
+                        i = self.expand_macros(argument_buffer, argument.start_byte, nodes, i, argument.end_byte, defines, source)
+                        arguments.append(str(argument_buffer))
+                    replacement = macro.expand(arguments)
+            if replacement is not None:
+                buffer.replace(node.start_byte - base, node.end_byte - base, replacement)
+                while i < len(nodes) and nodes[i].start_byte < node.end_byte:     # 跳过被替换节点的子孙
+                    i += 1
+        return i
+
+    def text(self, node: Node) -> str:
+        '''节点的文本，从self.source中解码'''
+        return self.source.text(node)
+
+    def close(self) -> None:
+        '''
+        释放语法树、索引和所有分析结果，每个对象只对应一份代码，处理完之后调用close或者使用with语句
+        close之后这个对象不能再使用
+        '''
+        self.functions = {}
+        self.function_nodes = []
+        self._index = None
+        self._function_ranges = None
+        self.edits = None
+        self.def_uses = None
+        self.root_node = None
+        self.tree = None
+        self.source = None
+
+    def __enter__(self) -> 'AST':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def function_at(self, start_byte: int, end_byte: int) -> Node:
+        '''按字节区间找到函数定义节点，Node不能跨进程传递，其他进程重新解析代码后用它定位同一个函数'''
+        if self._function_ranges is None:
+            self._function_ranges = {(node.start_byte, node.end_byte): node for node in self.function_nodes}
+        return self._function_ranges[(start_byte, end_byte)]
+
+    def source_line(self, line: int) -> int:
+        '''将预处理后代码的行号（例如CFG、PDG节点的line）映射回原始代码的行号'''
+        return self.edits.source_line(line) if self.edits else line
 
     def properties(self, node: Node) -> Dict[str, Any]:
-        return {'type': node.type, 'start_byte': node.start_byte, 'end_byte': node.end_byte, 'start_point': node.start_point, 'end_point': node.end_point, 'text': text(node), 'id': str(node.id), 'line': node.start_point[0] + 1}
+        return {'type': node.type, 'start_byte': node.start_byte, 'end_byte': node.end_byte, 'start_point': node.start_point, 'end_point': node.end_point, 'text': self.text(node), 'id': str(node.id), 'line': node.start_point[0] + 1}
+
+    @property
+    def index(self) -> NodeIndex:
+        '''root_node对应的节点类型索引，每次重新解析后在第一次查询时重新建立'''
+        if self._index is None or self._index.root_node != self.root_node:
+            self._index = NodeIndex(self.root_node)
+        return self._index
+
+    def match(self, 
+        pattern: str, 
+        root_node: Optional[Node] = None
+    ) -> List[Tuple[Node, str]]:
+        '''
+        使用tree-sitter的S表达式pattern匹配root_node的子树，root_node默认为整棵树
+        返回(节点, capture名)的列表，按照节点在代码中的位置排序
+        '''
+        return get_query(self.language, pattern).captures(root_node or self.root_node)
 
     def query(self, 
         root_node: Node, 
@@ -160,21 +711,15 @@ class AST:
         遍历根节点root_node
         如果types为all，则返回所有节点，否则返回指定类型的节点
         nest为False时，匹配到的第一个节点时就不往下遍历了，否则还要递归遍历所有子节点
+        root_node属于self.root_node时直接查索引，否则迭代遍历root_node
         '''
         if not root_node:
             return []
-        nodes: List[Node] = []
         if types != 'all' and not isinstance(types, list):
             types = [types]
-        def help(node):
-            if types == 'all' or node.type in types:
-                nodes.append(node)
-                if not nest:
-                    return 
-            for child in node.children:
-                help(child)
-        help(root_node)
-        return nodes
+        if getattr(self, 'root_node', None) is not None and self.index.contains(root_node):
+            return self.index.query(root_node, types, nest)
+        return walk_query(root_node, types, nest)
 
     def build_tree(self, 
         save: bool = False, 
@@ -192,6 +737,37 @@ class AST:
         if save:
             pickle.dump(self.ast, open(f'{filepath}.pkl', 'wb'))
 
+    def save_arrays(self, dirpath: str) -> None:
+        '''
+        将AST保存为dirpath下的NumPy数组，nodes.npy为AST_DTYPE的节点表，source.npy为原始代码的字节，types.npy为类型id到类型的映射
+        使用ArrayAST(dirpath)以内存映射的方式打开
+        '''
+        index = self.index
+        n = len(index.nodes)
+        nodes = np.empty(n, dtype=AST_DTYPE)
+        end = np.asarray(index.end, dtype=np.int32)
+        parent = np.full(n, -1, dtype=np.int32)
+        stack: List[int] = []
+        type_ids: Dict[str, int] = {}
+        for i, node in enumerate(index.nodes):
+            while stack and end[stack[-1]] <= i:
+                stack.pop()
+            if stack:
+                parent[i] = stack[-1]
+            stack.append(i)
+            type_id = type_ids.setdefault(node.type, len(type_ids))
+            nodes[i] = (type_id, parent[i], -1, -1, node.start_byte, node.end_byte, node.start_point[0] + 1)
+        positions = np.arange(n, dtype=np.int32)
+        has_child = end > positions + 1
+        nodes['first_child'][has_child] = positions[has_child] + 1
+        parent_end = np.where(parent >= 0, end[parent], 0)
+        has_sibling = (parent >= 0) & (end < parent_end)
+        nodes['next_sibling'][has_sibling] = end[has_sibling]
+        os.makedirs(dirpath, exist_ok=True)
+        np.save(os.path.join(dirpath, 'nodes.npy'), nodes)
+        np.save(os.path.join(dirpath, 'source.npy'), np.frombuffer(self.tree.text, dtype=np.uint8))
+        np.save(os.path.join(dirpath, 'types.npy'), np.array(list(type_ids)))
+
     def see_graph(self, 
         filepath: str = 'pdf/ast', 
         pdf: bool = True, 
@@ -222,24 +798,104 @@ class AST:
 
     def tokenize(self) -> List[str]:
         '''输入代码code，返回token列表'''
-        def tokenize_help(node, tokens):
-            if not node.children:
-                tokens.append(text(node))
-                return
-            for n in node.children:
-                tokenize_help(n, tokens)
-        tokens: List[str] = []
-        tokenize_help(self.root_node, tokens)
-        return tokens
+        return list(self.iter_tokens())
+
+    def iter_tokens(self, 
+        root_node: Optional[Node] = None, 
+        normalize: bool = False, 
+        lines: Optional[Iterable[int]] = None
+    ) -> Iterator[str]:
+        '''
+        使用TreeCursor遍历root_node（默认为整棵树），依次产生叶子节点的token
+        normalize为True时，变量名按照出现顺序替换为VAR_n，数字替换为NUM，字符串和字符替换为STR，函数名、成员名和类型名保留
+        lines不为空时只产生这些行上的token，例如SLICE的结果，与这些行不相交的子树直接跳过
+        '''
+        root_node = root_node or self.root_node
+        line_list = sorted(set(lines)) if lines is not None else None
+        variables: Dict[str, str] = {}
+        cursor = root_node.walk()
+        depth = 0
+        while True:
+            node = cursor.node if depth else root_node
+            visit = True
+            if line_list is not None:   # 子树的行号范围内没有需要的行
+                i = bisect_left(line_list, node.start_point[0] + 1)
+                visit = i < len(line_list) and line_list[i] <= node.end_point[0] + 1
+            if visit and normalize and node.type in ['string_literal', 'char_literal']:
+                if line_list is None or node.start_point[0] + 1 in line_list:
+                    yield 'STR'
+                visit = False
+            if visit and cursor.goto_first_child():
+                depth += 1
+                continue
+            if visit and (line_list is None or node.start_point[0] + 1 in line_list):    # 叶子节点
+                token = self.text(node)
+                if normalize and node.type == 'identifier' and node.parent.type not in ['call_expression', 'function_declarator']:
+                    token = variables.setdefault(token, f'VAR_{len(variables)}')
+                elif normalize and node.type == 'number_literal':
+                    token = 'NUM'
+                yield token
+            while depth == 0 or not cursor.goto_next_sibling():
+                if depth == 0:
+                    return
+                cursor.goto_parent()
+                depth -= 1
+
+    def save_token_ids(self, 
+        path: str, 
+        vocab: Vocabulary, 
+        by_function: bool = False, 
+        normalize: bool = False, 
+        lines: Optional[Iterable[int]] = None
+    ) -> None:
+        '''
+        将token编码成int32数组直接写入磁盘
+        by_function为False时整份代码写入path/ids.npy
+        by_function为True时每个函数的token首尾相接写入path/ids.npy，第i个函数为ids[offsets[i]:offsets[i+1]]，函数名写入path/names.npy
+        '''
+        os.makedirs(path, exist_ok=True)
+        if not by_function:
+            np.save(os.path.join(path, 'ids.npy'), vocab.encode(self.iter_tokens(normalize=normalize, lines=lines)))
+            return
+        arrays = [vocab.encode(self.iter_tokens(func_node, normalize=normalize, lines=lines)) for func_node in self.functions.values()]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(array) for array in arrays])
+        np.save(os.path.join(path, 'ids.npy'), np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int32))
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        np.save(os.path.join(path, 'names.npy'), np.array(list(self.functions)))
 
     def check_syntax(self) -> bool:
         '''检查代码是否有语法错误'''
         error_nodes = self.query(self.root_node, types='ERROR', nest=True)
         for i, node in enumerate(error_nodes):
             print(f"error {i:<3} : line {node.start_point[0]:<3} row {node.start_point[1]:<3} ---- line {node.end_point[0]:<3} row {node.end_point[1]:<3}")
-            print(f"error code: {text(node)}")
+            print(f"error code: {self.text(node)}")
         return self.root_node.has_error
 
+def benchmark_query(ast: AST, repeat: int = 10) -> None:
+    '''对比query（遍历和索引）与match在函数发现、调用点和返回语句提取上的耗时'''
+    def with_walk():
+        for func_node in walk_query(ast.root_node, ['function_definition'], False):
+            walk_query(func_node, ['function_declarator'], False)
+            walk_query(func_node, ['call_expression'], True)
+            walk_query(func_node, ['return_statement'], True)
+    def with_index():
+        ast._index = None
+        for func_node in ast.query(ast.root_node, 'function_definition', nest=False):
+            ast.query(func_node, 'function_declarator', nest=False)
+            ast.query(func_node, 'call_expression', nest=True)
+            ast.query(func_node, 'return_statement', nest=True)
+    def with_match():
+        ast.match(FUNCTION_PATTERN)
+        for func_node in ast.functions.values():
+            ast.match(CALL_PATTERN, func_node)
+            ast.match(RETURN_PATTERN, func_node)
+    for name, func in [('walk_query', with_walk), ('query(index)', with_index), ('match', with_match)]:
+        start = time.time()
+        for _ in range(repeat):
+            func()
+        print(f'{name:<30} cost time: {(time.time() - start) / repeat * 1000:.2f}ms')
+
 if __name__ == '__main__':
     code = r'{}'.format(open('./data/CVE-2013-4483_SYSCALL-DEFINE4/CVE-2013-4483_CWE-189_SYSCALL-DEFINE4_1.c_OLD.c', 'r', encoding='utf-8').read())
     ast = AST('c', code)
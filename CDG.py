@@ -1,88 +1,201 @@
 from CFG import *
-import copy
-
-def reverse(cfg: CFG_GRAPH) -> CFG_GRAPH:
-    reverse_cfg = copy.deepcopy(cfg)
-    reverse_cfg.delete_edges(reverse_cfg.get_edgelist())
-    for edge in cfg.es:
-        source, target, label = edge.source, edge.target, edge['label']
-        reverse_cfg.add_edge(target, source, label=label)
-    exit_node = reverse_cfg.vs.find(type='function_exit')
-    func_node = reverse_cfg.vs.find(type='function_definition')
-    reverse_cfg.add_edge(exit_node, func_node, label='')  # 添加一个从Exit到函数入口的边
-    return reverse_cfg
-
-def get_subTree(cfg: CFG_GRAPH) -> CFG_GRAPH:   # 按照广度优先遍历，找出一个子树
-    exit_node = cfg.vs.find(type='function_exit')
-    visited = {v.index:False for v in cfg.vs}
-    queue = [exit_node]
-    visited[exit_node] = True
-    subTree = copy.deepcopy(cfg)
-    subTree.delete_edges(subTree.get_edgelist())
-    while queue:
-        node = queue.pop()
-        if not cfg.successors(node):
-            continue
-        for succ in cfg.successors(node):
-            if not visited[succ]:
-                queue.append(succ)
-                visited[succ] = True
-                subTree.add_edge(node, succ, label='')
-    return subTree
-
-def post_dominator_tree(cfg: CFG_GRAPH, subTree: CFG_GRAPH) -> CFG_GRAPH:  # 生成后支配树
-    PDT = copy.deepcopy(subTree)
-    changed = True
-    exit_node = cfg.vs.find(type='function_exit')
-    while changed:
-        changed = False
-        for v in cfg.vs:
-            if v['type'] == 'function_exit':
-                continue
-            for u in cfg.predecessors(v.index):
-                parent_v = PDT.predecessors(v.index)[0]
-                # 寻找这两个节点的最近公共祖先
-                v_path = PDT.get_shortest_paths(exit_node.index, parent_v)
-                u_path = PDT.get_shortest_paths(exit_node.index, u)
-                v_lines = [PDT.vs[i].index for i in v_path[0]]
-                u_lines = [PDT.vs[i].index for i in u_path[0]]
-                for a, b in zip(v_lines, u_lines):
-                    if a != b:
-                        break
-                    lca = a
-                if u != parent_v and parent_v != lca:
-                    PDT.add_edge(lca, v.index)
-                    PDT.delete_edges(PDT.get_eid(parent_v, v.index))
-                    changed = True
-    return PDT
-
-def dominance_frontier(reverse_cfg: CFG_GRAPH, PDT: CFG_GRAPH) -> CFG_GRAPH:   # 计算支配边界
-    CDG = copy.deepcopy(reverse_cfg)
-    CDG.delete_edges(CDG.get_edgelist())
-    for v in reverse_cfg.vs:
-        preds = reverse_cfg.predecessors(v)
-        if len(preds) >= 2:     # 有多个分支
+
+def reverse(cfg: CompactGraph) -> EdgeLayer:
+    # 反向CFG只有边：CFG的边反向，再加上一条从Exit到函数入口的边，顶点仍然是cfg的顶点，不复制属性
+    layer = cfg.layer('CFG')
+    sources = np.append(layer.targets, cfg.find('function_exit')).astype(np.int32)
+    targets = np.append(layer.sources(), cfg.find('function_definition')).astype(np.int32)
+    return EdgeLayer.from_arrays(cfg.vcount(), sources, targets, np.full(len(sources), -1, dtype=np.int32))
+
+def immediate_dominators(layer: EdgeLayer, root: int) -> List[int]:
+    '''用igraph的dominator（Lengauer-Tarjan）求以root为根的支配树，返回每个顶点的直接支配节点，root和从root到不了的节点为-1'''
+    graph = Graph(n=layer.vcount(), edges=np.column_stack((layer.sources(), layer.targets)), directed=True)  # 只有边结构的临时图
+    return [-1 if parent != parent or parent < 0 else int(parent) for parent in graph.dominator(root, mode='out')]
+
+def immediate_post_dominators(reverse_cfg: EdgeLayer, exit_node: int) -> List[int]:
+    '''反向CFG中以exit为根的支配树即CFG的后支配树，返回每个顶点的直接后支配节点，exit节点和到不了exit的节点为-1'''
+    return immediate_dominators(reverse_cfg, exit_node)
+
+class DominatorTree:
+    '''
+    由直接（后）支配节点数组parents建立的（后）支配树，parents中root和不在树中的节点为-1
+    先序遍历的区间[enter, leave)用于O(1)判断支配关系，欧拉序上按深度建立的稀疏表用于O(1)求最近公共（后）支配节点
+    '''
+    def __init__(self, parents: List[int], root: int):
+        n = len(parents)
+        self.parents = parents
+        self.root = root
+        self.enter = [-1] * n      # 先序遍历的序号，不在树中的节点为-1
+        self.leave = [-1] * n      # 子树中最后一个节点的序号加1
+        self.depth = [0] * n
+        self.first = [-1] * n      # 节点在欧拉序中第一次出现的位置
+        children: List[List[int]] = [[] for _ in range(n)]
+        for v, parent in enumerate(parents):
+            if parent >= 0:
+                children[parent].append(v)
+        euler = [root]
+        self.enter[root], self.first[root] = 0, 0
+        order = 1
+        stack, next_child = [root], [0]
+        while stack:
+            v = stack[-1]
+            if next_child[-1] < len(children[v]):
+                child = children[v][next_child[-1]]
+                next_child[-1] += 1
+                self.depth[child] = self.depth[v] + 1
+                self.enter[child], self.first[child] = order, len(euler)
+                order += 1
+                euler.append(child)
+                stack.append(child)
+                next_child.append(0)
+            else:
+                self.leave[v] = order
+                stack.pop()
+                next_child.pop()
+                if stack:
+                    euler.append(stack[-1])
+        self.euler = np.array(euler, dtype=np.int32)
+        depths = np.array(self.depth, dtype=np.int32)[self.euler]
+        self.table = [np.arange(len(euler), dtype=np.int32)]     # table[k][i]为欧拉序[i, i + 2^k)中最浅节点的位置
+        k = 1
+        while (1 << k) <= len(euler):
+            previous, half = self.table[-1], 1 << (k - 1)
+            left, right = previous[:-half], previous[half:]
+            self.table.append(np.where(depths[left] <= depths[right], left, right))
+            k += 1
+        self.euler_depths = depths
+
+    def __contains__(self, v: int) -> bool:
+        return self.enter[v] >= 0
+
+    def dominates(self, a: int, b: int) -> bool:
+        '''a是否（后）支配b，每个节点都（后）支配自己'''
+        return self.enter[a] >= 0 and self.enter[b] >= 0 and self.enter[a] <= self.enter[b] < self.leave[a]
+
+    def lca(self, a: int, b: int) -> int:
+        '''a和b的最近公共（后）支配节点，有一个不在树中时为-1'''
+        if self.enter[a] < 0 or self.enter[b] < 0:
+            return -1
+        left, right = sorted((self.first[a], self.first[b]))
+        k = (right - left + 1).bit_length() - 1
+        i, j = self.table[k][left], self.table[k][right - (1 << k) + 1]
+        return int(self.euler[i if self.euler_depths[i] <= self.euler_depths[j] else j])
+
+def dominance_frontier(reverse_cfg: EdgeLayer, ipdom: List[int]) -> List[Tuple[int, int]]:   # 计算支配边界，返回CDG的边
+    CDG = []
+    predecessors = reverse_cfg.reverse()    # 反向CFG的入边，即CFG的出边
+    indptr, sources = predecessors.indptr.tolist(), predecessors.targets.tolist()
+    for v in range(reverse_cfg.vcount()):
+        preds = sources[indptr[v]:indptr[v + 1]]
+        if len(preds) >= 2 and ipdom[v] >= 0:     # 有多个分支
             for runner in preds:
-                while runner != PDT.predecessors(v)[0]:
-                    CDG.add_edge(v.index, runner)
-                    runner = PDT.predecessors(runner)[0]
+                while runner >= 0 and runner != ipdom[v]:
+                    CDG.append((v, runner))
+                    runner = ipdom[runner]
     return CDG
-        
+
+def control_dependences(reverse_cfg: EdgeLayer, exit_node: int) -> List[Tuple[int, int]]:
+    return dominance_frontier(reverse_cfg, immediate_post_dominators(reverse_cfg, exit_node))
+
+def build_cdg(cfg: CompactGraph) -> CompactGraph:
+    # CDG是cfg上的一层CDG边，和cfg共用顶点
+    edges = control_dependences(reverse(cfg), cfg.find('function_exit'))
+    return cfg.overlay(['CDG'], CDG=EdgeLayer.from_edges(cfg.vcount(), edges))
+
+def benchmark_cdg(sizes: List[int] = [10, 100, 1000, 10000], repeat: int = 3) -> None:
+    '''在大约有sizes个顶点的CFG上统计build_cdg的耗时，函数由顺序语句、if和while交替组成'''
+    for size in sizes:
+        statements = ''.join(f'x = x + {i}; if (x > {i}) x--; else x++; while (x < {i}) x += 2;' for i in range(max(1, size // 6)))
+        cfg = CFG('c', f'int f(int x) {{ {statements} return x; }}')
+        graph = cfg.function_cfg('f')
+        start = time.time()
+        for _ in range(repeat):
+            cdg = build_cdg(graph)
+        print(f'{graph.vcount():>6} nodes {len(cdg.layer("CDG")):>6} CDG edges  build_cdg: {(time.time() - start) / repeat * 1000:.2f}ms')
+
+def cdg_task(task: Tuple[EdgeLayer, int]) -> List[Tuple[int, int]]:
+    # CDG只依赖反向CFG的边和exit节点，工作进程不需要解析代码
+    return control_dependences(*task)
+
 class CDG:
     def __init__(self, cfg: CFG_GRAPH):
         self.cfg = cfg
-        self.cdgs: Dict[str, CFG_GRAPH] = {}
+        self.cdgs: Dict[str, CompactGraph] = {}
+        self.dominator_trees: Dict[str, DominatorTree] = {}
+        self.post_dominator_trees: Dict[str, DominatorTree] = {}
+
+    def close(self) -> None:
+        self.cdgs = {}
+        self.dominator_trees = {}
+        self.post_dominator_trees = {}
+        self.cfg = None
+
+    def dominator_tree(self, funcname: str) -> DominatorTree:
+        '''funcname的CFG中以函数入口为根的支配树，第一次使用时建立'''
+        if funcname not in self.dominator_trees:
+            cfg = self.cfg.function_cfg(funcname)
+            entry = cfg.find('function_definition')
+            self.dominator_trees[funcname] = DominatorTree(immediate_dominators(cfg.layer('CFG'), entry), entry)
+        return self.dominator_trees[funcname]
+
+    def post_dominator_tree(self, funcname: str) -> DominatorTree:
+        '''funcname的CFG中以exit为根的后支配树，第一次使用时建立'''
+        if funcname not in self.post_dominator_trees:
+            cfg = self.cfg.function_cfg(funcname)
+            exit_node = cfg.find('function_exit')
+            self.post_dominator_trees[funcname] = DominatorTree(immediate_post_dominators(reverse(cfg), exit_node), exit_node)
+        return self.post_dominator_trees[funcname]
+
+    def statement(self, funcname: str, line: int) -> int:
+        '''funcname的CFG中第一个起始行为line的顶点，没有时为-1'''
+        vertices = self.cfg.function_cfg(funcname).select(line)
+        return vertices[0] if vertices else -1
+
+    def dominates(self, funcname: str, a: int, b: int) -> bool:
+        '''第a行的语句是否支配第b行的语句'''
+        a, b = self.statement(funcname, a), self.statement(funcname, b)
+        return a >= 0 and b >= 0 and self.dominator_tree(funcname).dominates(a, b)
+
+    def post_dominates(self, funcname: str, a: int, b: int) -> bool:
+        '''第a行的语句是否后支配第b行的语句'''
+        a, b = self.statement(funcname, a), self.statement(funcname, b)
+        return a >= 0 and b >= 0 and self.post_dominator_tree(funcname).dominates(a, b)
+
+    def common_post_dominator(self, funcname: str, lines: Iterable[int]) -> Optional[int]:
+        '''lines中所有语句的最近公共后支配语句的行号，公共后支配节点为exit或者有一行没有语句时为None'''
+        tree, cfg = self.post_dominator_tree(funcname), self.cfg.function_cfg(funcname)
+        common = None
+        for line in lines:
+            v = self.statement(funcname, line)
+            if v < 0:
+                return None
+            common = v if common is None else tree.lca(common, v)
+            if common < 0:
+                return None
+        return None if common is None else cfg.line(common)
+
+    def function_cdg(self, funcname: str) -> CompactGraph:
+        '''funcname的CDG，第一次使用时才构建这个函数的CFG和CDG'''
+        if funcname not in self.cdgs:
+            self.cdgs[funcname] = build_cdg(self.cfg.function_cfg(funcname))
+        return self.cdgs[funcname]
 
     @timer
-    def construct_cdg(self) -> None:
+    def construct_cdg(self, workers: int = 1) -> None:
         # 参考文章 https://blog.csdn.net/Dong_HFUT/article/details/121492818?spm=wolai.workspace.0.0.477036c4rNeEPV
-        for funcname, cfg in self.cfg.cfgs.items():
-            print(f'constructing CDG for {funcname:>40}', end='\r')
-            reverse_cfg = reverse(cfg)
-            subTree = get_subTree(reverse_cfg)
-            PDT = post_dominator_tree(reverse_cfg, subTree)
-            CDG = dominance_frontier(reverse_cfg, PDT)
-            self.cdgs[funcname] = CDG
+        # workers大于1时，各个函数的CFG分到多个进程中计算
+        funcnames = [funcname for funcname in self.cfg.functions if funcname not in self.cdgs]
+        if workers > 1 and len(funcnames) > 1:
+            cfgs = [self.cfg.function_cfg(funcname) for funcname in funcnames]
+            tasks = [(reverse(cfg), cfg.find('function_exit')) for cfg in cfgs]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(cdg_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+            for funcname, cfg, edges in zip(funcnames, cfgs, results):
+                self.cdgs[funcname] = cfg.overlay(['CDG'], CDG=EdgeLayer.from_edges(cfg.vcount(), edges))
+        else:
+            for funcname in funcnames:
+                print(f'constructing CDG for {funcname:>40}', end='\r')
+                self.function_cdg(funcname)
         print(f'{"finish constructing CDG":-^70}')
 
     def see_graph(self, 
@@ -92,6 +205,7 @@ class CDG:
         self.construct_cdg()
         for funcname, cdg in self.cdgs.items():
             dot = Digraph(strict=True)
+            cdg = cdg.to_igraph()
             exit_node = cdg.vs.find(type='function_exit')
             cdg.delete_vertices(exit_node.index)
             for node in cdg.vs:
@@ -1,25 +1,73 @@
 from AST import *
+from GRAPH import *
 import html
-from typing import Callable, Literal, Dict, List, Any, Tuple, Union, TypedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Literal, Dict, List, Any, Tuple, Union, TypedDict, Generator
 
 NodeInfo = Dict[str, Union[str, int, bool, List[Tuple[int, int]]]]
 Edges = List[Tuple[str, str]]
 Nodes = List[Tuple[NodeInfo, str]]
 CFG_GRAPH = List[Tuple[NodeInfo, Edges]]
+FunctionTask = Tuple[int, str, int, int]    # (函数序号, 函数名, 起始字节, 结束字节)
 
-def get_break_continue_node(node: Node) -> Tuple[List[Node], List[Node]]:
-    # 找到node节点循环中的所有break和continue节点并返回
-    break_nodes, continue_nodes = [], []
-    for child in node.children:
-        if child.type == 'break_statement':
-            break_nodes.append(child)
-        elif child.type == 'continue_statement':
-            continue_nodes.append(child)
-        elif child.type not in ['for_statement', 'while_statement', 'switch_statement']:    # 保证break和continue在当前循环里
-            b_node, c_nodes = get_break_continue_node(child)
-            break_nodes.extend(b_node)
-            continue_nodes.extend(c_nodes)
-    return break_nodes, continue_nodes
+JUMP_TYPES = ['for_statement', 'while_statement', 'do_statement', 'switch_statement', 'break_statement', 'continue_statement', 'goto_statement', 'case_statement', 'labeled_statement']
+LOOP_TYPES = ['for_statement', 'while_statement', 'do_statement']
+
+class JumpTargets:
+    '''
+    一个函数中所有跳转语句的目标，按先序遍历一次函数中的循环、switch和跳转语句得到
+    break -> 最内层的循环或switch，continue -> 最内层的循环，case/default -> 最内层的switch，goto -> 同名的labeled_statement
+    '''
+    def __init__(self, ast: AST, func_node: Node):
+        self.breaks: Dict[int, List[Node]] = {}      # 循环或switch的id -> 跳出它的break
+        self.continues: Dict[int, List[Node]] = {}   # 循环的id -> 跳到它的continue
+        self.cases: Dict[int, List[Node]] = {}       # switch的id -> 它的case和default
+        self.labels: Dict[str, Node] = {}            # label -> labeled_statement
+        self.gotos: Dict[int, Node] = {}             # goto的id -> 目标labeled_statement
+        index = ast.index
+        stack: List[Tuple[Node, int]] = []   # 包含当前节点的循环和switch，以及它们的子树在先序遍历中的结束位置
+        goto_nodes: List[Node] = []
+        for node in index.query(func_node, types=JUMP_TYPES, nest=True):
+            position = index.order[node.id]
+            while stack and stack[-1][1] <= position:
+                stack.pop()
+            if node.type in LOOP_TYPES or node.type == 'switch_statement':
+                stack.append((node, index.end[position]))
+            elif node.type == 'break_statement':
+                if stack:
+                    self.breaks.setdefault(stack[-1][0].id, []).append(node)
+            elif node.type == 'continue_statement':
+                loop = next((target for target, _ in reversed(stack) if target.type in LOOP_TYPES), None)
+                if loop:
+                    self.continues.setdefault(loop.id, []).append(node)
+            elif node.type == 'case_statement':
+                switch = next((target for target, _ in reversed(stack) if target.type == 'switch_statement'), None)
+                if switch:
+                    self.cases.setdefault(switch.id, []).append(node)
+            elif node.type == 'labeled_statement':
+                self.labels[ast.text(node.child_by_field_name('label'))] = node
+            else:
+                goto_nodes.append(node)
+        for node in goto_nodes:     # goto可以跳到后面的label
+            label = ast.text(node.child_by_field_name('label'))
+            if label in self.labels:
+                self.gotos[node.id] = self.labels[label]
+
+worker_cfg: Optional['CFG'] = None    # 工作进程中解析好的代码
+
+def init_worker(language: str, code: str) -> None:
+    # 进程池的initializer，每个工作进程只解析一次代码
+    global worker_cfg
+    worker_cfg = CFG(language, code)
+
+def current_worker() -> 'CFG':
+    return worker_cfg
+
+def cfg_task(task: FunctionTask) -> GraphPayload:
+    i, _, start_byte, end_byte = task
+    cfg = current_worker()
+    func_node = cfg.function_at(start_byte, end_byte)
+    return graph_payload(cfg.build_cfg(i, func_node))
 
 def get_edge(in_nodes: Nodes) -> Edges:
     # 输入入节点，返回入边的列表，边为(parent_id, label)
@@ -31,16 +79,24 @@ def get_edge(in_nodes: Nodes) -> Edges:
     return edge
 
 class CFG(AST):
-    cfgs: Dict[str, Graph] = {} # 存放每一个函数的CFG图
+    cfgs: Dict[str, CompactGraph]      # 存放每一个函数的CFG图
 
     def __init__(self, language: str, code: str):
         super().__init__(language, code)
+        self.cfgs = {}
+        self.store = GraphStore(self)      # 这个文件所有图共用的字符串表
+        self.func_nums: Dict[str, int] = {funcname: i for i, funcname in enumerate(self.functions)}    # 函数名 -> 函数序号
+        self.node_infos: Dict[int, NodeInfo] = {}  # node.id -> properties，每个函数构建CFG前清空
+        self.jump_tables: Dict[int, JumpTargets] = {}   # 函数节点的id -> JumpTargets
 
     def properties(self, node: Node) -> NodeInfo:
+        if node.id in self.node_infos:
+            return self.node_infos[node.id]
         node_prop = super().properties(node)
+        self.node_infos[node.id] = node_prop
         node_prop['is_branch'] = False
         if node.type == 'function_definition':
-            node_prop['text'] = text(node.child_by_field_name('declarator').child_by_field_name('declarator'))  # 函数名
+            node_prop['text'] = self.text(node.child_by_field_name('declarator').child_by_field_name('declarator'))  # 函数名
             node_prop['id'] = str(self.func_num)
         elif node.type in ['if_statement', 'while_statement', 'for_statement', 'switch_statement']:
             if node.type == 'if_statement':
@@ -51,224 +107,300 @@ class CFG(AST):
             for child in node.children:
                 if child == body:
                     break
-                node_text += text(child)
+                node_text += self.text(child)
             node_prop['text'] = node_text
             if node.type != 'switch_statement':
                 node_prop['is_branch'] = True
         elif node.type == 'do_statement':
-            node_prop['text'] = f'while{text(node.child_by_field_name("condition"))}'
+            node_prop['text'] = f'while{self.text(node.child_by_field_name("condition"))}'
             node_prop['is_branch'] = True
         elif node.type == 'case_statement':
             node_text = ''
             for child in node.children:
                 if child.type == ':':
                     break
-                node_text += ' ' + text(child)
+                node_text += ' ' + self.text(child)
             node_prop['text'] = node_text
             node_prop['is_branch'] = True
         elif node.type == 'labeled_statement':
-            node_prop['text'] = text(node.child_by_field_name('label'))
+            node_prop['text'] = self.text(node.child_by_field_name('label'))
         else:
-            node_prop['text'] = text(node)
+            node_prop['text'] = self.text(node)
         return node_prop
 
+    def close(self) -> None:
+        self.cfgs = {}
+        self.store = None
+        self.node_infos = {}
+        self.jump_tables = {}
+        self.jumps = None
+        super().close()
+
+    def jump_targets(self, func_node: Node) -> JumpTargets:
+        # 函数中break、continue、goto和case的目标，每个函数只计算一次，CFG和DDG共用
+        if func_node.id not in self.jump_tables:
+            self.jump_tables[func_node.id] = JumpTargets(self, func_node)
+        return self.jump_tables[func_node.id]
+
     def create_cfg(self, 
         node: Node, 
         in_nodes: Nodes = [()]
     ) -> Tuple[CFG_GRAPH, Nodes]:
-            # CFG       node_info, edge_label(p_id, label)   out_nodes(node_info, label)
         # 输入当前节点，以及入节点，入节点为(node_info, edge_label)的列表，node_info['id']唯一确定一个节点，edge_label为边的标签
+        # 用显式栈代替递归，每条语句对应一个生成器，生成器yield (子语句, 子语句的入节点)，得到子语句的出节点后继续，return自己的出节点
+        # 所有语句的(node_info, edge)按照原来递归拼接的顺序直接追加到同一个CFG列表中，不再复制中间结果
+        CFG: CFG_GRAPH = []
+        stack = [self.cfg_steps(node, in_nodes, CFG)]
+        out_nodes = None
+        while stack:
+            try:
+                child, child_in_nodes = stack[-1].send(out_nodes)
+            except StopIteration as result:
+                stack.pop()
+                out_nodes = result.value
+                continue
+            stack.append(self.cfg_steps(child, child_in_nodes, CFG))
+            out_nodes = None
+        return CFG, out_nodes
+
+    def cfg_steps(self, 
+        node: Node, 
+        in_nodes: Nodes, 
+        CFG: CFG_GRAPH
+    ) -> Generator[Tuple[Node, Nodes], Nodes, Nodes]:
+            # CFG       node_info, edge_label(p_id, label)   out_nodes(node_info, label)
+        # 将node的CFG追加到CFG中，返回node的出节点
         if node.type == 'labeled_statement':  # 如果是label: statement语句
-            CFG = []            
-            edge = get_edge(in_nodes)
             node_info = self.properties(node)
-            CFG.append((node_info, edge))   
+            CFG.append((node_info, get_edge(in_nodes)))
             body = node.children[2]
-            cfg, out_nodes = self.create_cfg(body, [(node_info, '')])   # 遍历label后的语句
-            CFG.extend(cfg)
-            return CFG, out_nodes
+            return (yield body, [(node_info, '')])   # 遍历label后的语句
         if node.child_count == 0:   # 如果in_nodes为空，说明没有入节点，跳过
-            return [], in_nodes
-        if node.type == 'function_definition':      # 如果节点是函数，则创建函数节点，添加参数节点，并且递归遍历函数的compound_statement
-            CFG = []
+            return in_nodes
+        if node.type == 'function_definition':      # 如果节点是函数，则创建函数节点，添加参数节点，并且遍历函数的compound_statement
+            param_CFG = []
             body = node.child_by_field_name('body')
             func_node_info = self.properties(node)
             param_nodes = self.query(node, types='parameter_declaration', nest=False)
             last_node_info = func_node_info
             for param_node in param_nodes:
                 param_node_info = self.properties(param_node)
-                CFG.append((param_node_info, [(last_node_info['id'], '')]))
+                param_CFG.append((param_node_info, [(last_node_info['id'], '')]))
                 last_node_info = param_node_info
-            body_CFG, _ = self.create_cfg(body, [(last_node_info, '')])
-            return body_CFG + CFG + [(func_node_info, [])], []
-        elif node.type == 'compound_statement':     # 如果是复合语句，则递归遍历复合语句的每一条statement
-            CFG = []
-            for child in node.children:
-                cfg, out_nodes = self.create_cfg(child, in_nodes)
-                CFG.extend(cfg)
-                in_nodes = out_nodes
-            return CFG, in_nodes
-        elif 'preproc' in node.type:    # preproc_if, preproc_ifdef, preproc_def, preproc_call
-            CFG = []
-            if node.type in ['preproc_if', 'preproc_ifdef']:
-                for child in node.children[2:]:
-                    cfg, out_nodes = self.create_cfg(child, in_nodes)
-                    CFG.extend(cfg)
-                    in_nodes = out_nodes
-            return CFG, in_nodes
+            yield body, [(last_node_info, '')]
+            CFG.extend(param_CFG)    # 函数体之后依次是参数节点和函数节点
+            CFG.append((func_node_info, []))
+            return []
+        elif node.type == 'compound_statement' or node.type in ['preproc_if', 'preproc_ifdef']:     # 复合语句和条件编译，依次遍历每一条statement
+            children = node.children if node.type == 'compound_statement' else node.children[2:]
+            for child in children:
+                if child.child_count:   # 叶子节点（{、}、注释等）不改变入节点
+                    in_nodes = yield child, in_nodes
+            return in_nodes
+        elif 'preproc' in node.type:    # preproc_def, preproc_call
+            return in_nodes
         elif node.type not in ['if_statement', 'while_statement', 'for_statement', 'switch_statement', 'case_statement', 'translation_unit', 'do_statement']:  # 如果是普通的语句
             edge = get_edge(in_nodes)
             node_info = self.properties(node)
-            in_nodes = [(node_info, '')]
+            CFG.append((node_info, edge))
             if node.type in ['return_statement', 'break_statement', 'continue_statement']:  # return，break，continue为非条件跳转语句，不会到下一条语句
-                return [(node_info, edge)], []
+                return []
             elif node.type == 'goto_statement':  # goto语句将本句连接到对应label的节点上
-                label = text(node.child_by_field_name('label'))
-                if label in self.labeled_nodes:
-                    return [(node_info, edge)] + [(self.labeled_nodes[label], [(str(node.id), '')])], []
-                else:
-                    return [(node_info, edge)], []
+                if node.id in self.jumps.gotos:
+                    CFG.append((self.properties(self.jumps.gotos[node.id]), [(str(node.id), '')]))
+                return []
             else:
-                return [(node_info, edge)], in_nodes
+                return [(node_info, '')]
         elif node.type == 'if_statement':   # if语句
-            CFG = []
-            edge = get_edge(in_nodes)
             node_info = self.properties(node)
-            CFG.append((node_info, edge))
+            CFG.append((node_info, get_edge(in_nodes)))
             body = node.child_by_field_name('consequence')  # 获取if的主体部分
-            cfg, out_nodes = self.create_cfg(body, [(node_info, 'True')])
-            CFG.extend(cfg)
+            out_nodes = yield body, [(node_info, 'True')]
             alternate = node.child_by_field_name('alternative') # 获取else的主体部分，可能是else，也可能是else if
             if alternate:       # if else 或者 if else if
                 body = alternate.children[1]
-                cfg, al_out_nodes = self.create_cfg(body, [(node_info, 'False')])
-                CFG.extend(cfg)
-                return CFG, out_nodes + al_out_nodes
+                al_out_nodes = yield body, [(node_info, 'False')]
+                return out_nodes + al_out_nodes
             else:               # 只有if
-                return CFG, out_nodes + [(node_info, 'False')]
+                return out_nodes + [(node_info, 'False')]
         elif node.type in ['for_statement', 'while_statement']:     # for和while循环
-            CFG = []
-            edge = get_edge(in_nodes)
             node_info = self.properties(node)
-            CFG.append((node_info, edge))
+            CFG.append((node_info, get_edge(in_nodes)))
             body = node.child_by_field_name('body')     # 获取循环主体
-            cfg, out_nodes = self.create_cfg(body, [(node_info, 'True')])
-            CFG.extend(cfg)
-            for out_node in out_nodes:  # 将循环主体的出节点与循环的开始节点相连
-                parent, label = out_node
-                parent_id = parent['id']
-                CFG.append((node_info, [(parent_id, label)]))
-            break_nodes, continue_nodes = get_break_continue_node(node)     # 求得循环内的break和continue节点
+            out_nodes = yield body, [(node_info, 'True')]
+            for parent, label in out_nodes:  # 将循环主体的出节点与循环的开始节点相连
+                CFG.append((node_info, [(parent['id'], label)]))
+            break_nodes, continue_nodes = self.jumps.breaks.get(node.id, []), self.jumps.continues.get(node.id, [])     # 跳出和跳回这个循环的break和continue节点
             out_nodes = [(node_info, 'False')]      # 循环体的出节点开始节点，条件为False
             for break_node in break_nodes:      
                 out_nodes.append((self.properties(break_node), ''))   # 将break节点添加到out_nodes中
             for continue_node in continue_nodes:
                 CFG.append((node_info, [(str(continue_node.id), '')]))     # 将continue节点连接到循环的开始节点
-            return CFG, out_nodes
+            return out_nodes
         elif node.type == 'do_statement':   # do while循环
-            CFG = []
-            edge = get_edge(in_nodes)
             node_info = self.properties(node)
             body = node.child_by_field_name('body')     # 获取循环主体
-            cfg, out_nodes = self.create_cfg(body, [])  # 注意到body的入节点为空，真实的入节点是while跳转过来的
             first_node = self.properties(body.children[1]) if body.child_count > 2 else node_info  # 循环主体的第一条语句
-            CFG.append((first_node, edge))
-            CFG.extend(cfg)
-            edge = get_edge(out_nodes)
-            CFG.append((node_info, edge))   #  将循环主体的出节点与条件节点相连
+            CFG.append((first_node, get_edge(in_nodes)))
+            out_nodes = yield body, []  # 注意到body的入节点为空，真实的入节点是while跳转过来的
+            CFG.append((node_info, get_edge(out_nodes)))   #  将循环主体的出节点与条件节点相连
             CFG.append((first_node, [(node_info['id'], 'True')]))   # 将条件节点连接到循环主体的开始节点
             out_nodes = [(node_info, 'False')]      # 循环体的出节点开始节点，条件为False
-            break_nodes, continue_nodes = get_break_continue_node(node)     # 求得循环内的break和continue节点
+            break_nodes, continue_nodes = self.jumps.breaks.get(node.id, []), self.jumps.continues.get(node.id, [])     # 跳出和跳回这个循环的break和continue节点
             for break_node in break_nodes:
                 out_nodes.append((self.properties(break_node), ''))
             for continue_node in continue_nodes:
                 CFG.append((node_info, [(str(continue_node.id), '')]))
-            return CFG, out_nodes
+            return out_nodes
         elif node.type == 'switch_statement':   # switch语句
-            CFG = []
-            all_out_nodes = []
-            edge = get_edge(in_nodes)
             switch_node_info = self.properties(node)
-            CFG.append((switch_node_info, edge))
-            body = node.child_by_field_name('body')     # 获取switch的主体部分
+            CFG.append((switch_node_info, get_edge(in_nodes)))
             in_nodes = [(switch_node_info, '')]     # case的入节点
-            for case_node in body.children[1:-1]:
-                if case_node.type == 'comment' : continue # case_node是comment导致数组下标越界
-                if case_node.children[0].type == 'case': # 如果为case
-                    index = 3
-                    case_name = text(case_node.child_by_field_name('value'))
-                else:
-                    index = 2
-                    case_name = 'default'
+            out_nodes = []
+            body = node.child_by_field_name('body')
+            for case_node in self.jumps.cases.get(node.id, []):
+                index, case_name = self.case_label(case_node)
                 case_node_info = self.properties(case_node)
+                if case_node.parent.id != body.id:     # 嵌套在循环等语句中的case（例如Duff's device），只加switch到case的边，case在所在的语句中像label一样遍历
+                    CFG.append((case_node_info, [(switch_node_info['id'], case_name)]))
+                    continue
                 for i in range(len(in_nodes)):  # case的入边来自switch语句和上一条语句的out_nodes
-                    if in_nodes[i][0] == switch_node_info:
+                    if in_nodes[i][0] is switch_node_info:
                         in_nodes[i] = (switch_node_info, case_name) # 如果in_node为switch到case的边，则把标签改为case_name
-                edge = get_edge(in_nodes)   
-                CFG.append((case_node_info, edge))
+                CFG.append((case_node_info, get_edge(in_nodes)))
                 in_nodes = [(case_node_info, '')]   # 现在case里面第一条语句的入节点为case节点
                 out_nodes = []
                 for child in case_node.children[index:]:
-                    cfg, out_nodes = self.create_cfg(child, in_nodes)
-                    CFG.extend(cfg)
+                    out_nodes = yield child, in_nodes
                     in_nodes = out_nodes
-                break_nodes, _ = get_break_continue_node(case_node)     # 获取所有的break节点
-                if break_nodes: # 如果有break节点，则把break节点加到switch的all_out_nodes中
-                    for break_node in break_nodes:
-                        all_out_nodes.append((self.properties(break_node), ''))
                 in_nodes = out_nodes + [(switch_node_info, '')] # 下一条case语句的入节点为当前case最后一条语句的out_nodes加上switch到case的边
-            return CFG, all_out_nodes + out_nodes   # 最终返回switch语句所有的break节点和最后一条case的out_nodes
+            all_out_nodes = [(self.properties(break_node), '') for break_node in self.jumps.breaks.get(node.id, [])]   # switch所有的break节点
+            return all_out_nodes + out_nodes   # 最终返回switch语句所有的break节点和最后一条case的out_nodes
+        elif node.type == 'case_statement':     # 不是switch直接展开的case，即嵌套在循环等语句中的case，和label一样接在上一条语句之后，switch到它的边由switch添加
+            node_info = self.properties(node)
+            CFG.append((node_info, get_edge(in_nodes)))
+            index, _ = self.case_label(node)
+            in_nodes = [(node_info, '')]
+            for child in node.children[index:]:
+                in_nodes = yield child, in_nodes
+            return in_nodes
+        return []
+
+    def case_label(self, case_node: Node) -> Tuple[int, str]:
+        # case中第一条语句在children中的下标，以及switch到这个case的边的标签
+        if case_node.children[0].type == 'case':
+            return 3, self.text(case_node.child_by_field_name('value'))
+        return 2, 'default'
 
-    def convert_cfg_to_graph(self, cfg: CFG_GRAPH) -> Graph:
-        # 将CFG转换为iGraph，并加上exit节点
-        graph = Graph(directed=True)
-        node_ids = set()
+    def convert_cfg_to_graph(self, cfg: CFG_GRAPH) -> CompactGraph:
+        # 将CFG转换为CompactGraph，并加上exit节点
+        # 顶点和边先收集到列表中，再用一次add_vertices和一次add_edges插入
+        index: Dict[str, int] = {}      # 节点id -> 在vertices中的下标
+        vertices: List[NodeInfo] = []
         node_ids_with_out_edge = set()   # 有出边的节点
         condition_nodes: Dict[str, List[str]] = {}    # 保存条件节点, 如果条件语句只有一个分支，则将另一个分支指向exit节点
-        for end, edges in cfg:
-            if end['id'] not in node_ids:
-                node_ids.add(end['id'])
-                graph.add_vertex(end['id'], **end)
-            for start, label in edges:
+        for end, in_edges in cfg:
+            if end['id'] not in index:
+                index[end['id']] = len(vertices)
+                vertices.append(end)
+            for start, label in in_edges:
                 node_ids_with_out_edge.add(start)
                 if label in ['True', 'False']:
                     condition_nodes.setdefault(start, []).append(label)
-        one_exit_condition_node = [node for node, labels in condition_nodes.items() if len(labels) == 1]
-        last_node = list(node_ids - node_ids_with_out_edge) + one_exit_condition_node  # 没有出边的节点
         # 构造CFG的边
-        for end, edges in cfg:
-            for start, label in edges:
-                if start in node_ids:
-                    graph.add_edge(start, end['id'], label=label)
-        # 删除死代码，即不是函数入口节点且入度为0的节点
-        delete_nodes = graph.vs.select(lambda x: x['type'] != 'function_definition' and x.indegree() == 0)
-        while len(delete_nodes) > 0:
-            delete_ids: List[int] = []
-            for node in delete_nodes:
-                delete_ids.append(node.index)
-            graph.delete_vertices(delete_ids)
-            delete_nodes = graph.vs.select(lambda x: x['type'] != 'function_definition' and x.indegree() == 0)
+        edges: List[Tuple[int, int]] = []
+        labels: List[str] = []
+        successors: List[List[int]] = [[] for _ in vertices]
+        for end, in_edges in cfg:
+            for start, label in in_edges:
+                if start in index:
+                    edges.append((index[start], index[end['id']]))
+                    labels.append(label)
+                    successors[index[start]].append(index[end['id']])
+        # 删除死代码，即不是函数入口节点且入度为0的节点，删除后后继节点的入度随之减少，用一个工作表一次删完
+        # 注意不能简单地用从入口出发的可达性代替：goto到前面的label时，label所在的环可能没有从入口进入的边
+        indegree = [0] * len(vertices)
+        for _, end in edges:
+            indegree[end] += 1
+        alive = [True] * len(vertices)
+        stack = [i for i, vertex in enumerate(vertices) if indegree[i] == 0 and vertex['type'] != 'function_definition']
+        while stack:
+            node = stack.pop()
+            alive[node] = False
+            for next_node in successors[node]:
+                indegree[next_node] -= 1
+                if indegree[next_node] == 0 and vertices[next_node]['type'] != 'function_definition':
+                    stack.append(next_node)
+        new_index: List[int] = []      # 旧下标 -> 删除死代码后的下标
+        kept: List[NodeInfo] = []
+        for i, vertex in enumerate(vertices):
+            new_index.append(len(kept))
+            if alive[i]:
+                kept.append(vertex)
         # 添加exit节点，使得所有出度为0或者不完善的分支节点指向exit
-        graph.add_vertex(f'-{self.func_num}', type='function_exit', text='exit', id=f'-{self.func_num}')
-        for node_id in last_node:
-            if node_id in one_exit_condition_node:
-                graph.add_edge(node_id, f'-{self.func_num}', label='False')
-            else:
-                graph.add_edge(node_id, f'-{self.func_num}', label='')
-        return graph
+        exit_index = len(kept)
+        kept.append({'type': 'function_exit', 'text': 'exit', 'id': f'-{self.func_num}'})
+        graph_edges: List[Tuple[int, int]] = []
+        graph_labels: List[str] = []
+        for (start, end), label in zip(edges, labels):
+            if alive[start]:
+                graph_edges.append((new_index[start], new_index[end]))
+                graph_labels.append(label)
+        for i, vertex in enumerate(vertices):
+            if not alive[i]:
+                continue
+            branch_labels = condition_nodes.get(vertex['id'], [])
+            if len(branch_labels) == 1:    # 只有一个分支的条件节点
+                graph_edges.append((new_index[i], exit_index))
+                graph_labels.append('False')
+            elif vertex['id'] not in node_ids_with_out_edge:    # 没有出边的节点
+                graph_edges.append((new_index[i], exit_index))
+                graph_labels.append('')
+        return self.store.graph(self.func_num, kept, graph_edges, graph_labels)
+
+    def build_cfg(self, i: int, func_node: Node) -> CompactGraph:
+        # 构建第i个函数的CFG
+        self.func_num = i
+        self.node_infos = {}    # 函数节点的id和func_num有关
+        self.jumps = self.jump_targets(func_node)
+        cfg, _ = self.create_cfg(func_node)
+        return self.convert_cfg_to_graph(cfg)
+
+    def function_cfg(self, funcname: str) -> CompactGraph:
+        '''funcname的CFG，第一次使用时才构建'''
+        if funcname not in self.cfgs:
+            self.cfgs[funcname] = self.build_cfg(self.func_nums[funcname], self.functions[funcname])
+        return self.cfgs[funcname]
+
+    def map_functions(self, 
+        task: Callable[[FunctionTask], Any], 
+        workers: int
+    ) -> List[Any]:
+        '''
+        将每个函数的(序号, 函数名, 起始字节, 结束字节)分给workers个进程执行task，按函数的顺序返回结果
+        每个工作进程在init_worker中重新解析一次代码，task通过current_worker()和function_at拿到函数节点
+        '''
+        tasks = [(i, funcname, node.start_byte, node.end_byte) for i, (funcname, node) in enumerate(self.functions.items())]
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self.language, self.code)) as pool:
+            return list(pool.map(task, tasks, chunksize=chunksize))
 
     @timer
-    def construct_cfg(self) -> None:
-        for i, (funcname, func_node) in enumerate(self.functions.items()):
-            self.func_num = i
-            print(f'constructing CDG for {funcname:>40}', end='\r')
-            labeled_nodes = self.query(func_node, types='labeled_statement', nest=True)
-            self.labeled_nodes = {text(node.child_by_field_name('label')): self.properties(node) for node in labeled_nodes}
-            cfg, _ = self.create_cfg(func_node)
-            self.cfgs[funcname] = self.convert_cfg_to_graph(cfg)
+    def construct_cfg(self, workers: int = 1) -> None:
+        # workers大于1时，函数分到多个进程中构建
+        if workers > 1 and len(self.functions) > 1:
+            payloads = self.map_functions(cfg_task, workers)
+            for funcname, payload in zip(self.functions, payloads):
+                self.cfgs.setdefault(funcname, payload_graph(payload, self.store))
+            self.func_num = len(self.functions) - 1
+        else:
+            for funcname in self.functions:
+                print(f'constructing CDG for {funcname:>40}', end='\r')
+                self.function_cfg(funcname)
         print(f'{"finish constructing CFG":-^70}')
 
-    def draw_graph(self, graph: Graph) -> Digraph:
+    def draw_graph(self, graph: Union[CompactGraph, Graph]) -> Digraph:
+        graph = as_igraph(graph)
         dot = Digraph()
         for node in graph.vs:
             label = html.escape(node['text']) + '\\n' + f"{node['type']} | {node['line']}"
@@ -288,7 +420,7 @@ class CFG(AST):
     def see_graph(self, 
         pdf: bool = True, 
         view: bool = False
-    ) -> Dict[str, Graph]:
+    ) -> Dict[str, CompactGraph]:
         self.construct_cfg()
         for funcname, cfg in self.cfgs.items():
             dot = self.draw_graph(cfg)
@@ -297,6 +429,25 @@ class CFG(AST):
                 dot.clear()
         return self.cfgs
 
+def benchmark_cfg(sizes: List[int] = [1000, 5000, 20000], repeat: int = 3) -> None:
+    '''在有sizes条语句的函数上统计create_cfg和convert_cfg_to_graph的耗时，函数后半部分是return之后的死代码链'''
+    for size in sizes:
+        statements = ''.join(f'x = x + {i}; if (x > {i}) x--;' for i in range(size // 4))
+        dead = ''.join(f'x = x * {i};' for i in range(size // 2))
+        cfg = CFG('c', f'int f(int x) {{ {statements} return x; {dead} }}')
+        func_node = cfg.functions['f']
+        cfg.jumps = cfg.jump_targets(func_node)
+        create_time, convert_time = 0.0, 0.0
+        for _ in range(repeat):
+            cfg.func_num, cfg.node_infos = 0, {}
+            start = time.time()
+            graph, _ = cfg.create_cfg(func_node)
+            create_time += time.time() - start
+            start = time.time()
+            graph = cfg.convert_cfg_to_graph(graph)
+            convert_time += time.time() - start
+        print(f'{size:>6} statements {graph.vcount():>6} nodes  create_cfg: {create_time / repeat * 1000:.2f}ms  convert_cfg_to_graph: {convert_time / repeat * 1000:.2f}ms')
+
 if __name__ == '__main__':
     code = r'{}'.format(open('test.c', 'r', encoding='utf-8').read())
     cfg = CFG('c', code)
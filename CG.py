@@ -1,53 +1,94 @@
 from CFG import *
-from DDG import Identifier
+from DDG import def_use_cache
+
+SUMMARY_TYPES = ['parameter_declaration', 'call_expression', 'return_statement']   # 函数摘要需要的节点，按先序一次取出
 
 class CG(AST):
-    func_properties: Dict[str, Union[str, int, List[Dict[str, Union[str, int]]]]] = {}
-    call_edge: Dict[str, List[str]] = {}
-    return_edge: Dict[str, List[str]] = {}
-    cg: Graph = Graph(directed=True)
+    func_properties: Dict[str, Union[str, int, List[Dict[str, Union[str, int]]]]]
+    call_edge: Dict[str, List[str]]
+    return_edge: Dict[str, List[str]]
+    cg: Graph
 
     def __init__(self, cfg: CFG_GRAPH):
         self.cfg = cfg
+        self.func_properties = {}
+        self.call_edge = {}
+        self.return_edge = {}
+        self.cg = Graph(directed=True)
 
-    @timer
-    def construct_cg(self):
-        edges = []
-        name_to_id = {name: str(node.id) for name, node in self.cfg.functions.items()}
-        for funcname, func_node in self.cfg.functions.items():
-            func_type = text(func_node).split(funcname)[0].strip()
-            line = func_node.start_point[0] + 1
-            func_id = str(func_node.id)
-            param_nodes = self.query(func_node, types='parameter_declaration', nest=False)
-            parameters, return_node_ids, call_sites = [], [], []
-            for node in param_nodes:
-                identifier_nodes = self.cfg.query(node, types='identifier', nest=False)
+    def close(self) -> None:
+        # CG只引用CFG的语法树，不调用AST.close
+        self.func_properties = {}
+        self.call_edge = {}
+        self.return_edge = {}
+        self.cg = None
+        self.cfg = None
+
+    def signature_name(self, func_node: Node) -> Node:
+        # 沿declarator字段找到函数名所在的节点，和AST中确定函数名的方式相同
+        node = func_node.child_by_field_name('declarator')
+        while node is not None and node.type == 'pointer_declarator':
+            node = node.child_by_field_name('declarator')
+        if node is None or node.type != 'function_declarator':     # 其他形式的声明符，取第一个function_declarator
+            node = self.cfg.query(func_node, types='function_declarator', nest=False)[0]
+        return node.child_by_field_name('declarator')
+
+    def function_properties(self, funcname: str) -> Dict[str, Any]:
+        '''
+        funcname的属性（返回类型、形参、调用点和返回点），第一次使用时才分析这个函数
+        在语法树的索引上只遍历一次函数中的形参、调用和返回语句，返回类型和形参类型是声明符之前的源代码，不解码整个函数
+        '''
+        if funcname in self.func_properties:
+            return self.func_properties[funcname]
+        func_node = self.cfg.functions[funcname]
+        source, index = self.cfg.source, self.cfg.index
+        def_uses = def_use_cache(self.cfg)
+        func_type = source.decode(func_node.start_byte, self.signature_name(func_node).start_byte).strip()
+        line = func_node.start_point[0] + 1
+        func_id = str(func_node.id)
+        parameters, return_node_ids, call_sites = [], [], []
+        param_end = -1      # 和query(nest=False)相同，形参内部的parameter_declaration（函数指针的形参）不算
+        for node in index.query(func_node, types=SUMMARY_TYPES):
+            if node.type == 'parameter_declaration':
+                position = index.order[node.id]
+                if position < param_end:
+                    continue
+                param_end = index.end[position]
+                identifier_nodes = index.query(node, types=['identifier'], nest=False)
                 if identifier_nodes:
-                    param = text(identifier_nodes[0])
-                    type = text(node).split(param)[0].strip()
+                    param = self.cfg.text(identifier_nodes[0])
+                    type = source.decode(node.start_byte, identifier_nodes[0].start_byte).strip()
                     parameters.append({'type': type, 'param': param, 'param_id': str(node.id)})
-            print(f'constructing CG for {funcname:>40}', end='\r')
-            call_site_nodes = self.query(func_node, types='call_expression', nest=True)
-            for node in call_site_nodes:
-                callee_name = text(node.child_by_field_name('function'))
+            elif node.type == 'call_expression':
+                callee_name = self.cfg.text(node.child_by_field_name('function'))
                 if callee_name not in self.cfg.functions:
                     continue
-                edges.append((func_id, name_to_id[callee_name]))
                 arguments = []
                 for child in node.child_by_field_name('arguments').children[1:-1]:
                     if child.type != ',':
-                        ids = list(Identifier(child).ids)
-                        arguments.append(ids)
-                call_sites.append({'callee_name': callee_name, 'arguments': arguments, 'call_site_id': str(node.id), 'callee_code': text(node), 'callee_line': node.start_point[0] + 1})
-            return_nodes = self.query(func_node, types='return_statement', nest=True)
-            for return_node in return_nodes:
-                var = text(return_node).replace('return', '').replace(';', '').strip()
-                return_node_ids.append({'return_node_id': str(return_node.id), 'return_var': var, 'return_line': return_node.start_point[0] + 1})
-            func_properties = {'type': func_type, 'func_name': funcname, 'line': line, 'func_id': func_id, 'parameters': parameters, 'return_node_ids': return_node_ids, 'call_sites': call_sites}
-            self.func_properties[funcname] = func_properties
-            self.cg.add_vertex(func_id, **func_properties)
+                        arguments.append(def_uses.decode(def_uses.summary(child).uses))
+                call_sites.append({'callee_name': callee_name, 'arguments': arguments, 'call_site_id': str(node.id), 'callee_code': self.cfg.text(node), 'callee_line': node.start_point[0] + 1})
+            else:
+                var = self.cfg.text(node).replace('return', '').replace(';', '').strip()
+                return_node_ids.append({'return_node_id': str(node.id), 'return_var': var, 'return_line': node.start_point[0] + 1})
+        func_properties = {'type': func_type, 'func_name': funcname, 'line': line, 'func_id': func_id, 'parameters': parameters, 'return_node_ids': return_node_ids, 'call_sites': call_sites}
+        self.func_properties[funcname] = func_properties
+        return func_properties
+
+    @timer
+    def construct_cg(self):
+        edges, vertices = [], []
+        name_to_id = {name: str(node.id) for name, node in self.cfg.functions.items()}
+        for funcname in self.cfg.functions:
+            print(f'constructing CG for {funcname:>40}', end='\r')
+            func_properties = self.function_properties(funcname)
+            for call_site in func_properties['call_sites']:
+                edges.append((func_properties['func_id'], name_to_id[call_site['callee_name']]))
+            vertices.append(func_properties)
         # input(self.call_edge)
         # input(self.return_edge)
+        attributes = {key: [vertex[key] for vertex in vertices] for key in vertices[0]} if vertices else {}
+        self.cg.add_vertices([vertex['func_id'] for vertex in vertices], attributes=attributes)     # 一次性添加所有顶点和边
         self.cg.add_edges(edges)    # 一次性添加所有边比一个一个添加边要快得多
         print(f'{"finish constructing C G":-^70}')
  
@@ -86,6 +127,22 @@ class CG(AST):
                 str += f'line: {return_node_id["return_line"]}   var: {return_node_id["return_var"]} | '
         return str
 
+def benchmark_cg(sizes: List[int] = [1000, 5000], repeat: int = 3) -> None:
+    '''在有sizes个函数的文件上统计construct_cg的耗时，每个函数有形参、调用上一个函数的调用点和返回语句'''
+    for size in sizes:
+        functions = ['int f0(int x) { return x; }']
+        for i in range(1, size):
+            functions.append(f'static struct ctx_t *f{i}(struct ctx_t *ctx, size_t size) {{ int y = f{i - 1}(ctx->n, size); if (y) return ctx; return NULL; }}')
+        cfg = CFG('c', '\n'.join(functions))
+        cost = 0.0
+        for _ in range(repeat):
+            cfg.def_uses = None     # 每次都从冷缓存开始，def/use摘要的构建计入construct_cg的耗时
+            cg = CG(cfg)
+            start = time.time()
+            cg.construct_cg()
+            cost += time.time() - start
+        print(f'{size:>6} functions {cg.cg.vcount():>6} vertices {cg.cg.ecount():>6} edges  construct_cg: {cost / repeat * 1000:.2f}ms')
+
 if __name__ == '__main__':
     code = r'{}'.format(open('test.c', 'r', encoding='utf-8').read())
     cfg = CFG('c', code)
@@ -1,11 +1,13 @@
 from CFG import *
 from graphviz import Graph
-import copy
-from typing import Set
+from typing import Set, FrozenSet
+from collections import deque
+from functools import partial
 
 class Identifier:
-    def __init__(self, expression_node: Node):
-        # 输入利于a->b.c的变量
+    def __init__(self, expression_node: Node, source: Optional[SourceBuffer] = None):
+        # 输入利于a->b.c的变量，source为节点所在代码的SourceBuffer
+        self.source = source
         self.ids: Set[str] = set()             # 普通变量  定义和使用时，作为use
         self.index_ids: Set[str] = set()       # 数组索引   定义和使用时，作为use
         self.def_ids: Set[str] = set()         # 定义变量   定义时，作为def，使用时，排除在外
@@ -23,16 +25,16 @@ class Identifier:
             return
         if node.type == 'identifier' and node.parent.type != 'call_expression':
             if type == 'index':     # a[i]中的i
-                self.index_ids.add(text(node))
+                self.index_ids.add(text(node, self.source))
             if node.parent.type == 'declaration' or type == 'def':  # 定义变量 int a=1中的a
-                self.def_ids.add(text(node))
+                self.def_ids.add(text(node, self.source))
             elif type == 'field':   # a->b中的a
-                self.field_ids.add(text(node))
+                self.field_ids.add(text(node, self.source))
             elif type == 'update':  # a++中的a
-                self.ids.add(text(node))
-                self.def_ids.add(text(node))
+                self.ids.add(text(node, self.source))
+                self.def_ids.add(text(node, self.source))
             else:   # 普通变量
-                self.ids.add(text(node))
+                self.ids.add(text(node, self.source))
         elif node.type == 'declaration':    # int a, b=1;
             for child in node.children[1:-1]:
                 if child.type != ',':
@@ -42,7 +44,7 @@ class Identifier:
         elif node.type == 'pointer_declarator': # int *p
             self.traverse(node.children[1], 'def')
         elif node.type == 'field_expression':   # a->b.c
-            node_text = text(node).replace(' ', '')
+            node_text = text(node, self.source).replace(' ', '')
             if type == 'def':
                 self.def_ids.add(node_text)
                 self.traverse(node.children[0], '')
@@ -53,7 +55,7 @@ class Identifier:
                 self.field_ids.add(node_text)
                 self.traverse(node.children[0], 'field')
         elif node.type == 'subscript_expression':   # a[i][j]
-            node_text = text(node).replace(' ', '')
+            node_text = text(node, self.source).replace(' ', '')
             if type == 'def':
                 self.def_ids.add(node_text)
             else:
@@ -64,7 +66,7 @@ class Identifier:
             self.traverse(node.children[0], 'def')
             self.traverse(node.children[2], 'index')
         elif node.type == 'assignment_expression':  # a=b;/a+=b
-            if text(node.children[1]) != '=':
+            if text(node.children[1], self.source) != '=':
                 self.traverse(node.child_by_field_name('left'), 'update')
             else:
                 self.traverse(node.child_by_field_name('left'), 'def')
@@ -75,7 +77,7 @@ class Identifier:
             self.traverse(node.child_by_field_name('declarator'), 'def')
             self.traverse(node.child_by_field_name('value'), '')
         elif node.type == 'call_expression':    # func(a, b)
-            func_name = text(node.child_by_field_name('function'))
+            func_name = text(node.child_by_field_name('function'), self.source)
             if func_name == 'scanf':
                 self.traverse(node.child_by_field_name('arguments'), 'def')
             else:
@@ -86,32 +88,293 @@ class Identifier:
 
     def __str__(self):
         return 'ids: {}\nindex_ids: {}\ndef_ids: {}\nfield_ids: {}\narray_ids: {}\n'.format(list(self.ids), list(self.index_ids), list(self.def_ids), list(self.field_ids), list(self.array_ids))
-        
-STATE = Dict[str, Set[int]]
+
+class AccessPaths:
+    '''
+    访问路径的trie，例如a->b.c[i]拆成a、->b、.c、[i]四步，每个前缀编号为一个小整数，id 0为空路径（trie的根）
+    同一条访问路径在一个文件中只保存一次，用和Vocabulary相同的接口（paths[path]编号，decode解码），
+    prefixes和descendants沿trie向上或向下走，例如descendants(paths['dctx'])为所有以dctx开头的访问路径
+    '''
+    def __init__(self):
+        self.ids: Dict[str, int] = {'': 0}          # 访问路径的文本 -> id
+        self.tokens: List[str] = ['']               # id -> 访问路径的文本
+        self.parents: List[int] = [-1]              # id -> 少最后一步的前缀的id
+        self.children: List[Dict[str, int]] = [{}]  # id -> {下一步: id}
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, path: str) -> int:
+        id = self.ids.get(path)
+        if id is None:
+            id = 0
+            for step in split_access_path(path):
+                id = self.step(id, step)
+            self.ids[path] = id
+        return id
+
+    def step(self, parent: int, step: str) -> int:
+        # parent后面再走一步的访问路径
+        id = self.children[parent].get(step)
+        if id is None:
+            id = self.children[parent][step] = len(self.tokens)
+            self.tokens.append(self.tokens[parent] + step)
+            self.parents.append(parent)
+            self.children.append({})
+            self.ids.setdefault(self.tokens[id], id)
+        return id
+
+    def find(self, path: str) -> Optional[int]:
+        # 不编号新的访问路径，没有出现过时返回None
+        return self.ids.get(path)
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        return [self.tokens[id] for id in ids]
+
+    def prefixes(self, id: int) -> List[int]:
+        # id以及它所有非空的前缀，例如a->b.c -> [a->b.c, a->b, a]
+        ids = []
+        while id > 0:
+            ids.append(id)
+            id = self.parents[id]
+        return ids
+
+    def descendants(self, id: int) -> List[int]:
+        # id以及所有以它为前缀的访问路径
+        ids, stack = [], [id]
+        while stack:
+            id = stack.pop()
+            ids.append(id)
+            stack.extend(self.children[id].values())
+        return ids
+
+def split_access_path(path: str) -> List[str]:
+    # 去掉空格的访问路径拆成基变量和每一步成员/下标，括号里的->、.、[不拆开
+    steps, start, depth, i = [], 0, 0, 0
+    while i < len(path):
+        char = path[i]
+        if depth == 0 and i > start and (char == '.' or char == '[' or path.startswith('->', i)):
+            steps.append(path[start:i])
+            start = i
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == '-' and path.startswith('->', i):
+            i += 1
+        i += 1
+    steps.append(path[start:])
+    return steps
+
+class DefUse:
+    '''一个语句或表达式按Identifier的规则得到的def/use摘要，集合中都是DefUseCache.names中的变量id'''
+    __slots__ = ('uses', 'indices', 'defs', 'fields', 'arrays')
+
+    def __init__(self, 
+        uses: FrozenSet[int] = frozenset(), 
+        indices: FrozenSet[int] = frozenset(), 
+        defs: FrozenSet[int] = frozenset(), 
+        fields: FrozenSet[int] = frozenset(), 
+        arrays: FrozenSet[int] = frozenset()
+    ):
+        self.uses = uses            # Identifier.ids，包括结构体变量和数组变量
+        self.indices = indices      # Identifier.index_ids
+        self.defs = defs            # Identifier.def_ids
+        self.fields = fields        # Identifier.field_ids
+        self.arrays = arrays        # Identifier.array_ids
+
+NO_DEF_USE = DefUse()
+
+class DefUseCache:
+    '''
+    一次解析中每个节点的def/use摘要，按node.id缓存，每个语句的变量在一个文件中只提取一次，DDG、CG和DIFF共用
+    变量名都是names（访问路径的trie）中的id；DIFF的关键变量用自己的规则，extract按(规则, node.id)分别缓存
+    '''
+    def __init__(self, ast: AST):
+        self.source = ast.source
+        self.names = AccessPaths()
+        self.summaries: Dict[int, DefUse] = {}
+        self.extracted: Dict[Tuple[Callable, int], FrozenSet[int]] = {}
+
+    def encode(self, names: Iterable[str]) -> FrozenSet[int]:
+        return frozenset(self.names[name] for name in names)
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        # 按id排序，即按变量在文件中第一次被提取的顺序
+        return self.names.decode(sorted(ids))
+
+    def name(self, id: int) -> str:
+        return self.names.tokens[id]
+
+    def summary(self, node: Optional[Node]) -> DefUse:
+        if node is None:
+            return NO_DEF_USE
+        summary = self.summaries.get(node.id)
+        if summary is None:
+            id = Identifier(node, self.source)
+            summary = DefUse(self.encode(id.ids), self.encode(id.index_ids), self.encode(id.def_ids), self.encode(id.field_ids), self.encode(id.array_ids))
+            self.summaries[node.id] = summary
+        return summary
+
+    def extract(self, 
+        rule: Callable[[Node, Optional[SourceBuffer]], Set[str]], 
+        node: Optional[Node]
+    ) -> FrozenSet[int]:
+        # 按rule(node, source)提取的变量
+        if node is None:
+            return frozenset()
+        ids = self.extracted.get((rule, node.id))
+        if ids is None:
+            ids = self.extracted[(rule, node.id)] = self.encode(rule(node, self.source))
+        return ids
+
+def def_use_cache(ast: AST) -> DefUseCache:
+    '''ast这次解析的DefUseCache，第一次使用时建立'''
+    if ast.def_uses is None:
+        ast.def_uses = DefUseCache(ast)
+    return ast.def_uses
+
+TRIE_BITS = 5                   # DataflowState每一层用变量id的5位，即32路
+TRIE_WIDTH = 1 << TRIE_BITS
+NO_DEFS: FrozenSet[int] = frozenset()
+
+class DataflowState:
+    '''
+    变量id -> 到达的定义行（frozenset）的持久化映射，按变量id的位分段保存在32路的trie中，trie的节点都是tuple，从不修改
+    复制状态就是共用同一个对象，是O(1)的；set只复制根到叶子的一条路径；
+    merge时两边是同一个对象的子树直接共用，只合并不同的部分，结果和某一边相同时返回那一边，之后的merge仍然可以跳过
+    '''
+    __slots__ = ('root', 'depth')
+
+    def __init__(self, root: Optional[tuple] = None, depth: int = 1):
+        self.root = root
+        self.depth = depth      # trie的层数，能保存小于32**depth的变量id
+
+    def get(self, key: int) -> FrozenSet[int]:
+        if key >> TRIE_BITS * self.depth:
+            return NO_DEFS
+        node = self.root
+        for shift in range(TRIE_BITS * (self.depth - 1), -1, -TRIE_BITS):
+            if node is None:
+                return NO_DEFS
+            node = node[key >> shift & TRIE_WIDTH - 1]
+        return node or NO_DEFS
+
+    def set(self, key: int, value: FrozenSet[int]) -> 'DataflowState':
+        state = self.grow(key.bit_length())
+        return DataflowState(trie_set(state.root, TRIE_BITS * (state.depth - 1), key, value), state.depth)
+
+    def merge(self, other: 'DataflowState') -> 'DataflowState':
+        if other.root is None or other.root is self.root:
+            return self
+        if self.root is None:
+            return other
+        depth = max(self.depth, other.depth)
+        left, right = self.grow(TRIE_BITS * depth), other.grow(TRIE_BITS * depth)
+        root = trie_merge(left.root, right.root, TRIE_BITS * (depth - 1))
+        return left if root is left.root else right if root is right.root else DataflowState(root, depth)
+
+    def grow(self, bits: int) -> 'DataflowState':
+        # 加层直到能保存bits位的变量id，原来的trie成为新根的第0个子树
+        root, depth = self.root, self.depth
+        while TRIE_BITS * depth < bits:
+            root = None if root is None else (root,) + (None,) * (TRIE_WIDTH - 1)
+            depth += 1
+        return self if depth == self.depth else DataflowState(root, depth)
+
+    def items(self) -> Generator[Tuple[int, FrozenSet[int]], None, None]:
+        stack = [(self.root, TRIE_BITS * (self.depth - 1), 0)]
+        while stack:
+            node, shift, prefix = stack.pop()
+            if node is None:
+                continue
+            for i, child in enumerate(node):
+                if shift:
+                    stack.append((child, shift - TRIE_BITS, prefix | i << shift))
+                elif child:
+                    yield prefix | i, child
+
+def trie_set(node: Optional[tuple], shift: int, key: int, value: FrozenSet[int]) -> tuple:
+    slots = list(node) if node is not None else [None] * TRIE_WIDTH
+    i = key >> shift & TRIE_WIDTH - 1
+    slots[i] = value if shift == 0 else trie_set(slots[i], shift - TRIE_BITS, key, value)
+    return tuple(slots)
+
+def trie_merge(left: Optional[tuple], right: Optional[tuple], shift: int) -> Optional[tuple]:
+    # 逐个槽合并两棵同样深度的trie，没有变化的槽保留left的对象，left完全没变时返回left本身
+    if left is right or right is None:
+        return left
+    if left is None:
+        return right
+    slots = None
+    for i in range(TRIE_WIDTH):
+        x, y = left[i], right[i]
+        if x is y or y is None:
+            continue
+        if x is None:
+            z = y
+        elif shift == 0:
+            z = x if y <= x else y if x <= y else x | y
+        else:
+            z = trie_merge(x, y, shift - TRIE_BITS)
+        if z is not x:
+            if slots is None:
+                slots = list(left)
+            slots[i] = z
+    if slots is None:
+        return left
+    return right if all(a is b for a, b in zip(slots, right)) else tuple(slots)
+
+STATE = DataflowState
+Effect = Tuple[int, List[int], List[int], List[int]]    # (行号, 使用之前定义的变量, 使用的变量, 使用之后定义的变量)，都是变量id
+
+def reverse_postorder(successors: List[List[int]], root: int) -> List[int]:
+    # 从root出发DFS的逆后序，root到不了的节点（例如只能由goto进入的环）按下标排在最后
+    order, visited = [], [False] * len(successors)
+    visited[root] = True
+    stack = [(root, iter(successors[root]))]
+    while stack:
+        v, children = stack[-1]
+        for child in children:
+            if not visited[child]:
+                visited[child] = True
+                stack.append((child, iter(successors[child])))
+                break
+        else:
+            stack.pop()
+            order.append(v)
+    order.reverse()
+    return order + [v for v in range(len(successors)) if not visited[v]]
 
 class DDG:
-    dict: Set[Tuple[str, int, int]] = set() # def -> use
+    dict: Set[Tuple[str, int, int]]         # def -> use
 
-    def __init__(self, cfg: CFG_GRAPH):
+    def __init__(self, cfg: CFG_GRAPH, engine: Literal['ast', 'worklist'] = 'ast'):
+        # engine为ast时沿语法树递归求数据流，循环体分析两次；为worklist时在CFG上用工作表迭代求到达定义
         self.cfg = cfg
-        self.ddgs = copy.deepcopy(self.cfg.cfgs)
-        for ddg in self.ddgs.values():
-            ddg.delete_edges(ddg.get_edgelist())
+        self.engine = engine
+        self.dict = set()
+        self.ddgs: Dict[str, CompactGraph] = {}    # 每个函数CFG上的一层DDG边，和CFG共用顶点
+        self.def_uses = def_use_cache(cfg)          # 每个语句的def/use摘要，和CG、DIFF共用，变量id也用作DataflowState的键
+
+    def close(self) -> None:
+        self.ddgs = {}
+        self.dict = set()
+        self.def_uses = None
+        self.cfg = None
 
     def init_func_state(self, func_node: Node) -> STATE:
         param_nodes = self.cfg.query(func_node, types='parameter_declaration', nest=False)
-        out_state = {}
+        out_state = DataflowState()
         for param_node in param_nodes:
-            in_state = out_state
             identifier_nodes = self.cfg.query(param_node, types='identifier', nest=False)
             if identifier_nodes:
-                node_name = text(identifier_nodes[0])
-                in_state[node_name] = set([param_node.start_point[0] + 1])
-                out_state = in_state
+                node_name = self.cfg.text(identifier_nodes[0])
+                out_state = out_state.set(self.def_uses.names[node_name], frozenset([param_node.start_point[0] + 1]))
         return out_state
 
     def create_ddg(self, node: Node, in_state: STATE) -> STATE:
-        in_state = copy.deepcopy(in_state)
+        # 状态是持久化的，直接传给子语句，不用复制
         if not node:
             return in_state
         if node.type == 'compound_statement':
@@ -120,12 +383,11 @@ class DDG:
                 in_state = out_state
         elif node.type == 'if_statement':   # if语句输出的状态需要合并True分支和False分支的状态，如果没有else，则False分支为if语句的in状态
             condition = node.child_by_field_name('condition')
-            id = Identifier(condition)
-            for id_node in id.ids:
+            id = self.def_uses.summary(condition)
+            for id_node in id.uses:
                 self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
             body = node.child_by_field_name('consequence')  # 获取if的主体部分
             true_path_state = self.create_ddg(body, in_state)
-            false_path_state = {}
             alternative = node.child_by_field_name('alternative')
             if alternative:
                 body = alternative.children[1]
@@ -135,8 +397,8 @@ class DDG:
                 in_state = self.merge_state(true_path_state, in_state)
         elif node.type == 'while_statement':        # 对于所有循环语句的状态，需要合并循环体的两次状态，因为循环体可能会执行多次，后面定义的语句可能会影响前面使用的语句
             condition = node.child_by_field_name('condition')
-            id = Identifier(condition)
-            for id_node in id.ids:
+            id = self.def_uses.summary(condition)
+            for id_node in id.uses:
                 self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
             body = node.child_by_field_name('body')
             loop_body_state_1 = self.create_ddg(body, in_state)
@@ -144,24 +406,24 @@ class DDG:
             in_state = self.merge_state(in_state, loop_body_state_1, loop_body_state_2)
         elif node.type == 'do_statement':
             condition = node.child_by_field_name('condition')
-            id = Identifier(condition)
+            id = self.def_uses.summary(condition)
             body = node.child_by_field_name('body')
             loop_body_state_1 = self.create_ddg(body, in_state)
             loop_body_state_2 = self.create_ddg(body, loop_body_state_1)
             in_state = self.merge_state(in_state, loop_body_state_1, loop_body_state_2)
-            for id_node in id.ids:
+            for id_node in id.uses:
                 self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
         elif node.type == 'for_statement':
             initializer = node.child_by_field_name('initializer')
             condition = node.child_by_field_name('condition')
             update = node.child_by_field_name('update')
-            id = Identifier(initializer)
-            for id_node in id.def_ids:
-                in_state[id_node] = set([node.start_point[0] + 1])
-            for id_node in id.ids:
+            id = self.def_uses.summary(initializer)
+            for id_node in id.defs:
+                in_state = in_state.set(id_node, frozenset([node.start_point[0] + 1]))
+            for id_node in id.uses:
                 self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
-            id = Identifier(condition)
-            for id_node in id.ids:
+            id = self.def_uses.summary(condition)
+            for id_node in id.uses:
                 self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
             out_state = self.create_ddg(update, in_state)
             body = node.child_by_field_name('body')
@@ -169,32 +431,29 @@ class DDG:
             loop_body_state_2 = self.create_ddg(body, loop_body_state_1)
             in_state = self.merge_state(in_state, loop_body_state_1, loop_body_state_2)
         elif node.type == 'switch_statement':
-            condition = text(node.child_by_field_name('condition'))
-            body = node.child_by_field_name('body')
-            int_state_copy = copy.deepcopy(in_state)
+            int_state_copy = in_state
             states = []
-            for case_node in body.children[1:-1]:
-                if case_node.type == 'comment' : continue # case_node是comment导致数组下标越界
+            for case_node in self.jumps.cases.get(node.id, []):    # 这个switch的case和default
                 index = 3 if case_node.children[0].type == 'case' else 2
                 case_value  = case_node.child_by_field_name('value')
                 if case_value:
-                    id = Identifier(case_value)
-                    for id_node in id.ids:
+                    id = self.def_uses.summary(case_value)
+                    for id_node in id.uses:
                         self.add_def_use_edge(in_state, id_node, node.start_point[0] + 1)
                 for child in case_node.children[index:]:
                     in_state = self.create_ddg(child, in_state)
                     states.append(in_state)
             in_state = self.merge_state(int_state_copy, *states)
         else:
-            Id = Identifier(node)
+            Id = self.def_uses.summary(node)
             # input(text(node))
             # input(Id)
-            for id in Id.ids:
+            for id in Id.uses:
                 self.add_def_use_edge(in_state, id, node.start_point[0] + 1)
             
-            for def_id in Id.def_ids:
+            for def_id in Id.defs:
                 self.add_def_use_edge(in_state, def_id, node.start_point[0] + 1)
-                in_state[def_id] = set([node.start_point[0] + 1])   # 对于这一行定义的节点，要Kill掉前面所有的定义状态
+                in_state = in_state.set(def_id, frozenset([node.start_point[0] + 1]))   # 对于这一行定义的节点，要Kill掉前面所有的定义状态
         # input(text(node))
         # input(in_state)
 
@@ -204,52 +463,181 @@ class DDG:
     def merge_state(self, in_state: STATE, *out_states: List[STATE]) -> STATE:   # 合并多个状态，取并集
         out_state = in_state
         for state in out_states:
-            for key, value in state.items():
-                if key in out_state:
-                    out_state[key] = out_state[key].union(value)
-                else:
-                    out_state[key] = value
+            out_state = out_state.merge(state)
         return out_state
 
     def add_def_use_edge(self, 
         state: STATE, 
-        varname: str, 
+        var: int, 
         cur_line: int
-    ) -> None:   # 增加def到use的边
-        if varname not in state:    
-            return
-        for line in state[varname]:
-            self.dict.add((varname, line, cur_line))
+    ) -> None:   # 增加def到use的边，var为变量id
+        for line in state.get(var):
+            self.dict.add((self.def_uses.name(var), line, cur_line))
+
+    def statement_effect(self, node: Node, case_lines: Dict[int, int]) -> Effect:
+        # CFG上一个语句节点对数据流的影响，def和use的规则和create_ddg中对应的分支相同，case_lines为case的id -> 所在switch的行号
+        line = node.start_point[0] + 1
+        if node.type == 'parameter_declaration':
+            identifier_nodes = self.cfg.query(node, types='identifier', nest=False)
+            return line, [], [], [self.def_uses.names[self.cfg.text(identifier_nodes[0])]] if identifier_nodes else []
+        elif node.type in ['if_statement', 'while_statement', 'do_statement']:
+            return line, [], list(self.def_uses.summary(node.child_by_field_name('condition')).uses), []
+        elif node.type == 'for_statement':  # 初始化的定义在条件和更新的使用之前，更新的定义在最后
+            initializer = self.def_uses.summary(node.child_by_field_name('initializer'))
+            condition = self.def_uses.summary(node.child_by_field_name('condition'))
+            update = self.def_uses.summary(node.child_by_field_name('update'))
+            uses = initializer.uses | condition.uses | update.uses | update.defs
+            return line, list(initializer.defs), list(uses), list(update.defs)
+        elif node.type == 'case_statement':     # case的值记在switch所在的行上
+            uses = self.def_uses.summary(node.child_by_field_name('value')).uses
+            return case_lines.get(node.id, line), [], list(uses), []
+        elif node.type in ['function_definition', 'switch_statement', 'labeled_statement']:     # label后的语句是单独的节点
+            return line, [], [], []
+        Id = self.def_uses.summary(node)
+        return line, [], list(Id.uses | Id.defs), list(Id.defs)
 
-    def convert_dict_to_ddg(self, graph: Graph) -> None:
+    def reaching_definitions(self, func_node: Node, graph: CompactGraph) -> None:
+        '''
+        在函数的CFG上用工作表迭代求到达定义，把(变量, 定义行, 使用行)加入self.dict
+        变量和定义点(变量, 行号)都编号为整数，状态是以定义点编号为位的Python int，
+        每个节点的gen/kill只算一次，节点的入状态变化时才把后继放回工作表，总时间为CFG的大小乘以迭代次数
+        '''
+        index = self.cfg.index
+        case_lines = {case_node.id: switch_node.start_point[0] + 1
+            for switch_node in index.query(func_node, types=['switch_statement'])
+            for case_node in self.jumps.cases.get(switch_node.id, [])}
+        vcount = graph.vcount()
+        ids = graph.nodes['id'].tolist()
+        effects: List[Effect] = [(0, [], [], [])] * vcount     # 函数节点和exit节点没有数据流
+        for v in range(vcount):
+            if ids[v] != 0:
+                effects[v] = self.statement_effect(index.nodes[index.order[ids[v]]], case_lines)
+        sites: Dict[Tuple[int, int], int] = {}      # (变量id, 定义行) -> 位
+        site_lines: List[int] = []
+        masks: Dict[int, int] = {}                   # 变量id -> 它所有定义点的位
+        def gen(varnames: List[int], line: int) -> int:
+            bits = 0
+            for varname in varnames:
+                site = sites.get((varname, line))
+                if site is None:
+                    site = sites[(varname, line)] = len(site_lines)
+                    site_lines.append(line)
+                    masks[varname] = masks.get(varname, 0) | 1 << site
+                bits |= 1 << site
+            return bits
+        def kill(varnames: List[int]) -> int:
+            bits = 0
+            for varname in varnames:
+                bits |= masks[varname]
+            return bits
+        gens = [(gen(before, line), gen(after, line)) for line, before, _, after in effects]
+        transfers = [(kill(before), before_gen, kill(after), after_gen)     # 变量的全部定义点都编号之后才能算kill
+            for (_, before, _, after), (before_gen, after_gen) in zip(effects, gens)]
+        layer = graph.layer('CFG')
+        successors = [layer.successors(v).tolist() for v in range(vcount)]
+        in_states, out_states = [0] * vcount, [0] * vcount
+        worklist = deque(reverse_postorder(successors, graph.find('function_definition')))
+        queued = [True] * vcount
+        while worklist:
+            v = worklist.popleft()
+            queued[v] = False
+            before_kill, before_gen, after_kill, after_gen = transfers[v]
+            out_state = (in_states[v] & ~before_kill | before_gen) & ~after_kill | after_gen
+            if out_state == out_states[v]:
+                continue
+            out_states[v] = out_state
+            for next_node in successors[v]:
+                merged = in_states[next_node] | out_state
+                if merged != in_states[next_node]:
+                    in_states[next_node] = merged
+                    if not queued[next_node]:
+                        worklist.append(next_node)
+                        queued[next_node] = True
+        for v, (line, _, uses, _) in enumerate(effects):
+            before_kill, before_gen, _, _ = transfers[v]
+            state = in_states[v] & ~before_kill | before_gen
+            for var in uses:
+                bits = state & masks.get(var, 0)
+                varname = self.def_uses.name(var)
+                while bits:
+                    bit = bits & -bits
+                    self.dict.add((varname, site_lines[bit.bit_length() - 1], line))
+                    bits ^= bit
+
+    def convert_dict_to_ddg(self, graph: CompactGraph) -> EdgeLayer:
+        # (变量, 行号)对应这一行第一个提到该变量（或以它为前缀的访问路径，例如变量a对应提到a->b的语句）的顶点
+        # 每一行的顶点只建一次索引，每个顶点提到的访问路径及其前缀只算一次，每个(变量, 行号)只查找一次
+        index, names = self.cfg.index, self.def_uses.names
+        ids = graph.nodes['id'].tolist()
+        rows: Dict[int, List[int]] = {}     # 行号 -> 这一行的顶点，按顶点顺序
+        for v, row in enumerate(graph.nodes['start_row'].tolist()):
+            rows.setdefault(row + 1, []).append(v)
+        mentions: Dict[int, Set[int]] = {}  # 顶点 -> 它提到的访问路径以及这些路径的所有前缀
+        def mentioned(v: int) -> Set[int]:
+            paths = mentions.get(v)
+            if paths is None:
+                paths = mentions[v] = set()
+                if ids[v] != 0:     # 函数节点和exit节点不提到变量
+                    _, before, uses, after = self.statement_effect(index.nodes[index.order[ids[v]]], {})
+                    for path in before + uses + after:
+                        while path > 0 and path not in paths:   # 沿trie向上加入前缀，已经加入的前缀的前缀也都已经加入
+                            paths.add(path)
+                            path = names.parents[path]
+            return paths
+        statements: Dict[Tuple[str, int], Optional[int]] = {}
+        def statement(varname: str, line: int) -> Optional[int]:
+            if (varname, line) not in statements:
+                statements[(varname, line)] = None
+                var = names.find(varname)
+                for v in rows.get(line, []):
+                    if var in mentioned(v):
+                        statements[(varname, line)] = v
+                        break
+            return statements[(varname, line)]
+        edges, labels = {}, []     # (def, use) -> 边的序号，和原来每加一条边就simplify一样，去掉自环，重边只保留第一条的标签
         for varname, line1, line2 in self.dict:
-            def_nodes = graph.vs.select(line=line1)
-            use_nodes = graph.vs.select(line=line2)
-            def_node, use_node = None, None
-            for node in def_nodes:
-                if varname in node['text']:
-                    def_node = node
-                    break
-            for node in use_nodes:
-                if varname in node['text']:
-                    use_node = node
-                    break
-            if not def_node or not use_node:
+            def_node, use_node = statement(varname, line1), statement(varname, line2)
+            if def_node is None or use_node is None or def_node == use_node:
                 continue
-            graph.add_edge(def_node.index, use_node.index, label=varname)
-            graph.simplify(combine_edges='first')
+            if (def_node, use_node) not in edges:
+                edges[(def_node, use_node)] = len(labels)
+                labels.append(varname)
+        return self.cfg.store.edge_layer(graph.vcount(), list(edges), labels)     # 所有边一次加入
 
-    @timer
-    def construct_ddg(self) -> None:
-        for i, (funcname, func_node) in enumerate(self.cfg.functions.items()):
-            self.cfg.func_num = i
-            funcname = text(self.cfg.query(func_node, types='function_declarator', nest=False)[0].child_by_field_name('declarator'))
-            print(f'constructing DDG for {funcname:>40}', end='\r')
+    def build_ddg(self, i: int, func_node: Node, graph: CompactGraph) -> EdgeLayer:
+        # 返回graph（第i个函数的CFG）上的数据依赖边
+        self.cfg.func_num = i
+        self.jumps = self.cfg.jump_targets(func_node)
+        if self.engine == 'worklist':
+            self.reaching_definitions(func_node, graph)
+        else:
             init_state = self.init_func_state(func_node)
             body = func_node.child_by_field_name('body')
             self.create_ddg(body, init_state)
-            self.convert_dict_to_ddg(self.ddgs[funcname])
-            self.dict.clear()
+        layer = self.convert_dict_to_ddg(graph)
+        self.dict.clear()
+        return layer
+
+    def function_ddg(self, funcname: str) -> CompactGraph:
+        '''funcname的DDG，第一次使用时才构建这个函数的CFG和DDG'''
+        if funcname not in self.ddgs:
+            cfg = self.cfg.function_cfg(funcname)
+            layer = self.build_ddg(self.cfg.func_nums[funcname], self.cfg.functions[funcname], cfg)
+            self.ddgs[funcname] = cfg.overlay(['DDG'], DDG=layer)
+        return self.ddgs[funcname]
+
+    @timer
+    def construct_ddg(self, workers: int = 1) -> None:
+        # workers大于1时，函数分到多个进程中构建
+        if workers > 1 and len(self.cfg.functions) > 1:
+            payloads = self.cfg.map_functions(partial(ddg_task, engine=self.engine), workers)
+            for funcname, payload in zip(self.cfg.functions, payloads):
+                layer = payload_layer(payload, self.cfg.store)
+                self.ddgs.setdefault(funcname, self.cfg.function_cfg(funcname).overlay(['DDG'], DDG=layer))
+        else:
+            for funcname in self.cfg.functions:
+                print(f'constructing DDG for {funcname:>40}', end='\r')
+                self.function_ddg(funcname)
         print(f'{"finish constructing DDG":-^70}')
 
     def see_graph(self, 
@@ -265,6 +653,36 @@ class DDG:
                 dot.render('pdf/' + funcname, view=view, cleanup=True)
 
 
+def ddg_task(task: FunctionTask, engine: Literal['ast', 'worklist'] = 'ast') -> LayerPayload:
+    # 在工作进程中先构建函数的CFG，再在CFG的顶点上构建DDG边，只传回DDG边
+    i, _, start_byte, end_byte = task
+    cfg = current_worker()
+    func_node = cfg.function_at(start_byte, end_byte)
+    graph = cfg.build_cfg(i, func_node)
+    return layer_payload(DDG(cfg, engine).build_ddg(i, func_node, graph), cfg.store)
+
+def benchmark_ddg(depths: List[int] = [2, 4, 6, 8, 10], repeat: int = 3) -> None:
+    '''在循环嵌套depths层的函数上统计两种engine求数据流的耗时，ast每层循环体分析两次，耗时随嵌套层数指数增长'''
+    for depth in depths:
+        loops = ''.join(f'for (i{d} = 0; i{d} < n; i{d}++) {{ x = x + i{d}; ' for d in range(depth))
+        cfg = CFG('c', f'int f(int n) {{ int x = 0; {loops}{"}" * depth} return x; }}')
+        func_node = cfg.functions['f']
+        graph = cfg.function_cfg('f')
+        times = {}
+        for engine in ['ast', 'worklist']:
+            ddg = DDG(cfg, engine)
+            ddg.cfg.func_num, ddg.jumps = 0, cfg.jump_targets(func_node)
+            start = time.time()
+            for _ in range(repeat):
+                ddg.dict.clear()
+                if engine == 'worklist':
+                    ddg.reaching_definitions(func_node, graph)
+                else:
+                    ddg.create_ddg(func_node.child_by_field_name('body'), ddg.init_func_state(func_node))
+            times[engine] = (time.time() - start) / repeat * 1000
+        print(f'{depth:>3} nested loops {graph.vcount():>4} nodes  ast: {times["ast"]:.2f}ms  worklist: {times["worklist"]:.2f}ms')
+
+
 if __name__ == '__main__':
     code = r'{}'.format(open('test.c', 'r', encoding='utf-8').read())
     cfg = CFG('c', code)
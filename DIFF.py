@@ -1,20 +1,22 @@
 from CFG import *
+from CDG import *
+from DDG import def_use_cache
 from typing import Set
 # diff文件格式参考 https://www.ruanyifeng.com/blog/2012/08/how_to_read_diff.html
-from typing import Dict
+from typing import Dict, Optional
 import difflib
 from collections import defaultdict
 import logging
 import copy
 
-def Identifier(node: Node) -> Set[str]:
+def Identifier(node: Node, source: Optional[SourceBuffer] = None) -> Set[str]:
     ids = set()
     def helper(node):
         if not node:
             return
         if node.type == 'identifier' and node.parent.type != 'call_expression':
-            if not text(node).replace('_','').isupper():
-                ids.add(text(node))
+            if not text(node, source).replace('_','').isupper():
+                ids.add(text(node, source))
         elif node.type == 'declaration':
             for child in node.children[1:-1]:
                 if child.type != ',':
@@ -24,9 +26,9 @@ def Identifier(node: Node) -> Set[str]:
         elif node.type == 'pointer_declarator':
             helper(node.children[1])
         elif node.type == 'field_expression':
-            ids.add(text(node).replace(' ', ''))
+            ids.add(text(node, source).replace(' ', ''))
         elif node.type == 'subscript_expression':
-            ids.add(text(node).replace(' ', ''))
+            ids.add(text(node, source).replace(' ', ''))
         elif node.type == 'array_declarator':
             helper(node.children[0])
             helper(node.children[2])
@@ -44,23 +46,145 @@ def Identifier(node: Node) -> Set[str]:
     helper(node)
     return ids
 
+class CV:
+    # 关键变量，var相同且类型相同时认为是同一个关键变量
+    def __init__(self, var: str, line: int, type: str, change_type: str):
+        self.var = var
+        self.line = line
+        self.type = type
+        self.change_type = change_type
+
+    def __eq__(self, other):
+        return isinstance(other, CV) and self.var == other.var and self.type == other.type
+
+    def __hash__(self):
+        return hash((self.var, self.type))
+
+    def __repr__(self):
+        return f'CV({self.var}, {self.line}, {self.type}, {self.change_type})'
+
+EDIT = Tuple[int, int, int, Tuple[int, int], Tuple[int, int], Tuple[int, int]]
+
+def line_ranges(code: bytes, rows: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # 每个(起始行, 行数)对应的字节区间，行号从0开始，diff和代码对不上时行号可能越界，截断到代码末尾
+    offsets = line_starts(code) + [len(code)]
+    last = len(offsets) - 1
+    return [(offsets[min(row, last)], offsets[min(row + count, last)]) for row, count in rows]
+
 class DIFF(AST):
-    def __init__(self, language, code, diff_path):
+    def __init__(self, language, old_code, new_code, diff_path, incremental: bool = False):
+        '''
+        incremental为True时，NEW的语法树由OLD的语法树按照diff块edit后增量解析得到，
+        只有和修改区域或changed_ranges相交的NEW函数才会被重新分析，
+        OLD的语法树被edit之后位置都不再对应OLD的代码，OLD侧的分析都在增量解析之前完成，增量解析成功后old_ast被释放并置为None
+        '''
         self.language = language
         self.diff_path = diff_path #主要用于记录报错信息
+        self.dominance_cdgs: Dict[str, CDG] = {}    # change_type -> 用来查询（后）支配关系的CDG
         self.old_codes = old_code.split('\n')
         self.new_codes = new_code.split('\n')
         self.old_ast = AST(language, old_code)
-        self.new_ast = AST(language, new_code)
         # 记录当前diff中的关键变量
         self.old_cv = defaultdict(list) # {line:[cv]}
         self.new_cv = defaultdict(list)
         with open(diff_path, 'r', encoding='utf-8') as f:
             diff = f.read()
-        old_lines, new_lines, func_names = self.preprocess(diff)
-        for i, old_line in enumerate(old_lines):
-            func_node = self.functions[func_names[i]]
-            self.get_cruial_variable_lines(old_line, func_node)
+        old_lines, new_lines, _ = self.preprocess(diff)
+        # OLD和NEW两侧都用diff块的字节区间找修改所在的函数，而不是diff块开头（可能是上一个函数的结尾）所在的函数
+        old_ranges = line_ranges(self.old_ast.tree.text, [(old_row, old_count) for old_row, old_count, _, _ in self.edit_blocks])
+        self.func_names = self.get_changed_functions(self.old_ast, old_ranges)     # OLD中和diff块相交的函数
+        self.old_cv.update(self.hunk_cruial_variables(self.old_ast, self.func_names, old_lines, 'delete'))
+        self.new_ast = None
+        if incremental:
+            self.new_ast = self.incremental_parse(old_code, new_code)
+            if self.new_ast is not None:    # OLD的语法树已经被edit，不再保留
+                self.old_ast.close()
+                self.old_ast = None
+        if self.new_ast is None:
+            self.new_ast = AST(language, new_code)
+            self.changed_ranges = line_ranges(self.new_ast.tree.text, [(new_row, new_count) for _, _, new_row, new_count in self.edit_blocks])
+        self.changed_functions = self.get_changed_functions(self.new_ast, self.changed_ranges)
+        self.new_cv.update(self.hunk_cruial_variables(self.new_ast, self.changed_functions, new_lines, 'add'))
+        self.remove_duplicates(self.old_cv, self.new_cv)
+
+    def close(self) -> None:
+        # 释放OLD和NEW的语法树，old_cv和new_cv保留
+        for ast in [self.old_ast, self.new_ast]:
+            if ast is not None:
+                ast.close()
+        for cdg in self.dominance_cdgs.values():
+            cdg.cfg.close()
+            cdg.close()
+        self.dominance_cdgs = {}
+        self.changed_functions = []
+
+    def dominance(self, change_type: Literal['delete', 'add']) -> CDG:
+        '''
+        OLD（delete）或NEW（add）代码上的CDG，用dominates、post_dominates、common_post_dominator按行号筛选关键变量所在的语句，
+        代码在第一次调用时才重新解析，每个函数的CFG和（后）支配树在第一次查询这个函数时才构建
+        '''
+        if change_type not in self.dominance_cdgs:
+            code = '\n'.join(self.old_codes if change_type == 'delete' else self.new_codes)
+            self.dominance_cdgs[change_type] = CDG(CFG(self.language, code))
+        return self.dominance_cdgs[change_type]
+
+    def hunk_edits(self, old_code: bytes, new_code: bytes) -> Optional[List[EDIT]]:
+        # 将diff块中连续修改的行转换成tree-sitter的edit，坐标为依次应用前面的edit之后的坐标
+        # 如果diff和代码对不上，返回None
+        old_offsets, new_offsets = line_starts(old_code) + [len(old_code)], line_starts(new_code) + [len(new_code)]
+        edits: List[EDIT] = []
+        old_prev, new_prev = 0, 0
+        for old_row, old_count, new_row, new_count in self.edit_blocks:
+            if old_row + old_count >= len(old_offsets) or new_row + new_count >= len(new_offsets):
+                return None
+            old_start, old_end = old_offsets[old_row], old_offsets[old_row + old_count]
+            new_start, new_end = new_offsets[new_row], new_offsets[new_row + new_count]
+            if old_start < old_prev or old_code[old_prev:old_start] != new_code[new_prev:new_start]:   # 两个修改之间的代码应该完全一致
+                return None
+            edits.append((new_start, new_start + old_end - old_start, new_end, (new_row, 0), (new_row + old_count, 0), (new_row + new_count, 0)))
+            old_prev, new_prev = old_end, new_end
+        if old_code[old_prev:] != new_code[new_prev:]:
+            return None
+        return edits
+
+    def incremental_parse(self, old_code: str, new_code: str) -> Optional[AST]:
+        # 在OLD的语法树上应用diff的edit，再增量解析NEW，changed_ranges加上edit的区域即为NEW中需要重新分析的区域
+        old_tree = self.old_ast.tree
+        edits = self.hunk_edits(old_tree.text, bytes(new_code, 'utf8'))
+        if edits is None:
+            logging.debug(f'diff does not match the code, fall back to full parse: {self.diff_path}')
+            return None
+        for edit in edits:
+            old_tree.edit(*edit)
+        new_ast = AST(self.language, new_code, old_tree=old_tree)
+        self.changed_ranges = [(edit[0], edit[2]) for edit in edits]
+        self.changed_ranges += [(r.start_byte, r.end_byte) for r in old_tree.changed_ranges(new_ast.tree)]
+        return new_ast
+
+    def hunk_cruial_variables(self, 
+        ast: AST, 
+        funcnames: List[str], 
+        hunk_lines: List[List[int]], 
+        change_type: Literal['delete', 'add']
+    ) -> Dict[int, List[CV]]:
+        # 每个diff块修改的行中，在funcnames这些函数里的关键变量
+        cv = {}
+        for lines in hunk_lines:
+            for funcname in funcnames:
+                func_node = ast.functions[funcname]
+                if any(func_node.start_point[0] < line <= func_node.end_point[0] + 1 for line in lines):
+                    cv.update(self.get_cruial_variable_lines(lines, func_node, change_type))
+        return cv
+
+    def get_changed_functions(self, ast: AST, changed_ranges: List[Tuple[int, int]]) -> List[str]:
+        # 找到和修改区域相交的函数，删除产生的空区域也算相交
+        changed_functions = []
+        for funcname, func_node in ast.functions.items():
+            for start, end in changed_ranges:
+                if start <= func_node.end_byte and end >= func_node.start_byte:
+                    changed_functions.append(funcname)
+                    break
+        return changed_functions
 
     def preprocess(self, diff):
         diff_lines = diff.split('\n') 
@@ -74,6 +198,7 @@ class DIFF(AST):
         diff_blocks.append(diff_lines[diff_start_line:])
         # 提取出每一个diff_block中old line和new line以及对应文件的行号
         old_lines, new_lines, func_names = [], [], []
+        self.edit_blocks: List[Tuple[int, int, int, int]] = []  # 连续修改的行 (old_row, old_count, new_row, new_count)，行号从0开始
         for block in diff_blocks:
             diff_info = block[0].split('@@')[1].strip()
             old, new = diff_info.split(' ')
@@ -87,45 +212,61 @@ class DIFF(AST):
                         logging.debug(f"this hunk donot find a function {diff_info} {node.text}")
                     else:
                         funcnode = self.old_ast.query(node, types='function_declarator', nest=False)[0]
-                        func_name = text(funcnode.child_by_field_name('declarator'))
-                        func_names.append(func_name)
+                        func_name = self.old_ast.text(funcnode.child_by_field_name('declarator'))
             if func_name == '':
                 logging.debug(f'can not get func_name for this diff_hunk: {diff_info}')
+            func_names.append(func_name)
             old_offset, new_offset = 0, 0
             old_line, new_line = [], []
+            # 行数为0时，起始行号表示的是在这一行之后插入/删除
+            old_row = old_start_line - 1 if old.split(',')[-1] != '0' else old_start_line
+            new_row = new_start_line - 1 if new.split(',')[-1] != '0' else new_start_line
+            edit_block = None
             for line in block[1:]:
+                if line.startswith('\\'):    # \ No newline at end of file
+                    continue
+                if line.startswith('+') or line.startswith('-'):
+                    if edit_block is None:
+                        edit_block = [old_row + old_offset, 0, new_row + new_offset, 0]
+                        self.edit_blocks.append(edit_block)
+                else:
+                    edit_block = None
                 if line.startswith('+'):
                     new_line.append(new_start_line+new_offset)
                     new_offset += 1
+                    edit_block[3] += 1
                 elif line.startswith('-'):
                     old_line.append(old_start_line+old_offset)
                     old_offset += 1
+                    edit_block[1] += 1
                 else:
                     new_offset += 1
                     old_offset += 1
             old_lines.append(old_line)
             new_lines.append(new_line)
+        self.edit_blocks = [tuple(edit_block) for edit_block in self.edit_blocks]
         return old_lines, new_lines, func_names
             
-    def get_cruial_variable_lines(self, lines, func_node):
+    def get_cruial_variable_lines(self, lines, func_node, change_type: Literal['delete', 'add']):
         # 提取出某一行的关键变量，包含声明语句、赋值语句、函数调用语句和控制语句
         if change_type =='delete':
             ast_node = self.old_ast
         else:
             ast_node = self.new_ast
+        def_uses = def_use_cache(ast_node)     # 每个语句的关键变量在一个文件中只提取一次
         def helper(node):
             id_nodes = defaultdict(list)
             if node.type == 'function_declarator' and node.parent != None and node.parent.type != 'pointer_declarator':
                 param_nodes = ast_node.query(node, 'parameter_declaration')
                 for param_node in param_nodes:
-                    ids = Identifier(param_node)
+                    ids = def_uses.decode(def_uses.extract(Identifier, param_node))
                     for id in ids:
                         line  =node.start_point[0] + 1
                         id_nodes[line].append(CV(id,line,'declaration',change_type))
                 body_id_nodes = helper(node.parent.child_by_field_name('body'))
                 id_nodes.update(body_id_nodes)
             elif node.type == 'declaration':
-                ids = Identifier(node)
+                ids = def_uses.decode(def_uses.extract(Identifier, node))
                 for id in ids:
                     line = node.start_point[0] + 1
                     id_nodes[line].append(CV(id,line,'declaration',change_type))
@@ -133,7 +274,7 @@ class DIFF(AST):
                 if node.type == 'expression_statement':
                     node = node.children[0]
                 if node.type == 'assignment_expression':
-                    ids = Identifier(node)
+                    ids = def_uses.decode(def_uses.extract(Identifier, node))
                     line = node.start_point[0] + 1
                     for id in ids:
                         id_nodes[line].append(CV(id,line,'assignment',change_type))
@@ -144,13 +285,13 @@ class DIFF(AST):
                         right_node_ids = helper(right_node)
                         id_nodes[line].extend(right_node_ids[line])
                 if node.type == 'call_expression':
-                    ids = Identifier(node)
+                    ids = def_uses.decode(def_uses.extract(Identifier, node))
                     for id in ids:
                         line = node.start_point[0] + 1
                         id_nodes[line].append(CV(id,line,'call_expression',change_type))               
             elif node.type in ['if_statement', 'while_statement', 'for_statement', 'do_statement']:
                 condition = node.child_by_field_name('condition')
-                ids = Identifier(condition)
+                ids = def_uses.decode(def_uses.extract(Identifier, condition))
                 for id in ids:
                     line = node.start_point[0] + 1
                     id_nodes[line].append(CV(id,line,'control_statement',change_type))
@@ -245,5 +386,5 @@ if __name__ == '__main__':
     old_code = r'{}'.format(open('./data/CVE-2013-6376_recalculate-apic-map/CVE-2013-6376_CWE-189_recalculate-apic-map_1.c_OLD.c', 'r', encoding='utf-8').read())
     new_code = r'{}'.format(open('./data/CVE-2013-6376_recalculate-apic-map/CVE-2013-6376_CWE-189_recalculate-apic-map_1.c_NEW.c', 'r', encoding='utf-8').read())
     logging.basicConfig(filename='./diff.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    diff = DIFF('c', old_code,new_code, './data/CVE-2013-6376_recalculate-apic-map/CVE-2013-6376_CWE-189_recalculate-apic-map_1.c.diff')
+    diff = DIFF('c', old_code, new_code, './data/CVE-2013-6376_recalculate-apic-map/CVE-2013-6376_CWE-189_recalculate-apic-map_1.c.diff')
     print(diff)
\ No newline at end of file
@@ -0,0 +1,293 @@
+from AST import *
+
+GRAPH_DTYPE = np.dtype([
+    ('type', np.int32),             # 节点类型在GraphStore.strings中的编号
+    ('func', np.int32),             # 所属函数的序号
+    ('id', np.int64),               # tree-sitter的node.id，函数节点和exit节点为0
+    ('start_byte', np.int32),       # exit节点的字节区间和位置都为-1
+    ('end_byte', np.int32),
+    ('start_row', np.int32),
+    ('start_column', np.int32),
+    ('end_row', np.int32),
+    ('end_column', np.int32),
+    ('text', np.int32),             # 文本在GraphStore.strings中的编号，-1表示文本就是源代码的[start_byte, end_byte)
+    ('is_branch', np.bool_),
+])
+EDGE_KINDS = ['CFG', 'DDG', 'CDG', 'CALL', 'RETURN']
+LayerPayload = Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]     # (indptr, targets, labels, 用到的字符串)
+GraphPayload = Tuple[np.ndarray, Dict[str, LayerPayload], Tuple[str, ...], List[str]]  # (顶点表, 每种边, 看到的边的种类, 用到的字符串)
+
+class EdgeLayer:
+    '''
+    一种边的CSR邻接表，顶点v的出边终点为targets[indptr[v]:indptr[v+1]]，同一个顶点的出边保持插入的顺序
+    labels为边的标签在GraphStore.strings中的编号，-1表示没有标签
+    '''
+    def __init__(self, indptr: np.ndarray, targets: np.ndarray, labels: np.ndarray):
+        self.indptr = indptr
+        self.targets = targets
+        self.labels = labels
+        self._reverse: Optional['EdgeLayer'] = None
+
+    @classmethod
+    def from_arrays(cls,
+        vcount: int,
+        sources: np.ndarray,
+        targets: np.ndarray,
+        labels: np.ndarray
+    ) -> 'EdgeLayer':
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(vcount + 1, dtype=np.int32)
+        np.cumsum(np.bincount(sources, minlength=vcount), out=indptr[1:])
+        return cls(indptr, targets[order], labels[order])
+
+    @classmethod
+    def from_edges(cls,
+        vcount: int,
+        edges: List[Tuple[int, int]],
+        labels: Optional[List[int]] = None
+    ) -> 'EdgeLayer':
+        sources = np.fromiter((source for source, _ in edges), dtype=np.int32, count=len(edges))
+        targets = np.fromiter((target for _, target in edges), dtype=np.int32, count=len(edges))
+        labels = np.full(len(edges), -1, dtype=np.int32) if labels is None else np.asarray(labels, dtype=np.int32)
+        return cls.from_arrays(vcount, sources, targets, labels)
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def vcount(self) -> int:
+        return len(self.indptr) - 1
+
+    def sources(self) -> np.ndarray:
+        return np.repeat(np.arange(self.vcount(), dtype=np.int32), np.diff(self.indptr))
+
+    def edgelist(self) -> List[Tuple[int, int]]:
+        return list(zip(self.sources().tolist(), self.targets.tolist()))
+
+    def successors(self, v: int) -> np.ndarray:
+        return self.targets[self.indptr[v]:self.indptr[v + 1]]
+
+    def reverse(self) -> 'EdgeLayer':
+        '''所有边反向后的CSR，即每个顶点的入边，第一次使用时建立'''
+        if self._reverse is None:
+            self._reverse = EdgeLayer.from_arrays(self.vcount(), self.targets, self.sources(), self.labels)
+        return self._reverse
+
+    def predecessors(self, v: int) -> np.ndarray:
+        return self.reverse().successors(v)
+
+class GraphStore:
+    '''
+    一个文件中所有CompactGraph共用的字符串表，节点类型、边的标签和不是源代码片段的文本都只保存一次，
+    源代码片段的文本通过ast的SourceBuffer按需解码
+    '''
+    def __init__(self, ast: AST):
+        self.ast = ast
+        self.strings = Vocabulary()
+
+    def intern(self, string: Optional[str]) -> int:
+        return -1 if string is None else self.strings[string]
+
+    def string(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.strings.tokens[code]
+
+    def edge_layer(self,
+        vcount: int,
+        edges: List[Tuple[int, int]],
+        labels: Optional[List[Optional[str]]] = None
+    ) -> EdgeLayer:
+        return EdgeLayer.from_edges(vcount, edges, None if labels is None else [self.intern(label) for label in labels])
+
+    def graph(self,
+        func_num: int,
+        vertices: List[Dict[str, Any]],
+        edges: List[Tuple[int, int]],
+        labels: List[str]
+    ) -> 'CompactGraph':
+        '''由CFG的顶点属性字典和边构建第func_num个函数的CompactGraph，字典只在这里读一次，不会保存'''
+        source = self.ast.source
+        rows = []
+        for vertex in vertices:
+            if vertex['type'] == 'function_exit':
+                rows.append((self.intern('function_exit'), func_num, 0, -1, -1, -1, -1, -1, -1, self.intern(vertex['text']), False))
+                continue
+            start_byte, end_byte = vertex['start_byte'], vertex['end_byte']
+            text = -1 if vertex['text'] == source.decode(start_byte, end_byte) else self.intern(vertex['text'])
+            id = 0 if vertex['type'] == 'function_definition' else int(vertex['id'])
+            rows.append((self.intern(vertex['type']), func_num, id, start_byte, end_byte, *vertex['start_point'], *vertex['end_point'], text, vertex['is_branch']))
+        nodes = np.array(rows, dtype=GRAPH_DTYPE)
+        return CompactGraph(self, nodes, {'CFG': self.edge_layer(len(nodes), edges, labels)}, ('CFG',))
+
+class CompactGraph:
+    '''
+    一个函数（或跨函数）的图，顶点属性按列保存在GRAPH_DTYPE的nodes中，每种边是一个EdgeLayer，
+    由CFG派生的DDG、CDG、PDG共用同一个nodes和已有的边，只是kinds（看到的边的种类）不同，不复制顶点
+    '''
+    def __init__(self,
+        store: GraphStore,
+        nodes: np.ndarray,
+        layers: Dict[str, EdgeLayer],
+        kinds: Tuple[str, ...]
+    ):
+        self.store = store
+        self.nodes = nodes
+        self.layers = layers
+        self.kinds = kinds
+
+    def overlay(self, kinds: List[str], **layers: EdgeLayer) -> 'CompactGraph':
+        '''共用顶点和已有的边，返回只看到kinds这几种边的图，layers为新加的边'''
+        return CompactGraph(self.store, self.nodes, {**self.layers, **layers}, tuple(kinds))
+
+    @classmethod
+    def concat(cls, graphs: List['CompactGraph'], store: Optional[GraphStore] = None) -> 'CompactGraph':
+        '''
+        将多个函数的图拼成一个图，顶点依次排列，边的端点加上所在图的偏移
+        store默认为第一个图的字符串表，graphs为空（文件中没有函数）时返回空图，没有给出store时使用一个空的字符串表
+        '''
+        if store is None:
+            store = graphs[0].store if graphs else GraphStore(None)
+        offsets = np.cumsum([0] + [graph.vcount() for graph in graphs])
+        vcount = int(offsets[-1])
+        kinds = tuple(dict.fromkeys(kind for graph in graphs for kind in graph.kinds))
+        layers = {}
+        for kind in kinds:
+            parts = [(graph.layers[kind], offset) for graph, offset in zip(graphs, offsets.tolist()) if kind in graph.layers]
+            sources = np.concatenate([layer.sources() + offset for layer, offset in parts]).astype(np.int32)
+            targets = np.concatenate([layer.targets + offset for layer, offset in parts]).astype(np.int32)
+            labels = np.concatenate([layer.labels for layer, _ in parts])
+            layers[kind] = EdgeLayer.from_arrays(vcount, sources, targets, labels)
+        nodes = np.concatenate([graph.nodes for graph in graphs]) if graphs else np.zeros(0, dtype=GRAPH_DTYPE)
+        return cls(store, nodes, layers, kinds)
+
+    def vcount(self) -> int:
+        return len(self.nodes)
+
+    def ecount(self) -> int:
+        return sum(len(self.layers[kind]) for kind in self.kinds if kind in self.layers)
+
+    def layer(self, kind: str) -> EdgeLayer:
+        if kind not in self.layers:
+            return EdgeLayer.from_edges(self.vcount(), [])
+        return self.layers[kind]
+
+    def type(self, v: int) -> str:
+        return self.store.strings.tokens[self.nodes['type'][v]]
+
+    def text(self, v: int) -> str:
+        node = self.nodes[v]
+        if node['text'] < 0:
+            return self.store.ast.source.decode(int(node['start_byte']), int(node['end_byte']))
+        return self.store.strings.tokens[node['text']]
+
+    def id(self, v: int) -> str:
+        node = self.nodes[v]
+        type = self.store.strings.tokens[node['type']]
+        if type == 'function_definition':
+            return str(node['func'])
+        elif type == 'function_exit':
+            return f'-{node["func"]}'
+        return str(node['id'])
+
+    def line(self, v: int) -> Optional[int]:
+        row = int(self.nodes['start_row'][v])
+        return None if row < 0 else row + 1
+
+    def select(self, line: int) -> List[int]:
+        '''起始行为line的所有顶点'''
+        return np.flatnonzero(self.nodes['start_row'] == line - 1).tolist()
+
+    def find(self, type: str) -> int:
+        '''第一个类型为type的顶点'''
+        return int(np.flatnonzero(self.nodes['type'] == self.store.strings.ids.get(type, -1))[0])
+
+    def attributes(self) -> Dict[str, List[Any]]:
+        '''和原来igraph图中一样的顶点属性列，exit节点只有type、text和id'''
+        nodes, strings = self.nodes, self.store.strings.tokens
+        types = [strings[code] for code in nodes['type'].tolist()]
+        ids = [self.id(v) for v in range(self.vcount())]
+        attributes = {
+            'type': types,
+            'start_byte': nodes['start_byte'].tolist(),
+            'end_byte': nodes['end_byte'].tolist(),
+            'start_point': list(zip(nodes['start_row'].tolist(), nodes['start_column'].tolist())),
+            'end_point': list(zip(nodes['end_row'].tolist(), nodes['end_column'].tolist())),
+            'text': [self.text(v) for v in range(self.vcount())],
+            'id': ids,
+            'line': (nodes['start_row'] + 1).tolist(),
+            'is_branch': nodes['is_branch'].tolist(),
+        }
+        for v in np.flatnonzero(nodes['id'] == 0).tolist():
+            if types[v] == 'function_exit':
+                for key in ['start_byte', 'end_byte', 'start_point', 'end_point', 'line', 'is_branch']:
+                    attributes[key][v] = None
+        attributes['name'] = ids
+        return attributes
+
+    def edges(self) -> Iterator[Tuple[int, int, Optional[str], str]]:
+        '''按kinds的顺序返回(起点, 终点, 标签, 种类)'''
+        for kind in self.kinds:
+            if kind not in self.layers:
+                continue
+            layer = self.layers[kind]
+            for source, target, label in zip(layer.sources().tolist(), layer.targets.tolist(), layer.labels.tolist()):
+                yield source, target, self.store.string(label), kind
+
+    def to_igraph(self) -> Graph:
+        '''
+        生成带有全部属性的igraph图，用于画图和切片等需要igraph接口的地方
+        只有一种边时边属性为label，有多种边时再加上type，没有标签的边label为''
+        '''
+        edges, labels, types = [], [], []
+        for source, target, label, kind in self.edges():
+            edges.append((source, target))
+            labels.append(label)
+            types.append(kind)
+        edge_attrs = {'label': labels}
+        if len(self.kinds) > 1:
+            edge_attrs = {'label': ['' if label is None else label for label in labels], 'type': types}
+        return Graph(n=self.vcount(), edges=edges, directed=True, vertex_attrs=self.attributes(), edge_attrs=edge_attrs)
+
+def as_igraph(graph: Union[CompactGraph, Graph]) -> Graph:
+    return graph.to_igraph() if isinstance(graph, CompactGraph) else graph
+
+def pack_strings(store: GraphStore, codes: List[np.ndarray]) -> Tuple[List[np.ndarray], List[str]]:
+    '''将字符串编号换成在返回的字符串列表中的位置，-1保持不变，用于在进程间传递'''
+    used = np.unique(np.concatenate(codes)) if codes else np.zeros(0, dtype=np.int32)
+    used = used[used >= 0]
+    packed = [np.where(code >= 0, np.searchsorted(used, code), -1).astype(np.int32) for code in codes]
+    return packed, [store.strings.tokens[code] for code in used.tolist()]
+
+def unpack_strings(store: GraphStore, codes: List[np.ndarray], strings: List[str]) -> List[np.ndarray]:
+    '''pack_strings的逆过程，字符串在store中重新编号'''
+    remap = np.array([store.intern(string) for string in strings] + [-1], dtype=np.int32)  # 最后的-1对应编号-1
+    return [remap[code] for code in codes]
+
+def layer_payload(layer: EdgeLayer, store: GraphStore) -> LayerPayload:
+    (labels,), strings = pack_strings(store, [layer.labels])
+    return layer.indptr, layer.targets, labels, strings
+
+def payload_layer(payload: LayerPayload, store: GraphStore) -> EdgeLayer:
+    indptr, targets, labels, strings = payload
+    return EdgeLayer(indptr, targets, unpack_strings(store, [labels], strings)[0])
+
+def graph_payload(graph: CompactGraph) -> GraphPayload:
+    '''
+    将CompactGraph转换成可以在进程间传递的形式，边的标签单独打包
+    顶点的id（node.id）换成节点在先序遍历中的位置，另一个进程解析同一份代码后再换回自己的node.id
+    '''
+    store = graph.store
+    nodes = graph.nodes.copy()
+    regular = nodes['id'] != 0      # 函数节点和exit节点没有node.id
+    order = store.ast.index.order
+    nodes['id'][regular] = [order[id] for id in nodes['id'][regular].tolist()]
+    (nodes['type'], nodes['text']), strings = pack_strings(store, [nodes['type'], nodes['text']])
+    layers = {kind: layer_payload(layer, store) for kind, layer in graph.layers.items()}
+    return nodes, layers, graph.kinds, strings
+
+def payload_graph(payload: GraphPayload, store: GraphStore) -> CompactGraph:
+    '''graph_payload的逆过程'''
+    nodes, layers, kinds, strings = payload
+    regular = nodes['id'] != 0
+    index_nodes = store.ast.index.nodes
+    nodes['id'][regular] = [index_nodes[i].id for i in nodes['id'][regular].tolist()]
+    nodes['type'], nodes['text'] = unpack_strings(store, [nodes['type'], nodes['text']], strings)
+    return CompactGraph(store, nodes, {kind: payload_layer(layer, store) for kind, layer in layers.items()}, kinds)
@@ -5,35 +5,68 @@ from DDG import *
 from igraph import Graph
 
 class PDG(CFG):
-    pdgs: Dict[str, Graph] = {}         # 每个函数的PDG
-    ipdg: Graph = None                  # 跨函数PDG
+    pdgs: Dict[str, CompactGraph]       # 每个函数的PDG，CFG上DDG和CDG两层边的叠加
+    ipdg: Optional[Graph]               # 跨函数PDG
 
-    def __init__(self, language: str, code: str):
+    def __init__(self, 
+        language: str, 
+        code: str, 
+        workers: int = 1, 
+        lazy: bool = False, 
+        ddg_engine: Literal['ast', 'worklist'] = 'ast'
+    ):
+        # workers大于1时，CFG、DDG和CDG的构建分到多个进程中
+        # lazy为True时只解析代码，每个函数的CFG、DDG、CDG和CG属性在function(funcname)第一次用到时才构建
+        # ddg_engine为worklist时DDG在CFG上用工作表迭代求到达定义，见DDG.reaching_definitions
         super().__init__(language, code)
-        self.construct_cfg()
-        self.ddg = DDG(self)
-        self.ddg.construct_ddg()
+        self.pdgs = {}
+        self.ipdg = None
+        self.ddg = DDG(self, ddg_engine)
         self.cdg = CDG(self)
-        self.cdg.construct_cdg()
         self.cg = CG(self)
-        self.cg.construct_cg()
+        if not lazy:
+            self.construct_cfg(workers=workers)
+            self.ddg.construct_ddg(workers=workers)
+            self.cdg.construct_cdg(workers=workers)
+            self.cg.construct_cg()
+
+    def close(self) -> None:
+        for analysis in [self.ddg, self.cdg, self.cg]:
+            analysis.close()
+        self.pdgs = {}
+        self.ipdg = None
+        super().close()
+
+    def function(self, funcname: str) -> CompactGraph:
+        '''funcname的PDG，第一次使用时才构建这个函数的CFG、DDG和CDG'''
+        if funcname not in self.pdgs:
+            ddg, cdg = self.ddg.function_ddg(funcname), self.cdg.function_cdg(funcname)
+            self.pdgs[funcname] = self.function_cfg(funcname).overlay(['DDG', 'CDG'], DDG=ddg.layer('DDG'), CDG=cdg.layer('CDG'))
+        return self.pdgs[funcname]
 
     @timer
     def construct_pdg(self) -> None:
-        for funcname, cfg in self.cfgs.items():
+        for funcname in self.functions:
             print(f'constructing PDG for {funcname:>40}', end='\r')
-            ddg, cdg = self.ddg.ddgs[funcname], self.cdg.cdgs[funcname]
-            self.pdgs[funcname] = copy.deepcopy(cfg)
-            self.pdgs[funcname].delete_edges(self.pdgs[funcname].get_edgelist())
-            for ddg_edge in ddg.es:
-                src, tgt, label = ddg_edge.source, ddg_edge.target, ddg_edge['label']
-                self.pdgs[funcname].add_edge(src, tgt, label=label, type='DDG')
-            for cdg_edge in cdg.es:
-                src, tgt = cdg_edge.source, cdg_edge.target
-                self.pdgs[funcname].add_edge(src, tgt, label='', type='CDG')
+            self.function(funcname)
         print(f'{"finish constructing PDG":-^70}')
 
-    def print_graph(self, graph: Graph) -> None:
+    def reachable_functions(self, funcnames: Iterable[str], hops: int) -> List[str]:
+        '''funcnames以及从它们出发不超过hops次调用能到达的函数，按广度优先的顺序，不在代码中的函数名被忽略'''
+        reached = dict.fromkeys(funcname for funcname in funcnames if funcname in self.functions)
+        frontier = list(reached)
+        for _ in range(hops):
+            callees = []
+            for funcname in frontier:
+                for call_site in self.cg.function_properties(funcname)['call_sites']:
+                    if call_site['callee_name'] not in reached:
+                        reached[call_site['callee_name']] = None
+                        callees.append(call_site['callee_name'])
+            frontier = callees
+        return list(reached)
+
+    def print_graph(self, graph: Union[CompactGraph, Graph]) -> None:
+        graph = as_igraph(graph)
         for node in graph.vs:
             print(node.index, node.attributes())
         for edge in graph.es:
@@ -41,38 +74,47 @@ class PDG(CFG):
         print('---------------------------------')
     
     @timer
-    def interprocedual_analysis(self, save: bool = False) -> None:  # 进行跨函数分析，加上了call边和return边，其中call边为第i个实参所使用的变量到第i个形参，return边为返回值到调用点
+    def interprocedual_analysis(self, 
+        save: bool = False, 
+        functions: Optional[List[str]] = None, 
+        hops: int = 3
+    ) -> None:  # 进行跨函数分析，加上了call边和return边，其中call边为第i个实参所使用的变量到第i个形参，return边为返回值到调用点
+        # functions为None时分析所有函数，否则只分析functions以及hops次调用以内的函数，其他函数不会被构建
         print(f'{"constructing interprocedual PDG":-^70}')
-        edges, e_properties = [], {'type':[], 'label':[]}
-        ipdg = Graph(directed=True)
-        pdgs = list(self.pdgs.values())
-        ipdg = pdgs[0].union(pdgs[1:])
-        for funcname, properties in self.cg.func_properties.items():
-            call_sites = properties['call_sites']
+        funcnames = list(self.functions) if functions is None else self.reachable_functions(functions, hops)
+        pdgs = {funcname: self.function(funcname) for funcname in funcnames}
+        edges = {'CALL': [], 'RETURN': []}
+        labels = {'CALL': [], 'RETURN': []}
+        ipdg = CompactGraph.concat(list(pdgs.values()), self.store)   # 所有函数的PDG依次排列，顶点和边都不复制属性
+        offsets = dict(zip(pdgs, np.cumsum([0] + [pdg.vcount() for pdg in pdgs.values()]).tolist()))
+        vertices = {str(id): v for v, id in enumerate(ipdg.nodes['id'].tolist()) if id}   # node.id -> ipdg中的顶点
+        for funcname in pdgs:
+            call_sites = self.cg.function_properties(funcname)['call_sites']
             for call_site in call_sites:
                 callee_name, arguments, line = call_site['callee_name'], call_site['arguments'], call_site['callee_line']
-                callee_properties = self.cg.func_properties[callee_name]
-                call_site_nodes = self.pdgs[funcname].vs.select(lambda x: x['line'] == line)
+                if callee_name not in pdgs:     # 超过hops次调用的函数
+                    continue
+                callee_properties = self.cg.function_properties(callee_name)
+                call_site_nodes = pdgs[funcname].select(line)
                 if len(call_site_nodes) == 0:
                     continue
-                call_site_id = call_site_nodes[0]['id']
+                call_site_node = offsets[funcname] + call_site_nodes[0]
                 callee_parameters = callee_properties['parameters']
                 for i, ids in enumerate(arguments):
                     for id in ids:
                         if i > len(callee_parameters) - 1:
                             print(call_site['callee_code'])
                             print(callee_name, callee_parameters, arguments, i, ids, line)
-                        edges.append((call_site_id, callee_parameters[i]['param_id']))
-                        e_properties['type'].append('CALL')
-                        e_properties['label'].append(id)
+                        edges['CALL'].append((call_site_node, vertices[callee_parameters[i]['param_id']]))
+                        labels['CALL'].append(id)
                 for return_node_id in callee_properties['return_node_ids']:
-                    edges.append((return_node_id['return_node_id'], call_site_id))
-                    e_properties['type'].append('RETURN')
-                    e_properties['label'].append(return_node_id['return_var'])
-        ipdg.add_edges(edges, e_properties)
-        self.ipdg = ipdg
+                    edges['RETURN'].append((vertices[return_node_id['return_node_id']], call_site_node))
+                    labels['RETURN'].append(return_node_id['return_var'])
+        layers = {kind: self.store.edge_layer(ipdg.vcount(), edges[kind], labels[kind]) for kind in edges}
+        self.ipdg = ipdg.overlay(['DDG', 'CDG', 'CALL', 'RETURN'], **layers).to_igraph()     # 切片使用igraph接口
 
-    def draw_graph(self, graph: Graph) -> Digraph:
+    def draw_graph(self, graph: Union[CompactGraph, Graph]) -> Digraph:
+        graph = as_igraph(graph)
         dot = Digraph()
         for node in graph.vs:
             label = html.escape(node['text']) + '\\n' + f"{node['type']} | {node['line']}"
@@ -16,20 +16,39 @@ def sortedNodesByLoc(list_node):
     return list_ordered_nodes
 
 class SLICE(PDG):
-    edges: Set = set()
-    visit_id: Set[int] = set()
-    result_nodes: List = []
-    slice: Graph = Graph(directed=True)
+    edges: Set
+    visit_id: Set[int]
+    result_nodes: List
+    slice: Graph
 
-    def __init__(self, language: str, code: str):
-        self.pdg = PDG(language, code)
-        self.pdg.construct_pdg()
-        self.pdg.interprocedual_analysis()
+    def __init__(self, 
+        language: str, 
+        code: str, 
+        functions: Optional[List[str]] = None, 
+        hops: int = 3
+    ):
+        # functions不为None时只构建这些函数以及hops次调用以内的函数的PDG，例如diff块所在的函数
+        self.edges = set()
+        self.visit_id = set()
+        self.result_nodes = []
+        self.slice = Graph(directed=True)
+        self.pdg = PDG(language, code, lazy=functions is not None)
+        if functions is None:
+            self.pdg.construct_pdg()
+        self.pdg.interprocedual_analysis(functions=functions, hops=hops)
         # self.pdg.ipdg = pickle.load(open('ipdg.pkl', 'rb'))
         # dot = self.draw_graph(self.pdg.ipdg)
         # dot.render('pdf/ipdg', view=True, cleanup=True, format='pdf')
         # self.pdg.ipdg = pickle.load(open('ipdg.pkl', 'rb'))
 
+    def close(self) -> None:
+        # 切片的结果和self.pdg一起释放
+        self.pdg.close()
+        self.edges = set()
+        self.visit_id = set()
+        self.result_nodes = []
+        self.slice = None
+
     def spread(self, 
         node: Node, 
         cross_time: int,    # 跨函数层数
@@ -81,6 +100,23 @@ class SLICE(PDG):
         # input()
         return
 
+    def dominated_lines(self, 
+        funcname: str, 
+        line: int, 
+        candidates: Iterable[int], 
+        post: bool = False
+    ) -> List[int]:
+        # candidates中被第line行的语句支配（post为True时为后支配）的行，每次判断都是O(1)，用于快速筛选候选语句
+        cdg = self.pdg.cdg
+        tree = cdg.post_dominator_tree(funcname) if post else cdg.dominator_tree(funcname)
+        v = cdg.statement(funcname, line)
+        lines = []
+        for candidate in candidates:
+            u = cdg.statement(funcname, candidate)
+            if v >= 0 and u >= 0 and tree.dominates(v, u):
+                lines.append(candidate)
+        return lines
+
     @timer
     def get_slice(self, startlines, max_cross_time=3):
         startnodes = self.pdg.ipdg.vs.select(lambda x: x['line'] in startlines)
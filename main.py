@@ -29,33 +29,34 @@ if __name__ == '__main__':
                 old_code = r'{}'.format(open(old_file_path, 'r', encoding='utf-8').read())
                 new_code = r'{}'.format(open(new_file_path, 'r', encoding='utf-8').read())
                 # 获取切片起始位置
-                diff = DIFF('c',old_code,new_code,diff_path)
-                print(diff)
-                # cve_result_path = os.path.join(RESULT_PATH,software,cve)
-                # if not os.path.exists(cve_result_path): os.makedirs(cve_result_path)
-                if len(diff.old_cv) !=0:
-                    code = old_code
-                    cv_dict = diff.old_cv
-                else:
-                    code = new_code
-                    cv_dict = diff.new_cv
+                with DIFF('c',old_code,new_code,diff_path) as diff:   # 处理完这个CVE后释放语法树
+                    print(diff)
+                    # cve_result_path = os.path.join(RESULT_PATH,software,cve)
+                    # if not os.path.exists(cve_result_path): os.makedirs(cve_result_path)
+                    if len(diff.old_cv) !=0:
+                        code = old_code
+                        cv_dict = diff.old_cv
+                    else:
+                        code = new_code
+                        cv_dict = diff.new_cv
                 
-                if len(cv_dict.keys()) == 0:
-                    logging.error(f'this diff has no cv {diff_path}')
-                    continue
-                # 将diff中提取的关键变量记录到之前数据结果下
-                diff_result_path = os.path.join(file_path,'cv.json')
-                with open(diff_result_path,'w') as cv_file:
-                    json.dump(diff.to_json(),cv_file)
+                    if len(cv_dict.keys()) == 0:
+                        logging.error(f'this diff has no cv {diff_path}')
+                        continue
+                    # 将diff中提取的关键变量记录到之前数据结果下
+                    diff_result_path = os.path.join(file_path,'cv.json')
+                    with open(diff_result_path,'w') as cv_file:
+                        json.dump(diff.to_json(),cv_file)
                 
-                # 开始切片
+                    # 开始切片
                 
-                #     continue
-                # else:
-                #     slice = SLICE('c',code)
-                #     slice_result_path = os.path.join(cve_result_path,'slice')
-                #     slice.get_slice(cv_dict.keys(),slice_result_path)
-                #     slice.pdg.see_graph(cve_result_path)
+                    #     continue
+                    # else:
+                    #     func_names = diff.func_names if code is old_code else diff.changed_functions
+                    #     slice = SLICE('c',code,functions=func_names)   # 只分析diff块所在的函数以及它们调用的函数
+                    #     slice_result_path = os.path.join(cve_result_path,'slice')
+                    #     slice.get_slice(cv_dict.keys(),slice_result_path)
+                    #     slice.pdg.see_graph(cve_result_path)
             else:
                 print("mising old, new or diff file!")
                 continue
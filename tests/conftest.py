@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 仓库中的模块是平铺的（from CFG import *），测试时把仓库根目录加入sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# tree-sitter的语法库路径（./tree-sitter-c、./build）是相对仓库根目录的
+os.chdir(sys.path[0])
@@ -0,0 +1,77 @@
+import pytest
+
+from PDG import *
+
+
+@pytest.mark.parametrize('path, steps', [
+    ('s', ['s']),
+    ('s.a', ['s', '.a']),
+    ('p->x', ['p', '->x']),
+    ('a->b.c[i]', ['a', '->b', '.c', '[i]']),
+    ('a[b->c].d', ['a', '[b->c]', '.d']),
+    ('(p->q).r', ['(p->q)', '.r']),
+    ('arr[i][j]', ['arr', '[i]', '[j]']),
+])
+def test_split_access_path(path, steps):
+    assert split_access_path(path) == steps
+    assert ''.join(steps) == path
+
+
+def test_prefixes_and_descendants():
+    paths = AccessPaths()
+    s, sa, sab, p, px, other = paths['s'], paths['s.a'], paths['s.a.b'], paths['p'], paths['p->x'], paths['sa']
+    assert len({s, sa, sab, p, px, other}) == 6
+    assert paths['s.a'] == sa and paths['s'] == s     # 同一条访问路径只编号一次
+    assert paths.prefixes(sab) == [sab, sa, s]
+    assert paths.prefixes(px) == [px, p]
+    assert paths.prefixes(other) == [other]           # sa不是s的成员
+    assert paths.prefixes(0) == []
+    assert sorted(paths.descendants(s)) == sorted([s, sa, sab])
+    assert paths.descendants(px) == [px]
+    assert paths.decode(paths.prefixes(sab)) == ['s.a.b', 's.a', 's']
+    assert paths.parents[s] == 0 and paths.parents[px] == p
+
+
+def test_find_and_step_do_not_duplicate():
+    paths = AccessPaths()
+    assert paths.find('p->x') is None
+    px = paths['p->x']
+    size = len(paths)
+    assert paths.find('p') == paths.parents[px]       # 前缀在拆分时已经编号
+    assert paths.step(paths['p'], '->x') == px
+    assert paths['p->x'] == px
+    assert len(paths) == size
+    assert paths.find('p.x') is None
+
+
+CODE = '''
+struct S { int a; int b; };
+int f(struct S s, int sa, struct S *p) {
+    s.a = 1;
+    int t = s.b + sa;
+    sa = t;
+    p->x = sa;
+    int u = p->x + s.a;
+    return u + sa;
+}
+'''
+
+
+def ddg_edges(pdg: PDG, funcname: str) -> Set[Tuple[int, int, str]]:
+    graph = pdg.function(funcname)
+    return {(graph.line(source), graph.line(target), label) for source, target, label, kind in graph.edges() if kind == 'DDG'}
+
+
+def test_ddg_matches_statements_by_access_path():
+    with PDG('c', CODE) as pdg:
+        edges = ddg_edges(pdg, 'f')
+        names = pdg.ddg.def_uses.names
+        # s.a的前缀是s，sa和s没有关系
+        assert names.prefixes(names['s.a'])[-1] == names['s']
+        assert names['s'] not in names.prefixes(names['sa'])
+        assert (3, 4, 's') in edges         # 第4行只提到s.a，变量s按前缀匹配到这一行
+        assert (4, 8, 's.a') in edges
+        assert (4, 5, 'sa') not in edges and (4, 6, 'sa') not in edges
+        assert (6, 7, 'sa') in edges
+        assert (7, 8, 'p->x') in edges
+        assert all(label in names.ids for _, _, label in edges)
@@ -0,0 +1,238 @@
+from typing import List, Tuple
+
+import pytest
+
+from CFG import *
+
+
+class RecursiveCFG(CFG):
+    '''显式栈之前的递归版create_cfg，每条语句递归一次并拼接子语句的CFG列表，跳转目标和现在一样由self.jumps给出'''
+
+    def create_cfg(self, node: Node, in_nodes: Nodes = [()]) -> Tuple[CFG_GRAPH, Nodes]:
+        if node.type == 'labeled_statement':
+            node_info = self.properties(node)
+            cfg, out_nodes = self.create_cfg(node.children[2], [(node_info, '')])
+            return [(node_info, get_edge(in_nodes))] + cfg, out_nodes
+        if node.child_count == 0:
+            return [], in_nodes
+        if node.type == 'function_definition':
+            CFG = []
+            func_node_info = self.properties(node)
+            last_node_info = func_node_info
+            for param_node in self.query(node, types='parameter_declaration', nest=False):
+                param_node_info = self.properties(param_node)
+                CFG.append((param_node_info, [(last_node_info['id'], '')]))
+                last_node_info = param_node_info
+            body_CFG, _ = self.create_cfg(node.child_by_field_name('body'), [(last_node_info, '')])
+            return body_CFG + CFG + [(func_node_info, [])], []
+        elif node.type == 'compound_statement' or node.type in ['preproc_if', 'preproc_ifdef']:
+            CFG = []
+            children = node.children if node.type == 'compound_statement' else node.children[2:]
+            for child in children:
+                cfg, in_nodes = self.create_cfg(child, in_nodes)
+                CFG.extend(cfg)
+            return CFG, in_nodes
+        elif 'preproc' in node.type:
+            return [], in_nodes
+        elif node.type not in ['if_statement', 'while_statement', 'for_statement', 'switch_statement', 'case_statement', 'translation_unit', 'do_statement']:
+            node_info = self.properties(node)
+            CFG = [(node_info, get_edge(in_nodes))]
+            if node.type in ['return_statement', 'break_statement', 'continue_statement']:
+                return CFG, []
+            elif node.type == 'goto_statement':
+                if node.id in self.jumps.gotos:
+                    CFG.append((self.properties(self.jumps.gotos[node.id]), [(str(node.id), '')]))
+                return CFG, []
+            return CFG, [(node_info, '')]
+        elif node.type == 'if_statement':
+            node_info = self.properties(node)
+            CFG = [(node_info, get_edge(in_nodes))]
+            cfg, out_nodes = self.create_cfg(node.child_by_field_name('consequence'), [(node_info, 'True')])
+            CFG.extend(cfg)
+            alternate = node.child_by_field_name('alternative')
+            if alternate:
+                cfg, al_out_nodes = self.create_cfg(alternate.children[1], [(node_info, 'False')])
+                CFG.extend(cfg)
+                return CFG, out_nodes + al_out_nodes
+            return CFG, out_nodes + [(node_info, 'False')]
+        elif node.type in ['for_statement', 'while_statement']:
+            node_info = self.properties(node)
+            CFG = [(node_info, get_edge(in_nodes))]
+            cfg, out_nodes = self.create_cfg(node.child_by_field_name('body'), [(node_info, 'True')])
+            CFG.extend(cfg)
+            for parent, label in out_nodes:
+                CFG.append((node_info, [(parent['id'], label)]))
+            out_nodes = [(node_info, 'False')]
+            for break_node in self.jumps.breaks.get(node.id, []):
+                out_nodes.append((self.properties(break_node), ''))
+            for continue_node in self.jumps.continues.get(node.id, []):
+                CFG.append((node_info, [(str(continue_node.id), '')]))
+            return CFG, out_nodes
+        elif node.type == 'do_statement':
+            node_info = self.properties(node)
+            body = node.child_by_field_name('body')
+            first_node = self.properties(body.children[1]) if body.child_count > 2 else node_info
+            CFG = [(first_node, get_edge(in_nodes))]
+            cfg, out_nodes = self.create_cfg(body, [])
+            CFG.extend(cfg)
+            CFG.append((node_info, get_edge(out_nodes)))
+            CFG.append((first_node, [(node_info['id'], 'True')]))
+            out_nodes = [(node_info, 'False')]
+            for break_node in self.jumps.breaks.get(node.id, []):
+                out_nodes.append((self.properties(break_node), ''))
+            for continue_node in self.jumps.continues.get(node.id, []):
+                CFG.append((node_info, [(str(continue_node.id), '')]))
+            return CFG, out_nodes
+        elif node.type == 'switch_statement':
+            switch_node_info = self.properties(node)
+            CFG = [(switch_node_info, get_edge(in_nodes))]
+            in_nodes = [(switch_node_info, '')]
+            out_nodes = []
+            for case_node in self.jumps.cases.get(node.id, []):
+                if case_node.children[0].type == 'case':
+                    index, case_name = 3, self.text(case_node.child_by_field_name('value'))
+                else:
+                    index, case_name = 2, 'default'
+                case_node_info = self.properties(case_node)
+                in_nodes = [(case_name_info, case_name if case_name_info is switch_node_info else label) for case_name_info, label in in_nodes]
+                CFG.append((case_node_info, get_edge(in_nodes)))
+                in_nodes = [(case_node_info, '')]
+                out_nodes = []
+                for child in case_node.children[index:]:
+                    cfg, out_nodes = self.create_cfg(child, in_nodes)
+                    CFG.extend(cfg)
+                    in_nodes = out_nodes
+                in_nodes = out_nodes + [(switch_node_info, '')]
+            all_out_nodes = [(self.properties(break_node), '') for break_node in self.jumps.breaks.get(node.id, [])]
+            return CFG, all_out_nodes + out_nodes
+        return [], []
+
+
+CASES = {
+    'nested_if_while': '''
+int f(int a, int b) {
+    int s = 0;
+    while (a > 0) {
+        if (a % 2) {
+            while (b > 0) {
+                if (b == 3) s++;
+                else if (b == 5) { s--; }
+                else s += 2;
+                b--;
+            }
+        } else {
+            s = s * 2;
+        }
+        a--;
+    }
+    for (int i = 0; i < a; i++) { if (i) continue; s++; }
+    return s;
+}''',
+    'goto_label': '''
+int f(int n) {
+    int i = 0;
+again:
+    i++;
+    if (i < n) goto again;
+    if (i > 100) goto out;
+    i = i * 2;
+    goto again;
+dead:
+    i = 0;
+out:
+    return i;
+}''',
+    'switch_fallthrough': '''
+int f(int x, int y) {
+    int r = 0;
+    switch (x) {
+    case 1:
+        r = 1;
+    case 2:
+        r += 2;
+        break;
+    case 3: {
+        switch (y) {
+        case 0: r = 7; break;
+        default: r = 8;
+        }
+    }
+    case 4:
+        if (y) break;
+        r = 4;
+    default:
+        r = -1;
+    }
+    return r;
+}''',
+    'do_while_break_continue': '''
+int f(int n) {
+    int s = 0;
+    do {
+        n--;
+        if (n == 3) continue;
+        if (n < 0) break;
+        do {
+            s++;
+            if (s > 10) break;
+        } while (s < n);
+        while (s > 100) { s--; if (s == 50) continue; break; }
+    } while (n > 0);
+    do { } while (0);
+    return s;
+}''',
+}
+
+
+def entries(cfg: CFG_GRAPH) -> List[Tuple[str, str, List[Tuple[str, str]]]]:
+    return [(info['id'], info['type'], list(edges)) for info, edges in cfg]
+
+
+def build(ast: RecursiveCFG, func_node: Node, create_cfg) -> Tuple[CFG_GRAPH, CompactGraph]:
+    ast.func_num = 0
+    ast.node_infos = {}
+    ast.jumps = ast.jump_targets(func_node)
+    cfg, _ = create_cfg(ast, func_node)
+    return cfg, ast.convert_cfg_to_graph(cfg)
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_explicit_stack_matches_recursive_builder(name):
+    ast = RecursiveCFG('c', CASES[name])
+    func_node = ast.functions['f']
+    stack_cfg, stack_graph = build(ast, func_node, CFG.create_cfg)
+    recursive_cfg, recursive_graph = build(ast, func_node, RecursiveCFG.create_cfg)
+    assert entries(stack_cfg) == entries(recursive_cfg)
+    assert stack_graph.attributes() == recursive_graph.attributes()
+    assert list(stack_graph.edges()) == list(recursive_graph.edges())
+
+
+def test_deep_nesting_does_not_recurse():
+    depth = 3000    # 远超过Python默认的递归深度
+    code = 'int f(int x) {' + 'if (x) {' * depth + 'x++;' + '}' * depth + 'return x; }'
+    ast = CFG('c', code)
+    graph = ast.function_cfg('f')
+    assert graph.vcount() >= depth
+
+
+def test_case_nested_in_loop():
+    # Duff's device：do循环体中的case由switch跳入，循环体在case处不能断开
+    code = '''void f(int *to, int *from, int c, int n) {
+    switch (c % 8) {
+    case 0: do { *to = *from++;
+    case 7:      *to = *from++;
+    case 1:      *to = *from++;
+            } while (--n > 0);
+    }
+}'''
+    ast = CFG('c', code)
+    graph = ast.function_cfg('f')
+    edges = [(graph.type(source), graph.line(source), graph.type(target), graph.line(target), label) for source, target, label, _ in graph.edges()]
+    assert ('expression_statement', 5, 'do_statement', 3, '') in edges         # 循环体的最后一条语句到循环条件
+    assert ('do_statement', 3, 'expression_statement', 3, 'True') in edges     # 回到循环体的第一条语句
+    assert ('do_statement', 3, 'function_exit', None, 'False') in edges
+    for line, name in [(4, '7'), (5, '1')]:
+        assert ('switch_statement', 2, 'case_statement', line, name) in edges   # switch直接跳到嵌套的case
+        assert ('expression_statement', line - 1, 'case_statement', line, '') in edges   # 上一条语句顺序执行到case
+        assert ('case_statement', line, 'expression_statement', line, '') in edges
+    assert [graph.line(v) for v in range(graph.vcount()) if graph.type(v) == 'expression_statement'] == [3, 4, 5]
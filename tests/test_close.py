@@ -0,0 +1,75 @@
+import contextlib
+import gc
+import os
+import tracemalloc
+
+import pytest
+
+from SLICE import *
+
+CODE = '''
+struct node { int value; struct node *next; };
+
+int sum(struct node *p) {
+    int s = 0;
+    while (p) {
+        if (p->value > 0) s += p->value;
+        else break;
+        p = p->next;
+    }
+    return s;
+}
+
+int scale(struct node *p, int k) {
+    int s = sum(p);
+    switch (k) {
+    case 0: return 0;
+    case 1: break;
+    default: s = s * k;
+    }
+    return s;
+}
+
+int main(int argc, char **argv) {
+    struct node n = {argc, 0};
+    int r = scale(&n, argc);
+    for (int i = 0; i < r; i++) r -= sum(&n);
+    return r;
+}
+'''
+
+
+def build_pdg() -> None:
+    with PDG('c', CODE) as pdg:
+        pdg.interprocedual_analysis()
+
+
+def build_slice() -> None:
+    with SLICE('c', CODE) as slicer:
+        assert slicer.pdg.ipdg.vcount() > 0
+
+
+def build_slice_closed() -> None:
+    slicer = SLICE('c', CODE, functions=['scale'])
+    slicer.close()
+
+
+@pytest.mark.parametrize('build', [build_pdg, build_slice, build_slice_closed])
+def test_close_releases_memory(build):
+    # 构建过程中的进度输出不计入，pytest捕获的输出会一直留在内存里
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # 预热：解析器、语法库以及numpy、igraph内部的缓存只在前几次使用时分配
+        for _ in range(20):
+            build()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            for _ in range(50):
+                build()
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    # 每次构建要分配约200KB，close之后应该全部释放，50次构建累积的增长不超过64KB
+    assert current - baseline < 64 * 1024
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from DDG import *
+
+
+def as_dict(state: DataflowState) -> Dict[int, FrozenSet[int]]:
+    return dict(state.items())
+
+
+def random_defs(rng: random.Random) -> FrozenSet[int]:
+    return frozenset(rng.sample(range(1, 40), rng.randint(0, 3)))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_set_get_matches_dict(seed):
+    rng = random.Random(seed)
+    state, model = DataflowState(), {}
+    history = []
+    for _ in range(300):
+        key = rng.choice([rng.randrange(TRIE_WIDTH), rng.randrange(TRIE_WIDTH ** 3), rng.randrange(1 << 20)])
+        value = random_defs(rng)
+        history.append((state, dict(model)))
+        state = state.set(key, value)
+        if value:
+            model[key] = value
+        else:
+            model.pop(key, None)
+        assert state.get(key) == value
+    assert as_dict(state) == model
+    for key in list(model) + [rng.randrange(1 << 22) for _ in range(50)]:
+        assert state.get(key) == model.get(key, NO_DEFS)
+    # 持久化：之前的状态不受之后set的影响
+    for old_state, old_model in history[::25]:
+        assert as_dict(old_state) == old_model
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_merge_matches_dict_union(seed):
+    rng = random.Random(seed)
+    base = DataflowState()
+    for _ in range(rng.randint(0, 50)):
+        base = base.set(rng.randrange(200), random_defs(rng))
+    states = []
+    for _ in range(4):
+        state = base
+        for _ in range(rng.randint(0, 20)):
+            state = state.set(rng.choice([rng.randrange(200), rng.randrange(1 << 15)]), random_defs(rng))
+        states.append(state)
+    for left in states:
+        for right in states:
+            merged = left.merge(right)
+            expected = {}
+            for key, value in list(left.items()) + list(right.items()):
+                expected[key] = expected.get(key, NO_DEFS) | value
+            assert as_dict(merged) == expected
+
+
+def test_merge_shares_unchanged_state():
+    state = DataflowState().set(3, frozenset([1])).set(1000, frozenset([2]))
+    assert state.merge(DataflowState()) is state
+    assert DataflowState().merge(state) is state
+    assert state.merge(state) is state
+    smaller = state.set(3, frozenset())
+    assert state.merge(smaller) is state
+    assert smaller.merge(state) is state
+    larger = state.set(3, frozenset([1, 5]))
+    assert state.merge(larger) is larger
+
+
+def test_trie_set_and_merge_leave_inputs_unchanged():
+    shift = TRIE_BITS
+    left = trie_set(None, shift, 40, frozenset([1]))
+    right = trie_set(left, shift, 7, frozenset([2]))
+    assert left[1][8] == frozenset([1]) and left[0] is None
+    assert right[1] is left[1]      # 没有修改的子树共用
+    assert right[0][7] == frozenset([2])
+    assert trie_merge(left, right, shift) is right
+    assert trie_merge(right, left, shift) is right
+    assert trie_merge(left, None, shift) is left
+    other = trie_set(None, shift, 40, frozenset([3]))
+    merged = trie_merge(left, other, shift)
+    assert merged[1][8] == frozenset([1, 3])
+    assert left[1][8] == frozenset([1]) and other[1][8] == frozenset([3])
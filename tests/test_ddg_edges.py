@@ -0,0 +1,93 @@
+import pytest
+
+from DDG import *
+
+
+def linear_scan(records: Set[Tuple[str, int, int]], graph: CompactGraph) -> Dict[Tuple[int, int], str]:
+    '''按行号索引之前的做法：每条记录在select(line)中找第一个文本包含变量名的顶点'''
+    def statement(varname: str, line: int) -> Optional[int]:
+        for v in graph.select(line):
+            if varname in graph.text(v):
+                return v
+        return None
+    edges = {}
+    for varname, line1, line2 in records:
+        def_node, use_node = statement(varname, line1), statement(varname, line2)
+        if def_node is None or use_node is None or def_node == use_node:
+            continue
+        edges.setdefault((def_node, use_node), varname)
+    return edges
+
+
+class RecordingDDG(DDG):
+    '''每个函数的记录同时用行号索引和线性扫描转换成边，保存两种结果'''
+    def __init__(self, cfg: CFG, engine: Literal['ast', 'worklist'] = 'ast'):
+        super().__init__(cfg, engine)
+        self.results: Dict[str, Tuple[Dict[Tuple[int, int], str], Dict[Tuple[int, int], str]]] = {}
+
+    def convert_dict_to_ddg(self, graph: CompactGraph) -> EdgeLayer:
+        layer = super().convert_dict_to_ddg(graph)
+        indexed = {(source, target): graph.store.string(label) for source, target, label in zip(layer.sources().tolist(), layer.targets.tolist(), layer.labels.tolist())}
+        self.results[graph.text(graph.find('function_definition')).split('(')[0].split()[-1]] = (indexed, linear_scan(self.dict, graph))
+        return layer
+
+
+CODE = '''
+struct buf { int len; char *data; };
+
+int copy(struct buf *dst, struct buf *src, int limit) {
+    int count = 0; int total = src->len;
+    if (total > limit) total = limit;
+    while (count < total) {
+        dst->data[count] = src->data[count]; count++;
+    }
+    dst->len = count;
+    return count;
+}
+
+int checksum(char *data, int length) {
+    int value = 0, index;
+    for (index = 0; index < length; index++) {
+        value = value * 31 + data[index];
+        if (value < 0) { value = -value; continue; }
+    }
+    switch (length) {
+    case 0: return -1;
+    default: value ^= length;
+    }
+    return value;
+}
+
+int run(int argc, char **argv) {
+    struct buf first, second;
+    first.len = argc; first.data = argv[0];
+    int copied = copy(&second, &first, argc);
+    int result = checksum(second.data, copied);
+    return result;
+}
+'''
+
+
+@pytest.mark.parametrize('engine', ['ast', 'worklist'])
+def test_line_index_matches_linear_scan(engine):
+    with CFG('c', CODE) as cfg:
+        ddg = RecordingDDG(cfg, engine)
+        for funcname in cfg.functions:
+            ddg.function_ddg(funcname)
+        assert set(ddg.results) == {'copy', 'checksum', 'run'}
+        for funcname, (indexed, scanned) in ddg.results.items():
+            assert indexed, funcname
+            assert indexed == scanned, funcname
+
+
+def test_line_index_ignores_substring_matches():
+    # 线性扫描按子串匹配，同一行先出现的ab会被当成提到b的语句；行号索引按访问路径匹配
+    code = 'int f(int b) {\n    int ab = 1; int c = b;\n    return c + ab;\n}'
+    with CFG('c', code) as cfg:
+        ddg = RecordingDDG(cfg)
+        graph = cfg.function_cfg('f')
+        ddg.function_ddg('f')
+        indexed, scanned = ddg.results['f']
+        use = {graph.text(target) for (source, target), label in indexed.items() if label == 'b'}
+        assert use == {'int c = b;'}
+        assert {graph.text(target) for (source, target), label in scanned.items() if label == 'b'} == {'int ab = 1;'}
@@ -0,0 +1,119 @@
+import pytest
+
+from DDG import *
+
+
+class RecordingDDG(DDG):
+    '''保存每个函数转换成边之前的(变量, 定义行, 使用行)记录'''
+    def __init__(self, cfg: CFG, engine: Literal['ast', 'worklist'] = 'ast'):
+        super().__init__(cfg, engine)
+        self.records: Set[Tuple[str, int, int]] = set()
+
+    def convert_dict_to_ddg(self, graph: CompactGraph) -> EdgeLayer:
+        self.records = set(self.dict)
+        return super().convert_dict_to_ddg(graph)
+
+
+def records(code: str, engine: Literal['ast', 'worklist']) -> Set[Tuple[str, int, int]]:
+    with CFG('c', code) as cfg:
+        ddg = RecordingDDG(cfg, engine)
+        ddg.function_ddg('f')
+        return ddg.records
+
+
+SAME = {
+    'straight_line': '''int f(int a, int b) {
+    int c = a + b;
+    int d = c * 2;
+    a = d - c;
+    b = a + d;
+    return a + b;
+}''',
+    'if_else': '''int f(int a, int b) {
+    int c = 0;
+    if (a > b) {
+        c = a;
+        b = c + 1;
+    } else if (a < 0) {
+        c = b;
+    } else {
+        a = -a;
+    }
+    return a + b + c;
+}''',
+    'for_loop': '''int f(int n) {
+    int s = 0;
+    for (int i = 0; i < n; i++) {
+        s = s + i;
+    }
+    return s;
+}''',
+}
+
+
+@pytest.mark.parametrize('name', list(SAME))
+def test_engines_agree(name):
+    ast_records = records(SAME[name], 'ast')
+    assert ast_records
+    assert records(SAME[name], 'worklist') == ast_records
+
+
+# 两种引擎有意不同的地方，每种一个最小的例子：(代码, 只有ast引擎有的记录, 只有worklist引擎有的记录)
+# ast引擎沿语法树递归，不够精确；worklist引擎在CFG上求到达定义
+DIVERGENT = {
+    # return之后的定义不应该再到达后面的语句
+    'def_past_return': ('''int f(int a) {
+    int x = 0;
+    if (a) {
+        x = 1;
+        return x;
+    }
+    return x + a;
+}''', {('x', 4, 7)}, set()),
+    # break之后的定义到达循环之后的语句，而不是循环体中break后面的语句；循环体中的定义到达循环条件
+    'def_past_break': ('''int f(int n) {
+    int x = 0;
+    while (n) {
+        if (n == 5) {
+            x = 1;
+            break;
+        }
+        x = 2;
+        n = n - x;
+    }
+    return x;
+}''', {('x', 5, 8)}, {('x', 5, 11), ('n', 9, 3)}),
+    # label后面语句中的使用记在语句所在的行，而不是label的行
+    'label': ('''int f(int a) {
+    int x = a;
+again:
+    x = x + 1;
+    if (x < 10) goto again;
+    return x;
+}''', {('x', 2, 3), ('x', 3, 5), ('x', 3, 6)}, {('x', 2, 4), ('x', 4, 4), ('x', 4, 5), ('x', 4, 6)}),
+    # #if中语句的使用记在语句所在的行，而不是#if的行
+    'preproc_if': ('''int f(int a) {
+    int x = a;
+#if DEBUG
+    x = x + 1;
+#endif
+    return x;
+}''', {('x', 2, 3), ('x', 3, 6)}, {('x', 2, 4), ('x', 4, 6)}),
+    # 循环体中的定义到达while的条件
+    'loop_condition': ('''int f(int n) {
+    int i = 0;
+    while (i < n) {
+        i = i + 1;
+    }
+    return i;
+}''', set(), {('i', 4, 3)}),
+}
+
+
+@pytest.mark.parametrize('name', list(DIVERGENT))
+def test_documented_divergences(name):
+    code, ast_only, worklist_only = DIVERGENT[name]
+    ast_records, worklist_records = records(code, 'ast'), records(code, 'worklist')
+    assert ast_records - worklist_records == ast_only
+    assert worklist_records - ast_records == worklist_only
+    assert ast_records & worklist_records     # 其余的记录相同
@@ -0,0 +1,129 @@
+import pytest
+
+from DIFF import *
+
+OLD = '''int f(int a) {
+    int b = a + 1;
+    return b;
+}
+'''
+
+NEW = '''int f(int a) {
+    int b = a + 2;
+    return b;
+}
+'''
+
+DIFF_TEXT = '''diff --git a/old.c b/new.c
+index 0000000..1111111 100644
+--- a/old.c
++++ b/new.c
+@@ -1,4 +1,4 @@
+ int f(int a) {
+-    int b = a + 1;
++    int b = a + 2;
+     return b;
+ }
+'''
+
+# 和代码对不上的diff：增加的行超出了NEW的末尾
+STALE_DIFF_TEXT = '''diff --git a/old.c b/new.c
+index 0000000..1111111 100644
+--- a/old.c
++++ b/new.c
+@@ -1,4 +1,8 @@
+ int f(int a) {
+-    int b = a + 1;
++    int b = a + 2;
+     return b;
+ }
++
++
++
++int g(void) { return 0; }
+'''
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_changed_functions(tmp_path, incremental):
+    path = tmp_path / 'f.diff'
+    path.write_text(DIFF_TEXT, encoding='utf-8')
+    diff = DIFF('c', OLD, NEW, str(path), incremental=incremental)
+    assert diff.changed_functions == ['f']
+    assert [cv.var for cv in diff.old_cv[2]] == ['b']
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_hunk_past_end_of_code(tmp_path, incremental):
+    path = tmp_path / 'stale.diff'
+    path.write_text(STALE_DIFF_TEXT, encoding='utf-8')
+    diff = DIFF('c', OLD, NEW, str(path), incremental=incremental)
+    length = len(NEW.encode('utf-8'))
+    assert all(0 <= start <= end <= length for start, end in diff.changed_ranges)
+    assert diff.changed_functions == ['f']
+
+
+TWO_FUNCTIONS_OLD = '''int g(int a) {
+    return a;
+}
+int f(int b) {
+    int c = b + 1;
+    return c;
+}
+int pad1(void) { return 1; }
+int pad2(void) { return 2; }
+int pad3(void) { return 3; }
+int h(int d) {
+    int e = d * 2;
+    return e;
+}
+'''
+
+TWO_FUNCTIONS_NEW = TWO_FUNCTIONS_OLD.replace('b + 1', 'b + 2').replace('d * 2', 'd * 3')
+
+# 第一个diff块的上下文从g的结尾开始，修改在f中
+TWO_HUNKS_DIFF_TEXT = '''diff --git a/old.c b/new.c
+index 0000000..1111111 100644
+--- a/old.c
++++ b/new.c
+@@ -3,5 +3,5 @@
+ }
+ int f(int b) {
+-    int c = b + 1;
++    int c = b + 2;
+     return c;
+ }
+@@ -10,5 +10,5 @@
+ int pad3(void) { return 3; }
+ int h(int d) {
+-    int e = d * 2;
++    int e = d * 3;
+     return e;
+ }
+'''
+
+
+@pytest.mark.parametrize('incremental', [False, True])
+def test_hunk_context_starts_in_previous_function(tmp_path, incremental):
+    path = tmp_path / 'two.diff'
+    path.write_text(TWO_HUNKS_DIFF_TEXT, encoding='utf-8')
+    diff = DIFF('c', TWO_FUNCTIONS_OLD, TWO_FUNCTIONS_NEW, str(path), incremental=incremental)
+    assert diff.func_names == ['f', 'h']
+    assert diff.changed_functions == ['f', 'h']
+    assert {line: [cv.var for cv in cvs] for line, cvs in diff.old_cv.items()} == {5: ['c'], 12: ['e']}
+    diff.close()
+
+
+def test_incremental_drops_edited_old_ast(tmp_path):
+    path = tmp_path / 'f.diff'
+    path.write_text(DIFF_TEXT, encoding='utf-8')
+    diff = DIFF('c', OLD, NEW, str(path), incremental=True)
+    assert diff.old_ast is None     # OLD的语法树被edit过，位置不再对应OLD的代码
+    assert diff.dominance('delete').cfg.functions.keys() == {'f'}      # OLD侧需要时重新解析
+    diff.close()
+    stale = tmp_path / 'stale.diff'
+    stale.write_text(STALE_DIFF_TEXT, encoding='utf-8')
+    diff = DIFF('c', OLD, NEW, str(stale), incremental=True)
+    assert diff.old_ast is not None     # diff和代码对不上时没有edit，退回完整解析
+    assert diff.old_ast.functions.keys() == {'f'}
+    diff.close()
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from CDG import *
+
+
+def layer(vcount: int, edges: List[Tuple[int, int]]) -> EdgeLayer:
+    return EdgeLayer.from_edges(vcount, edges)
+
+
+def test_immediate_dominators_root_and_unreachable():
+    # 0 -> 1 -> 3, 0 -> 2 -> 3, 4 -> 5 从0到不了4和5，igraph对根返回-1，对到不了的节点返回NaN
+    idom = immediate_dominators(layer(6, [(0, 1), (0, 2), (1, 3), (2, 3), (4, 5)]), 0)
+    assert idom == [-1, 0, 0, 0, -1, -1]
+    assert all(type(parent) is int for parent in idom)
+    tree = DominatorTree(idom, 0)
+    assert 0 in tree and 3 in tree
+    assert 4 not in tree and 5 not in tree
+    assert not tree.dominates(4, 5) and not tree.dominates(0, 4)
+    assert tree.lca(1, 4) == -1
+    assert tree.lca(1, 2) == 0
+
+
+def test_immediate_post_dominators():
+    # 0 -> 1 -> 3(exit), 0 -> 2 -> 3，2 -> 4 -> 4 为到不了exit的死循环
+    cfg = layer(5, [(0, 1), (0, 2), (1, 3), (2, 3), (2, 4), (4, 4)])
+    ipdom = immediate_post_dominators(cfg.reverse(), 3)
+    assert ipdom == [3, 3, 3, -1, -1]
+
+
+def chain(parents: List[int], v: int) -> List[int]:
+    path = [v]
+    while parents[path[-1]] >= 0:
+        path.append(parents[path[-1]])
+    return path
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_dominator_tree_matches_parent_chains(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 60)
+    root = rng.randrange(n)
+    order = [root] + rng.sample([v for v in range(n) if v != root], n - 1)
+    parents = [-1] * n
+    in_tree = {root}
+    for v in order[1:]:
+        if rng.random() < 0.85:
+            parents[v] = rng.choice(sorted(in_tree))
+            in_tree.add(v)
+    tree = DominatorTree(parents, root)
+    for a in range(n):
+        assert (a in tree) == (a in in_tree)
+        for b in range(n):
+            expected = a in in_tree and b in in_tree and a in chain(parents, b)
+            assert tree.dominates(a, b) == expected
+            if a in in_tree and b in in_tree:
+                ancestors = chain(parents, a)
+                assert tree.lca(a, b) == next(v for v in chain(parents, b) if v in ancestors)
+            else:
+                assert tree.lca(a, b) == -1
+
+
+CODE = '''int f(int a, int b) {
+    int c = 0;
+    if (a > b) {
+        c = a;
+        b = b + 1;
+    } else {
+        c = b;
+    }
+    a = c * 2;
+    if (a)
+        return a;
+    b = a + c;
+    return b;
+dead:
+    a++;
+    goto dead;
+}
+'''
+
+
+def test_real_cfg_unreachable_vertices():
+    with CFG('c', CODE) as cfg:
+        cdg = CDG(cfg)
+        graph = cfg.function_cfg('f')
+        dead = [v for v in range(graph.vcount()) if graph.line(v) in (14, 15, 16)]
+        assert dead     # goto形成的环没有从入口进入的边，不会被当作死代码删除
+        dominators, post_dominators = cdg.dominator_tree('f'), cdg.post_dominator_tree('f')
+        for v in dead:
+            assert v not in dominators          # 从入口到不了
+            assert v not in post_dominators     # 到不了exit
+            assert cdg.dominator_tree('f').lca(v, graph.find('function_definition')) == -1
+        assert not cdg.dominates('f', 2, 15)
+        assert not cdg.post_dominates('f', 16, 14)
+
+
+def test_if_else_diamond():
+    with CFG('c', CODE) as cfg:
+        cdg = CDG(cfg)
+        # 两个分支的最近公共后支配语句为汇合处的第9行
+        assert cdg.common_post_dominator('f', [4, 7]) == 9
+        assert cdg.common_post_dominator('f', [5, 7]) == 9
+        assert cdg.common_post_dominator('f', [3]) == 3     # 每个语句后支配自己
+        assert cdg.common_post_dominator('f', [9]) == 9
+        # 第10行的if之后一个分支return，另一个分支继续，公共后支配节点为exit
+        assert cdg.common_post_dominator('f', [11, 12]) is None
+        assert cdg.common_post_dominator('f', [4, 99]) is None     # 没有语句的行
+        assert cdg.dominates('f', 3, 4) and cdg.dominates('f', 3, 7) and cdg.dominates('f', 3, 9)
+        assert not cdg.dominates('f', 4, 9) and not cdg.dominates('f', 7, 9)
+        assert cdg.post_dominates('f', 9, 3) and cdg.post_dominates('f', 9, 4)
+        assert not cdg.post_dominates('f', 4, 3) and not cdg.post_dominates('f', 12, 10)
+        assert cdg.post_dominates('f', 13, 12)
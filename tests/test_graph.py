@@ -0,0 +1,34 @@
+from SLICE import *
+
+NO_FUNCTIONS = '''
+#include <stdio.h>
+struct point { int x, y; };
+static int counter = 0;
+'''
+
+
+def test_concat_empty():
+    graph = CompactGraph.concat([])
+    assert graph.vcount() == 0
+    assert graph.ecount() == 0
+    assert graph.layers == {}
+    assert graph.store.strings.tokens == [Vocabulary.UNK]
+    assert graph.to_igraph().vcount() == 0
+
+
+def test_concat_keeps_offsets():
+    cfg = CFG('c', 'int f(int a) { if (a) a++; return a; }\nint g(void) { return 0; }')
+    f, g = cfg.function_cfg('f'), cfg.function_cfg('g')
+    graph = CompactGraph.concat([f, g], cfg.store)
+    assert graph.store is cfg.store
+    assert graph.vcount() == f.vcount() + g.vcount()
+    offset = f.vcount()
+    expected = list(f.edges()) + [(source + offset, target + offset, label, kind) for source, target, label, kind in g.edges()]
+    assert list(graph.edges()) == expected
+
+
+def test_file_without_functions():
+    with SLICE('c', NO_FUNCTIONS) as slicer:
+        assert slicer.pdg.functions == {}
+        assert slicer.pdg.ipdg.vcount() == 0
+        assert slicer.pdg.ipdg.ecount() == 0
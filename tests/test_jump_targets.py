@@ -0,0 +1,94 @@
+from CFG import *
+
+CODE = '''int f(int n, int *to, int *from) {
+    int i = 0, j;
+    while (i < n) {
+        for (j = 0; j < n; j++) {
+            if (j == i) continue;
+            switch (to[j]) {
+            case 0:
+                break;
+            case 1:
+                continue;
+            default:
+                do {
+                    if (j) break;
+                    i++;
+                } while (i < j);
+            }
+            if (j > 10) break;
+        }
+        if (i > 100) goto done;
+        i++;
+    }
+    switch (n % 4) {
+    case 0: do { *to++ = *from++;
+    case 3:      *to++ = *from++;
+    case 2:      *to++ = *from++;
+                 if (n < 0) break;
+    case 1:      *to++ = *from++;
+            } while (--n > 0);
+    }
+retry:
+    if (n) goto retry;
+done:
+    return i;
+}
+
+int g(void) {
+    goto done;
+    break;
+done:
+    return 0;
+}
+'''
+
+
+def by_line(targets: Dict[int, List[Node]], cfg: CFG, func_node: Node) -> Dict[int, List[int]]:
+    nodes = {node.id: node for node in cfg.query(func_node, types=JUMP_TYPES, nest=True)}
+    return {nodes[id].start_point[0] + 1: [node.start_point[0] + 1 for node in jumps] for id, jumps in targets.items()}
+
+
+def enclosing(node: Node, types: List[str]) -> Optional[Node]:
+    '''沿父节点向上找到最内层的types节点，原来的get_break_continue_node的做法'''
+    node = node.parent
+    while node is not None and node.type != 'function_definition':
+        if node.type in types:
+            return node
+        node = node.parent
+    return None
+
+
+def test_nested_loops_and_switches():
+    with CFG('c', CODE) as cfg:
+        func_node = cfg.functions['f']
+        jumps = cfg.jump_targets(func_node)
+        assert by_line(jumps.breaks, cfg, func_node) == {6: [8], 12: [13], 4: [17], 23: [26]}   # Duff's device中的break跳出do
+        assert by_line(jumps.continues, cfg, func_node) == {4: [5, 10]}
+        assert by_line(jumps.cases, cfg, func_node) == {6: [7, 9, 11], 22: [23, 24, 25, 27]}   # 在do循环里面的case仍然属于switch
+        assert set(jumps.labels) == {'retry', 'done'}
+        gotos = {cfg.text(node): target.start_point[0] + 1 for node in cfg.query(func_node, types='goto_statement') for target in [jumps.gotos[node.id]]}
+        assert gotos == {'goto done;': 32, 'goto retry;': 30}
+
+
+def test_matches_parent_walk():
+    with CFG('c', CODE) as cfg:
+        for func_node in cfg.functions.values():
+            jumps = cfg.jump_targets(func_node)
+            expected = {'break_statement': {}, 'continue_statement': {}, 'case_statement': {}}
+            rules = {'break_statement': LOOP_TYPES + ['switch_statement'], 'continue_statement': LOOP_TYPES, 'case_statement': ['switch_statement']}
+            for node in cfg.query(func_node, types=list(rules), nest=True):
+                target = enclosing(node, rules[node.type])
+                if target is not None:
+                    expected[node.type].setdefault(target.id, []).append(node.id)
+            for type, targets in [('break_statement', jumps.breaks), ('continue_statement', jumps.continues), ('case_statement', jumps.cases)]:
+                assert {id: [node.id for node in nodes] for id, nodes in targets.items()} == expected[type]
+
+
+def test_targets_do_not_cross_functions():
+    with CFG('c', CODE) as cfg:
+        func_node = cfg.functions['g']
+        jumps = cfg.jump_targets(func_node)
+        assert jumps.breaks == {} and jumps.continues == {} and jumps.cases == {}
+        assert [target.start_point[0] + 1 for target in jumps.gotos.values()] == [39]
+        assert cfg.jump_targets(func_node) is jumps     # 每个函数只计算一次
@@ -0,0 +1,27 @@
+from AST import *
+
+
+def test_save_load_roundtrip(tmp_path):
+    tokens = ['int', 'a\nb', '"\\n"', '', ' ', '中文', '<unk>x', '\r\n']
+    vocab = Vocabulary(tokens)
+    path = str(tmp_path / 'vocab.json')
+    vocab.save(path)
+    loaded = Vocabulary.load(path, frozen=True)
+    assert loaded.tokens == vocab.tokens
+    assert loaded.ids == vocab.ids
+    assert loaded.frozen
+    assert loaded['not seen'] == 0
+
+
+def test_load_empty_file(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text('', encoding='utf-8')
+    loaded = Vocabulary.load(str(path))
+    assert loaded.tokens == [Vocabulary.UNK]
+    assert len(loaded) == 1
+
+
+def test_save_load_empty_vocabulary(tmp_path):
+    path = str(tmp_path / 'vocab.json')
+    Vocabulary().save(path)
+    assert Vocabulary.load(path).tokens == [Vocabulary.UNK]